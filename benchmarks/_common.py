@@ -0,0 +1,112 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def use_temp_workdir():
+    # database.py открывает ./chat_app.db относительно текущего каталога,
+    # поэтому бенчмарки работают во временном каталоге и не трогают рабочую БД.
+    workdir = tempfile.mkdtemp(prefix="chat_bench_")
+    os.chdir(workdir)
+    return workdir
+
+
+def configure_jwt():
+    # Через окружение ключ получают и серверы, запущенные подпроцессами
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+    os.environ.setdefault("JWT_ALGORITHM", "HS256")
+    import dependencies
+    if not dependencies.SECRET_KEY:
+        dependencies.SECRET_KEY = "bench-secret"
+    if not dependencies.ALGORITHM:
+        dependencies.ALGORITHM = "HS256"
+
+
+def seed_users(count, password="secret"):
+    # Пользователи user1..userN с одним и тем же паролем; хеш считается один раз
+    from dependencies import get_password_hash
+    hashed = get_password_hash(password)
+    conn = sqlite3.connect("chat_app.db")
+    conn.executemany(
+        "INSERT INTO users (id, username, password, email) VALUES (?, ?, ?, ?)",
+        [(i, f"user{i}", hashed, f"user{i}@example.com") for i in range(1, count + 1)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@asynccontextmanager
+async def serve(app, port):
+    import uvicorn
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        yield f"127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await task
+
+
+async def probe_pair(host, sender, recipient, stop, samples, interval):
+    import websockets
+    from dependencies import create_access_token
+    sender_token = create_access_token({"sub": f"user{sender}"})
+    recipient_token = create_access_token({"sub": f"user{recipient}"})
+    async with websockets.connect(f"ws://{host}/ws/chat?token={sender_token}") as tx, \
+            websockets.connect(f"ws://{host}/ws/chat?token={recipient_token}") as rx:
+
+        async def receive():
+            async for raw in rx:
+                data = json.loads(raw)
+                if data.get("type") == "personal_message":
+                    samples.append(time.perf_counter() - float(data["content"]))
+
+        receiver = asyncio.create_task(receive())
+        while not stop.is_set():
+            await tx.send(json.dumps({
+                "type": "personal",
+                "recipient_id": recipient,
+                "content": repr(time.perf_counter()),
+            }))
+            await asyncio.sleep(interval)
+        await asyncio.sleep(0.5)
+        receiver.cancel()
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    if not samples:
+        return {f"p{p}": None for p in points}
+    ordered = sorted(samples)
+    result = {}
+    for p in points:
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        result[f"p{p}"] = ordered[index]
+    result["mean"] = statistics.fmean(ordered)
+    return result
+
+
+def format_ms(stats):
+    return "  ".join(
+        f"{name}={value * 1000:.2f}ms" if value is not None else f"{name}=n/a"
+        for name, value in stats.items()
+    )
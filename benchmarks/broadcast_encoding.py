@@ -0,0 +1,82 @@
+"""CPU per group broadcast as the group grows: per-recipient json.dumps vs a shared EncodedFrame.
+
+    python benchmarks/broadcast_encoding.py --sizes 10 100 1000 5000
+
+The shared frame uses orjson when it is installed and falls back to json otherwise.
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+
+import _common  # noqa: F401  (добавляет корень репозитория в sys.path)
+from utils import frames
+from utils.connection import ClientConnection, OverflowPolicy
+from utils.frames import EncodedFrame
+
+
+class NullSocket:
+    async def send_text(self, text):
+        pass
+
+    async def close(self, code=None):
+        pass
+
+
+def make_payload():
+    return {
+        "type": "group_message",
+        "group_id": 42,
+        "group_name": "engineering",
+        "sender_id": 7,
+        "sender_name": "alice",
+        "content": "Deploy finished, dashboards look healthy. " * 4,
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+
+
+def broadcast_per_recipient(connections, payload):
+    for connection in connections:
+        text = json.dumps(payload)
+        connection.queue.put_nowait(text)
+
+
+def broadcast_shared(connections, payload):
+    frame = EncodedFrame(payload)
+    for connection in connections:
+        connection.offer(frame)
+        frame.text
+
+
+def measure(fn, connections, rounds):
+    start = time.process_time()
+    for _ in range(rounds):
+        fn(connections, make_payload())
+        for connection in connections:
+            while not connection.queue.empty():
+                connection.queue.get_nowait()
+    return (time.process_time() - start) / rounds
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"fast encoder: {'orjson' if frames.orjson else 'json'}")
+    print(f"{'members':>8} {'per-recipient':>15} {'shared frame':>14} {'speedup':>8}")
+    for size in args.sizes:
+        connections = [
+            ClientConnection(i, NullSocket(), lambda c: None, queue_size=4, policy=OverflowPolicy.DROP_OLDEST)
+            for i in range(size)
+        ]
+        rounds = max(5, args.rounds * 100 // size)
+        naive = measure(broadcast_per_recipient, connections, rounds)
+        shared = measure(broadcast_shared, connections, rounds)
+        print(f"{size:>8} {naive * 1e6:>13.1f}us {shared * 1e6:>12.1f}us {naive / shared:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+"""Reaping of silent connections and its effect on group fan-out.
+
+    python benchmarks/dead_connections.py --clients 500 --dead 0.5
+
+--clients users join group 1 over /ws/chat with heartbeat=1. Live clients answer every
+{"type": "ping"} with {"type": "pong"}. A --dead share answers the first
+ping and then stops reading while keeping its TCP connection open: a peer
+that silently went away. The script prints the registry size and the
+fan-out time of one group message every second until the reaper has
+evicted the dead clients. Heartbeat intervals are shortened for the run
+(--interval, --idle-timeout).
+Requires websockets.
+"""
+import argparse
+import asyncio
+import json
+import sqlite3
+import time
+from datetime import datetime
+
+from _common import use_temp_workdir, configure_jwt, free_port, serve, seed_users
+
+use_temp_workdir()
+configure_jwt()
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--clients", type=int, default=500)
+parser.add_argument("--dead", type=float, default=0.5)
+parser.add_argument("--interval", type=float, default=1.0)
+parser.add_argument("--idle-timeout", type=float, default=3.0)
+parser.add_argument("--duration", type=float, default=8.0)
+args = parser.parse_args()
+
+import websockets
+
+import config
+from main import app
+from database import init_db, close_db
+from dependencies import create_access_token
+from utils.frames import EncodedFrame
+from utils.manager import manager
+
+# Менеджер читает настройки пульса на каждом проходе
+config.HEARTBEAT_INTERVAL = args.interval
+config.HEARTBEAT_IDLE_TIMEOUT = args.idle_timeout
+
+
+async def seed(users):
+    await init_db()
+    await close_db()
+    seed_users(users)
+    conn = sqlite3.connect("chat_app.db")
+    conn.execute("INSERT INTO groups (id, name, created_at) VALUES (1, 'fanout', ?)", (datetime.utcnow().isoformat(" "),))
+    conn.executemany("INSERT INTO group_members (group_id, user_id) VALUES (1, ?)", [(i,) for i in range(1, users + 1)])
+    conn.commit()
+    conn.close()
+
+
+async def client(host, user, dead, stop):
+    token = create_access_token({"sub": f"user{user}"})
+    async with websockets.connect(f"ws://{host}/ws/chat?token={token}&heartbeat=1", max_queue=None) as ws:
+        async for raw in ws:
+            if json.loads(raw).get("type") != "ping":
+                continue
+            await ws.send(json.dumps({"type": "pong"}))
+            if dead:
+                # Больше ничего не читает и не шлёт, сокет остаётся открытым
+                await stop.wait()
+                return
+            if stop.is_set():
+                return
+
+
+async def fanout_ms():
+    frame = EncodedFrame({"type": "group_message", "group_id": 1, "content": "probe"})
+    started = time.perf_counter()
+    await manager._broadcast(list(manager.group_online.get(1, ())), frame)
+    return (time.perf_counter() - started) * 1000
+
+
+async def main():
+    await seed(args.clients)
+    dead_count = int(args.clients * args.dead)
+    async with serve(app, free_port()) as host:
+        stop = asyncio.Event()
+        clients = [
+            asyncio.create_task(client(host, user, user <= dead_count, stop))
+            for user in range(1, args.clients + 1)
+        ]
+        started = time.perf_counter()
+        while time.perf_counter() - started < args.duration:
+            await asyncio.sleep(1)
+            print(
+                f"t={time.perf_counter() - started:4.1f}s  connections={len(manager.active_connections)}  "
+                f"group online={len(manager.group_online.get(1, ()))}  fan-out={await fanout_ms():.2f}ms"
+            )
+        stop.set()
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+    print(f"expected after reaping: {args.clients - dead_count} connections")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""Throughput and peak memory of the streaming NDJSON export.
+
+    python benchmarks/export_memory.py --history 500000 [--gzip]
+
+Seeds one group with --history messages, downloads GET /groups/1/export
+through an in-process server and reports rows/s plus the growth of the
+process's peak RSS during the download. Run it with two --history sizes:
+the RSS growth should stay flat. SQLite's mmap and page cache are turned
+down by default so that they do not show up as export memory.
+Requires httpx.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from _common import use_temp_workdir, configure_jwt, free_port, serve, seed_users
+
+use_temp_workdir()
+# Отображённые страницы файла БД и кэш страниц тоже входят в RSS
+os.environ.setdefault("SQLITE_MMAP_SIZE", "0")
+os.environ.setdefault("SQLITE_CACHE_SIZE", "-2000")
+configure_jwt()
+
+import httpx
+
+from main import app
+from database import init_db, close_db
+from dependencies import create_access_token
+
+
+async def seed(history):
+    await init_db()
+    await close_db()
+    seed_users(2)
+    conn = sqlite3.connect("chat_app.db")
+    conn.execute("INSERT INTO groups (id, name, created_at) VALUES (1, 'export', ?)", (datetime.utcnow().isoformat(" "),))
+    conn.executemany("INSERT INTO group_members (group_id, user_id) VALUES (1, ?)", [(1,), (2,)])
+    start = datetime.utcnow() - timedelta(seconds=history)
+    conn.executemany(
+        "INSERT INTO messages (content, sender_id, group_id, timestamp) VALUES (?, ?, 1, ?)",
+        (
+            (f"export message {n} " + "x" * 80, 1 + n % 2, (start + timedelta(seconds=n)).isoformat(" "))
+            for n in range(history)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", type=int, default=200_000)
+    parser.add_argument("--gzip", action="store_true")
+    args = parser.parse_args()
+
+    await seed(args.history)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'user1'})}"}
+    async with serve(app, free_port()) as host:
+        async with httpx.AsyncClient(base_url=f"http://{host}", timeout=None) as api:
+            (await api.get("/groups/1/messages", headers=headers)).raise_for_status()
+            baseline = peak_rss_mb()
+            started = time.perf_counter()
+            rows = wire_bytes = 0
+            async with api.stream("GET", "/groups/1/export", params={"gzip": args.gzip}, headers=headers) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    rows += bool(line)
+                wire_bytes = response.num_bytes_downloaded
+            elapsed = time.perf_counter() - started
+    print(
+        f"{rows:,} rows in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s), {wire_bytes / 1e6:.1f} MB on the wire, "
+        f"peak RSS +{peak_rss_mb() - baseline:.1f} MB"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+"""Delivery latency for well-behaved clients while one client floods a large group.
+
+    python benchmarks/flood_admission.py --members 500 --duration 10 [--unlimited]
+
+The server and the flooding client run in their own processes, so neither
+the flood nor its error frames slow down the measuring client. user1 floods
+group 1 (--members members, all connected) over /ws/chat at --flood-rate
+frames per second, far above the limits, and reconnects whenever the server
+disconnects it,
+while --pairs other users
+exchange personal messages and measure delivery latency (the loadgen probe).
+Prints probe percentiles, flood messages stored and the server's rejection
+counters. --unlimited raises every rate limit out of reach to show the same
+run without admission control.
+Requires httpx and websockets.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime
+
+from _common import ROOT, use_temp_workdir, configure_jwt, free_port, probe_pair, percentiles, format_ms, seed_users
+
+workdir = use_temp_workdir()
+configure_jwt()
+
+import httpx
+import websockets
+
+from database import init_db, close_db
+from dependencies import create_access_token
+
+UNLIMITED = {
+    f"WS_{kind}_{scope}": "1e9"
+    for kind in ("RATE", "BURST") for scope in ("CONNECTION", "USER", "GROUP")
+}
+
+
+async def seed(users, members):
+    await init_db()
+    await close_db()
+    seed_users(users)
+    conn = sqlite3.connect("chat_app.db")
+    conn.execute("INSERT INTO groups (id, name, created_at) VALUES (1, 'flood', ?)", (datetime.utcnow().isoformat(" "),))
+    conn.executemany("INSERT INTO group_members (group_id, user_id) VALUES (1, ?)", [(i,) for i in range(1, members + 1)])
+    conn.commit()
+    conn.close()
+
+
+async def listener(host, user, stop):
+    # Участники группы: читают всё, что приходит, чтобы очереди не переполнялись
+    token = create_access_token({"sub": f"user{user}"})
+    async with websockets.connect(f"ws://{host}/ws/chat?token={token}", max_queue=None) as ws:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(ws.recv(), 0.5)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def flood(host, duration, rate):
+    # Игнорирует кадры ошибок и retry_after; после отключения сразу подключается снова
+    token = create_access_token({"sub": "user1"})
+    frame = json.dumps({"type": "group", "group_id": 1, "content": "flood"})
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    counts = {"sent": 0, "disconnects": 0}
+    while loop.time() < deadline:
+        try:
+            async with websockets.connect(f"ws://{host}/ws/chat?token={token}", close_timeout=1) as ws:
+                while loop.time() < deadline:
+                    await ws.send(frame)
+                    counts["sent"] += 1
+                    await asyncio.sleep(1 / rate)
+        except websockets.ConnectionClosed:
+            counts["disconnects"] += 1
+    print(json.dumps(counts))
+
+
+async def start_flooder(host, duration, rate):
+    return await asyncio.create_subprocess_exec(
+        sys.executable, __file__, "--flood", host, "--duration", str(duration), "--flood-rate", str(rate),
+        stdout=subprocess.PIPE,
+    )
+
+
+async def start_server(port, unlimited):
+    env = dict(os.environ, PYTHONPATH=ROOT, **(UNLIMITED if unlimited else {}))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=workdir, env=env,
+    )
+    async with httpx.AsyncClient() as client:
+        for _ in range(200):
+            try:
+                await client.get(f"http://127.0.0.1:{port}/")
+                return process
+            except httpx.TransportError:
+                await asyncio.sleep(0.05)
+    process.kill()
+    raise RuntimeError("server did not start")
+
+
+async def rejections(host):
+    async with httpx.AsyncClient() as client:
+        text = (await client.get(f"http://{host}/metrics")).text
+    return [line for line in text.splitlines() if line.startswith("ws_admission_rejected_total")]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=300)
+    parser.add_argument("--pairs", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--flood-rate", type=float, default=500)
+    parser.add_argument("--unlimited", action="store_true")
+    parser.add_argument("--flood", metavar="HOST", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.flood:
+        return await flood(args.flood, args.duration, args.flood_rate)
+
+    users = args.members + 2 * args.pairs
+    await seed(users, args.members)
+    port = free_port()
+    host = f"127.0.0.1:{port}"
+    server = await start_server(port, args.unlimited)
+    try:
+        stop, samples = asyncio.Event(), []
+        members = [asyncio.create_task(listener(host, user, stop)) for user in range(2, args.members + 1)]
+        await asyncio.sleep(1)
+        probes = [
+            asyncio.create_task(probe_pair(
+                host, args.members + 2 * i + 1, args.members + 2 * i + 2, stop, samples, args.interval
+            ))
+            for i in range(args.pairs)
+        ]
+        flooder = await start_flooder(host, args.duration, args.flood_rate)
+        counts = json.loads((await flooder.communicate())[0])
+        stop.set()
+        await asyncio.gather(*probes, *members)
+        rejected = await rejections(host)
+    finally:
+        server.terminate()
+        server.wait()
+
+    conn = sqlite3.connect("chat_app.db")
+    stored = conn.execute("SELECT count(*) FROM messages WHERE group_id = 1").fetchone()[0]
+    conn.close()
+    print(f"probe delivery: {format_ms(percentiles(samples))}  ({len(samples)} messages)")
+    print(
+        f"flood: {counts['sent']:,} frames sent, {stored:,} messages stored "
+        f"({stored / args.duration:,.0f}/s), {counts['disconnects']} disconnects"
+    )
+    print("rejected:", ", ".join(rejected) or "none")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+"""WebSocket frames/sec and CPU for a busy group, with and without ?batch=1.
+
+    python benchmarks/frame_coalescing.py --members 50 --senders 5 --messages 200
+
+Senders push bursts into one group; every member counts frames and events it
+receives. CPU is process time of this process, which runs both the server and
+the clients. BATCH_MAX_DELAY and BATCH_MAX_BYTES are read from the environment.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import time
+
+from _common import use_temp_workdir, configure_jwt, free_port, serve, seed_users
+
+use_temp_workdir()
+configure_jwt()
+# Считаются все события, поэтому переполнение очереди не должно их выбрасывать
+os.environ.setdefault("OUTBOUND_OVERFLOW_POLICY", "block")
+
+import websockets
+
+from main import app
+from database import init_db
+from dependencies import create_access_token
+
+GROUP_ID = 1
+
+
+def seed(members):
+    seed_users(members)
+    conn = sqlite3.connect("chat_app.db")
+    conn.execute("INSERT INTO groups (id, name) VALUES (?, ?)", (GROUP_ID, "busy"))
+    conn.executemany(
+        "INSERT INTO group_members (group_id, user_id) VALUES (?, ?)",
+        [(GROUP_ID, user_id) for user_id in range(1, members + 1)],
+    )
+    conn.commit()
+    conn.close()
+
+
+async def member(host, user_id, batch, expected, counts, ready):
+    token = create_access_token({"sub": f"user{user_id}"})
+    async with websockets.connect(f"ws://{host}/ws/chat?token={token}&batch={int(batch)}") as ws:
+        ready.release()
+        frames = events = 0
+        while events < expected:
+            data = json.loads(await ws.recv())
+            frames += 1
+            events += len(data["events"]) if data.get("type") == "batch" else 1
+        counts.append((frames, events))
+
+
+async def consume(ws):
+    async for _ in ws:
+        pass
+
+
+async def sender(host, user_id, batch, messages, burst, finished):
+    token = create_access_token({"sub": f"user{user_id}"})
+    async with websockets.connect(f"ws://{host}/ws/chat?token={token}&batch={int(batch)}") as ws:
+        # Отправители тоже участники группы; их входящие кадры просто вычитываются
+        drain = asyncio.create_task(consume(ws))
+        for start in range(0, messages, burst):
+            events = [
+                {"type": "group", "group_id": GROUP_ID, "content": f"{user_id}:{n}"}
+                for n in range(start, min(start + burst, messages))
+            ]
+            if batch:
+                await ws.send(json.dumps({"type": "batch", "events": events}))
+            else:
+                for event in events:
+                    await ws.send(json.dumps(event))
+            await asyncio.sleep(0)
+        # Сокет закрывается только после доставки: сервер может ещё разбирать принятые кадры
+        await finished.wait()
+        drain.cancel()
+
+
+async def run(host, args, batch):
+    # Каждый участник получает сообщения всех отправителей, кроме своих
+    members = list(range(args.senders + 1, args.senders + args.members + 1))
+    expected = args.senders * args.messages
+    counts = []
+    ready = asyncio.Semaphore(0)
+    receivers = [
+        asyncio.create_task(member(host, user_id, batch, expected, counts, ready))
+        for user_id in members
+    ]
+    for _ in members:
+        await ready.acquire()
+
+    finished = asyncio.Event()
+    cpu, wall = time.process_time(), time.perf_counter()
+    senders = [
+        asyncio.create_task(sender(host, user_id, batch, args.messages, args.burst, finished))
+        for user_id in range(1, args.senders + 1)
+    ]
+    await asyncio.wait_for(asyncio.gather(*receivers), args.timeout)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    finished.set()
+    await asyncio.gather(*senders)
+
+    frames = sum(f for f, _ in counts)
+    events = sum(e for _, e in counts)
+    print(
+        f"{'batched' if batch else 'per-event':>10}: {events} events in {frames} frames  "
+        f"{frames / wall:,.0f} frames/s  {events / wall:,.0f} events/s  "
+        f"cpu={cpu:.2f}s ({cpu / events * 1e6:.1f}us/event)  wall={wall:.2f}s"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--senders", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=200, help="messages per sender")
+    parser.add_argument("--burst", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    await init_db()
+    seed(args.senders + args.members)
+    async with serve(app, free_port()) as host:
+        await run(host, args, batch=False)
+        await run(host, args, batch=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
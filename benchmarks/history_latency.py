@@ -0,0 +1,82 @@
+"""Tail latency of live WebSocket delivery while another client reads a large history.
+
+    python benchmarks/history_latency.py --history 50000 --probes 20 --duration 5
+
+Requires the packages from requirements.txt plus httpx.
+"""
+import argparse
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+
+from _common import use_temp_workdir, configure_jwt, free_port, serve, percentiles, format_ms, probe_pair, seed_users
+
+use_temp_workdir()
+configure_jwt()
+
+import httpx
+
+from main import app
+from database import init_db
+from dependencies import create_access_token
+
+
+def seed(users, history):
+    seed_users(users)
+    conn = sqlite3.connect("chat_app.db")
+    start = datetime.utcnow() - timedelta(seconds=history)
+    conn.executemany(
+        "INSERT INTO messages (content, sender_id, recipient_id, timestamp) VALUES (?, ?, ?, ?)",
+        (
+            (f"history message {n}", 1 + n % 2, 2 - n % 2, (start + timedelta(seconds=n)).isoformat(" "))
+            for n in range(history)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def history_reader(host, stop, reads):
+    token = create_access_token({"sub": "user1"})
+    async with httpx.AsyncClient(base_url=f"http://{host}", timeout=120) as client:
+        while not stop.is_set():
+            response = await client.get("/messages/with/2", headers={"Authorization": f"Bearer {token}"})
+            response.raise_for_status()
+            reads.append(len(response.content))
+
+
+async def run_phase(host, probes, duration, interval, readers):
+    stop = asyncio.Event()
+    samples, reads = [], []
+    tasks = [
+        asyncio.create_task(probe_pair(host, 3 + 2 * i, 4 + 2 * i, stop, samples, interval))
+        for i in range(probes)
+    ]
+    tasks += [asyncio.create_task(history_reader(host, stop, reads)) for _ in range(readers)]
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return samples, reads
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", type=int, default=50000)
+    parser.add_argument("--probes", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--interval", type=float, default=0.1)
+    parser.add_argument("--readers", type=int, default=1)
+    args = parser.parse_args()
+
+    await init_db()
+    seed(4 + 2 * args.probes, args.history)
+
+    async with serve(app, free_port()) as host:
+        for label, readers in (("idle", 0), ("history reads", args.readers)):
+            samples, reads = await run_phase(host, args.probes, args.duration, args.interval, readers)
+            print(f"{label:>14}: {len(samples)} deliveries, {len(reads)} history reads  "
+                  f"{format_ms(percentiles(samples))}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
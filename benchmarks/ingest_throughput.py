@@ -0,0 +1,65 @@
+"""Sustained message write throughput: one commit per message vs the group-commit pipeline.
+
+    python benchmarks/ingest_throughput.py --writers 50 --messages 40
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from _common import use_temp_workdir
+
+use_temp_workdir()
+
+from database import AsyncSessionLocal, init_db
+from models import MessageDB, NotificationDB
+from utils.ingest import WritePipeline
+
+
+def make_rows(writer, n):
+    now = datetime.utcnow()
+    return (
+        MessageDB(content=f"message {n}", sender_id=writer, recipient_id=writer + 1, timestamp=now),
+        NotificationDB(user_id=writer + 1, content=f"New message from user {writer}", timestamp=now),
+    )
+
+
+async def commit_per_message(writer, count):
+    for n in range(count):
+        async with AsyncSessionLocal() as db:
+            db.add_all(make_rows(writer, n))
+            await db.commit()
+
+
+async def run(label, worker, writers, count):
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(worker(writer, count) for writer in range(writers)), return_exceptions=True
+    )
+    elapsed = time.perf_counter() - start
+    errors = sum(isinstance(result, Exception) for result in results)
+    total = writers * count
+    print(f"{label:>18}: {total} messages in {elapsed:.2f}s  {total / elapsed:,.0f} msg/s  failed writers={errors}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=40)
+    args = parser.parse_args()
+
+    await init_db()
+    await run("commit per message", commit_per_message, args.writers, args.messages)
+
+    pipeline = WritePipeline()
+
+    async def via_pipeline(writer, count):
+        for n in range(count):
+            await pipeline.write(*make_rows(writer, n))
+
+    await run("group commit", via_pipeline, args.writers, args.messages)
+    await pipeline.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
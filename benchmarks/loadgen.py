@@ -0,0 +1,474 @@
+"""Load generator for the chat server: WebSocket clients chatting in groups and
+DMs, a login storm and history readers, with end-to-end delivery latency.
+
+    python benchmarks/loadgen.py --clients 1000 --duration 30 --json results.json
+    python benchmarks/loadgen.py --clients 1000 --duration 30 --compare results.json
+    python benchmarks/loadgen.py --inprocess --clients 200
+    python benchmarks/loadgen.py --url http://127.0.0.1:8000 --clients 500
+
+By default the server runs as a separate uvicorn process on localhost against a
+freshly seeded temporary database. --inprocess runs it inside this process;
+--url targets an already running server (users are registered through the API).
+
+Every chat message carries the sender's clock reading. Each recipient computes
+delivery latency when it receives the message. All clients live in this
+process, so send and receive share one clock.
+
+Only messages sent after --warmup count toward the results. --json writes
+machine-readable results, and --compare prints the change against an
+earlier results file. Requires httpx, websockets and, for
+--encoding msgpack, msgpack.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from _common import ROOT, use_temp_workdir, configure_jwt, free_port, serve, percentiles, seed_users
+
+invocation_dir = os.getcwd()
+workdir = use_temp_workdir()
+configure_jwt()
+
+import httpx
+import websockets
+
+PASSWORD = "secret"
+
+
+def parse_group_sizes(spec):
+    # "4:50,20:35,100:15" — размер группы: доля групп этого размера
+    sizes, weights = [], []
+    for part in spec.split(","):
+        size, weight = part.split(":")
+        sizes.append(int(size))
+        weights.append(float(weight))
+    return sizes, weights
+
+
+def plan_groups(clients, groups_per_user, spec, rng):
+    sizes, weights = parse_group_sizes(spec)
+    average = sum(s * w for s, w in zip(sizes, weights)) / sum(weights)
+    count = max(1, round(clients * groups_per_user / average))
+    groups = []
+    for _ in range(count):
+        size = min(clients, rng.choices(sizes, weights)[0])
+        groups.append(rng.sample(range(1, clients + 1), size))
+    return groups
+
+
+async def seed_database(clients, groups):
+    # Быстрое наполнение напрямую через sqlite: пользователи user1..userN с одним паролем
+    from database import init_db, close_db
+    await init_db()
+    await close_db()
+    seed_users(clients, PASSWORD)
+    conn = sqlite3.connect("chat_app.db")
+    conn.executemany(
+        "INSERT INTO groups (id, name, created_at) VALUES (?, ?, ?)",
+        [(gid, f"load-group-{gid}", datetime.utcnow().isoformat(" ")) for gid in range(1, len(groups) + 1)],
+    )
+    conn.executemany(
+        "INSERT INTO group_members (group_id, user_id) VALUES (?, ?)",
+        [(gid, uid) for gid, members in enumerate(groups, 1) for uid in members],
+    )
+    conn.commit()
+    conn.close()
+
+
+async def register_through_api(base_url, clients, groups, concurrency):
+    # Для внешнего сервера: пользователи и группы создаются через REST
+    ids, tokens = {}, {}
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as api:
+        async def account(n):
+            async with semaphore:
+                name = f"load{n}"
+                await api.post("/auth/register", json={"username": name, "password": PASSWORD})
+                response = await api.post("/auth/login", data={"username": name, "password": PASSWORD})
+                response.raise_for_status()
+                token = response.json()["access_token"]
+                me = await api.get("/auth/me", headers={"Authorization": f"Bearer {token}"})
+                ids[n], tokens[n] = me.json()["id"], token
+
+        await asyncio.gather(*(account(n) for n in range(1, clients + 1)))
+        group_ids = []
+        for gid, members in enumerate(groups, 1):
+            owner = tokens[members[0]]
+            response = await api.post(
+                "/groups",
+                json={"name": f"load-group-{gid}", "member_ids": [ids[m] for m in members[1:]]},
+                headers={"Authorization": f"Bearer {owner}"},
+            )
+            response.raise_for_status()
+            group_ids.append(response.json()["id"])
+    return ids, tokens, group_ids, {n: f"load{n}" for n in ids}
+
+
+def local_accounts(clients, groups):
+    from dependencies import create_access_token
+    ids = {n: n for n in range(1, clients + 1)}
+    tokens = {n: create_access_token({"sub": f"user{n}"}) for n in ids}
+    return ids, tokens, list(range(1, len(groups) + 1)), {n: f"user{n}" for n in ids}
+
+
+def process_cpu(pid):
+    # Время CPU процесса сервера из /proc (только Linux)
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self.measuring = False
+        self.latencies = []
+        self.sent = 0
+        self.expected = 0
+        self.delivered = 0
+        self.frames = 0
+        self.connect_times = []
+        self.errors = collections.Counter()
+        self.logins = []
+        self.login_statuses = collections.Counter()
+        self.history = []
+        self.history_statuses = collections.Counter()
+
+
+def decode_events(raw, binary):
+    if binary:
+        import msgpack
+        data = msgpack.unpackb(raw)
+    else:
+        data = json.loads(raw)
+    return data["events"] if data.get("type") == "batch" else [data]
+
+
+async def chat_client(host, n, user_id, token, memberships, ids, group_sizes, args, rec, stop, rng, connect_slots):
+    binary = args.encoding == "msgpack"
+    url = f"ws://{host}/ws/chat?token={token}&batch={int(args.batch)}&encoding={args.encoding}"
+    async with connect_slots:
+        started = time.perf_counter()
+        try:
+            ws = await websockets.connect(url, max_queue=None, open_timeout=60)
+        except Exception as exc:
+            rec.errors[f"connect: {type(exc).__name__}"] += 1
+            return
+        rec.connect_times.append(time.perf_counter() - started)
+
+    async def receive():
+        async for raw in ws:
+            rec.frames += 1
+            now = time.perf_counter()
+            for event in decode_events(raw, binary):
+                content = event.get("content", "")
+                if event.get("type") in ("personal_message", "group_message") and content.startswith("lg|"):
+                    _, sent_at, measured = content.split("|")
+                    if measured == "1":
+                        rec.delivered += 1
+                        rec.latencies.append(now - float(sent_at))
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while not stop.is_set():
+            await asyncio.sleep(rng.expovariate(args.rate))
+            if stop.is_set():
+                break
+            measured = rec.measuring
+            content = f"lg|{time.perf_counter()!r}|{int(measured)}"
+            if memberships and rng.random() >= args.dm_ratio:
+                gid = rng.choice(memberships)
+                event = {"type": "group", "group_id": gid, "content": content}
+                fanout = group_sizes[gid] - 1
+            else:
+                other = rng.randint(1, args.clients - 1)
+                other += other >= n
+                event = {"type": "personal", "recipient_id": ids[other], "content": content}
+                fanout = 1
+            if binary:
+                import msgpack
+                await ws.send(msgpack.packb(event))
+            else:
+                await ws.send(json.dumps(event))
+            if measured:
+                rec.sent += 1
+                rec.expected += fanout
+        # Доставка сообщений, отправленных в конце окна
+        await asyncio.sleep(args.drain)
+    except websockets.ConnectionClosed as exc:
+        rec.errors[f"closed: {exc.code}"] += 1
+    finally:
+        receiver.cancel()
+        await ws.close()
+
+
+async def login_storm(base_url, names, rec, stop, rng):
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                response = await client.post(
+                    "/auth/login", data={"username": rng.choice(names), "password": PASSWORD}
+                )
+                status = response.status_code
+            except httpx.HTTPError as exc:
+                status = type(exc).__name__
+            if rec.measuring:
+                rec.logins.append(time.perf_counter() - started)
+                rec.login_statuses[status] += 1
+            if status == 503:
+                await asyncio.sleep(0.05)
+
+
+async def history_reader(base_url, tokens, ids, user_groups, rec, stop, rng):
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        while not stop.is_set():
+            n = rng.choice(list(tokens))
+            headers = {"Authorization": f"Bearer {tokens[n]}"}
+            if user_groups[n] and rng.random() < 0.5:
+                path = f"/groups/{rng.choice(user_groups[n])}/messages"
+            else:
+                other = rng.choice(list(ids))
+                path = f"/messages/with/{ids[other]}"
+            started = time.perf_counter()
+            try:
+                status = (await client.get(path, headers=headers)).status_code
+            except httpx.HTTPError as exc:
+                status = type(exc).__name__
+            if rec.measuring:
+                rec.history.append(time.perf_counter() - started)
+                rec.history_statuses[status] += 1
+
+
+def ms(stats):
+    return {name: None if value is None else round(value * 1000, 3) for name, value in stats.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_load(host, base_url, accounts, groups, args, server_pid=None):
+    ids, tokens, group_ids, names = accounts
+    rng = random.Random(args.seed)
+    user_groups = {n: [] for n in ids}
+    group_sizes = {}
+    for gid, members in zip(group_ids, groups):
+        group_sizes[gid] = len(members)
+        for member in members:
+            user_groups[member].append(gid)
+
+    rec = Recorder()
+    stop = asyncio.Event()
+    connect_slots = asyncio.Semaphore(args.connect_concurrency)
+    clients = [
+        asyncio.create_task(chat_client(
+            host, n, ids[n], tokens[n], user_groups[n], ids, group_sizes, args, rec, stop,
+            random.Random(rng.random()), connect_slots,
+        ))
+        for n in ids
+    ]
+    while len(rec.connect_times) + sum(rec.errors.values()) < len(clients):
+        await asyncio.sleep(0.1)
+
+    background = [
+        asyncio.create_task(login_storm(base_url, list(names.values()), rec, stop, random.Random(rng.random())))
+        for _ in range(args.login_concurrency)
+    ]
+    background += [
+        asyncio.create_task(history_reader(base_url, tokens, ids, user_groups, rec, stop, random.Random(rng.random())))
+        for _ in range(args.history_concurrency)
+    ]
+
+    await asyncio.sleep(args.warmup)
+    rec.measuring = True
+    cpu_before = process_cpu(server_pid) if server_pid else None
+    await asyncio.sleep(args.duration)
+    rec.measuring = False
+    cpu_after = process_cpu(server_pid) if server_pid else None
+    stop.set()
+    await asyncio.gather(*background)
+    await asyncio.gather(*clients)
+
+    duration = args.duration
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.utcnow().isoformat(),
+            "mode": "external" if args.url else "inprocess" if args.inprocess else "subprocess",
+            "args": vars(args),
+            "groups": len(groups),
+        },
+        "chat": {
+            "clients": len(clients),
+            "connected": len(rec.connect_times),
+            "connect_ms": ms(percentiles(rec.connect_times)),
+            "sent": rec.sent,
+            "sent_per_s": round(rec.sent / duration, 1),
+            "expected_deliveries": rec.expected,
+            "delivered": rec.delivered,
+            "delivered_per_s": round(rec.delivered / duration, 1),
+            "delivery_ratio": round(rec.delivered / rec.expected, 4) if rec.expected else None,
+            "frames": rec.frames,
+            "latency_ms": ms(percentiles(rec.latencies)),
+            "errors": dict(rec.errors),
+        },
+        "login": {
+            "requests": len(rec.logins),
+            "ok_per_s": round(rec.login_statuses[200] / duration, 1),
+            "statuses": {str(k): v for k, v in rec.login_statuses.items()},
+            "latency_ms": ms(percentiles(rec.logins)),
+        },
+        "history": {
+            "requests": len(rec.history),
+            "per_s": round(len(rec.history) / duration, 1),
+            "statuses": {str(k): v for k, v in rec.history_statuses.items()},
+            "latency_ms": ms(percentiles(rec.history)),
+        },
+        "server": {
+            "cpu_s": round(cpu_after - cpu_before, 2) if cpu_before is not None and cpu_after is not None else None,
+        },
+    }
+
+
+def print_report(results):
+    chat, login, history = results["chat"], results["login"], results["history"]
+
+    def fmt(stats):
+        return "  ".join(f"{k}={v:.2f}ms" if v is not None else f"{k}=n/a" for k, v in stats.items())
+
+    print(f"commit {results['meta']['commit']}  mode {results['meta']['mode']}  groups {results['meta']['groups']}")
+    print(f"clients   {chat['connected']}/{chat['clients']} connected  connect {fmt(chat['connect_ms'])}")
+    print(
+        f"chat      sent {chat['sent_per_s']}/s  delivered {chat['delivered_per_s']}/s  "
+        f"ratio {chat['delivery_ratio']}  frames {chat['frames']}  errors {chat['errors']}"
+    )
+    print(f"delivery  {fmt(chat['latency_ms'])}")
+    print(f"login     {login['ok_per_s']}/s ok  statuses {login['statuses']}  {fmt(login['latency_ms'])}")
+    print(f"history   {history['per_s']}/s  statuses {history['statuses']}  {fmt(history['latency_ms'])}")
+    if results["server"]["cpu_s"] is not None:
+        print(f"server    cpu {results['server']['cpu_s']}s over {results['meta']['args']['duration']}s")
+
+
+COMPARED = [
+    ("chat", "delivered_per_s", True),
+    ("chat", "latency_ms.p50", False),
+    ("chat", "latency_ms.p95", False),
+    ("chat", "latency_ms.p99", False),
+    ("login", "ok_per_s", True),
+    ("login", "latency_ms.p99", False),
+    ("history", "per_s", True),
+    ("history", "latency_ms.p99", False),
+    ("server", "cpu_s", False),
+]
+
+
+def compare(previous, current):
+    def get(results, section, path):
+        value = results.get(section, {})
+        for key in path.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        return value
+
+    print(f"\ncompared with {previous['meta'].get('commit')} ({previous['meta'].get('time')})")
+    for section, path, higher_is_better in COMPARED:
+        old, new = get(previous, section, path), get(current, section, path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        better = change >= 0 if higher_is_better else change <= 0
+        print(f"  {section + '.' + path:<24} {old:>10} -> {new:<10} {change:+6.1f}% {'' if better else '(worse)'}")
+
+
+def start_server(port):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=workdir, env=env,
+    )
+
+
+async def wait_for_server(base_url):
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        for _ in range(400):
+            try:
+                await client.get("/")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.05)
+    raise RuntimeError(f"server at {base_url} did not start")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000, help="connected /ws/chat clients")
+    parser.add_argument("--rate", type=float, default=0.2, help="messages per second per client")
+    parser.add_argument("--dm-ratio", type=float, default=0.7, help="share of messages sent as DMs")
+    parser.add_argument("--group-sizes", default="4:50,20:35,100:15", help="size:weight list")
+    parser.add_argument("--groups-per-user", type=float, default=2.0)
+    parser.add_argument("--login-concurrency", type=int, default=2)
+    parser.add_argument("--history-concurrency", type=int, default=4)
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--batch", action="store_true", help="connect with ?batch=1")
+    parser.add_argument("--encoding", choices=["json", "msgpack"], default="json")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for in-flight deliveries")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--inprocess", action="store_true", help="run the server inside this process")
+    parser.add_argument("--url", help="target an already running server, e.g. http://127.0.0.1:8000")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    groups = plan_groups(args.clients, args.groups_per_user, args.group_sizes, random.Random(args.seed))
+    if args.url:
+        base_url = args.url.rstrip("/")
+        accounts = await register_through_api(base_url, args.clients, groups, args.connect_concurrency)
+        results = await run_load(base_url.split("://", 1)[1], base_url, accounts, groups, args)
+    else:
+        await seed_database(args.clients, groups)
+        accounts = local_accounts(args.clients, groups)
+        port = free_port()
+        if args.inprocess:
+            from main import app
+            async with serve(app, port) as host:
+                results = await run_load(host, f"http://{host}", accounts, groups, args, os.getpid())
+        else:
+            server = start_server(port)
+            try:
+                await wait_for_server(f"http://127.0.0.1:{port}")
+                results = await run_load(
+                    f"127.0.0.1:{port}", f"http://127.0.0.1:{port}", accounts, groups, args, server.pid
+                )
+            finally:
+                server.terminate()
+                server.wait()
+
+    print_report(results)
+    if args.json:
+        with open(os.path.join(invocation_dir, args.json), "w") as output:
+            json.dump(results, output, indent=2)
+    if args.compare:
+        with open(os.path.join(invocation_dir, args.compare)) as previous:
+            compare(json.load(previous), results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""Login throughput during a login storm, with live chat latency measured alongside.
+
+    python benchmarks/login_throughput.py --logins 16 --probes 5 --duration 5
+    python benchmarks/login_throughput.py --inline     # bcrypt on the event loop, for comparison
+
+BCRYPT_ROUNDS, PASSWORD_WORKERS and PASSWORD_MAX_QUEUE are read from the environment.
+Requires httpx.
+"""
+import argparse
+import asyncio
+import collections
+
+from _common import use_temp_workdir, configure_jwt, free_port, serve, percentiles, format_ms, probe_pair, seed_users
+
+use_temp_workdir()
+configure_jwt()
+
+import httpx
+
+from main import app
+from database import init_db
+from utils.password_pool import password_pool
+
+
+async def login_storm(host, user, stop, statuses):
+    async with httpx.AsyncClient(base_url=f"http://{host}", timeout=60) as client:
+        while not stop.is_set():
+            response = await client.post("/auth/login", data={"username": f"user{user}", "password": "secret"})
+            statuses[response.status_code] += 1
+            if response.status_code == 503:
+                await asyncio.sleep(0.05)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=16, help="concurrent login loops")
+    parser.add_argument("--probes", type=int, default=5, help="chat sender/receiver pairs")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--interval", type=float, default=0.1)
+    parser.add_argument("--inline", action="store_true", help="run bcrypt on the event loop")
+    args = parser.parse_args()
+
+    if args.inline:
+        async def run_inline(fn, *fn_args):
+            return fn(*fn_args)
+        password_pool.run = run_inline
+
+    await init_db()
+    seed_users(2 * args.probes + 2)
+
+    async with serve(app, free_port()) as host:
+        stop = asyncio.Event()
+        samples = []
+        statuses = collections.Counter()
+        tasks = [
+            asyncio.create_task(probe_pair(host, 3 + 2 * i, 4 + 2 * i, stop, samples, args.interval))
+            for i in range(args.probes)
+        ]
+        tasks += [asyncio.create_task(login_storm(host, 1 + i % 2, stop, statuses)) for i in range(args.logins)]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    mode = "inline" if args.inline else f"pool({password_pool.workers} workers)"
+    print(f"bcrypt {mode}: {statuses[200] / args.duration:.1f} logins/s  statuses={dict(statuses)}")
+    print(f"chat delivery during storm: {len(samples)} messages  {format_ms(percentiles(samples))}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
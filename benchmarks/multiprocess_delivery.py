@@ -0,0 +1,112 @@
+"""Cross-worker delivery check over the Unix-socket backplane.
+
+Starts a broker and two uvicorn worker processes sharing one SQLite file,
+connects users to different workers and verifies that personal messages,
+group messages, membership changes and notifications reach them.
+
+    python benchmarks/multiprocess_delivery.py
+
+Exits with a non-zero status if any delivery is missing. Requires httpx.
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+from _common import ROOT, use_temp_workdir, free_port
+
+workdir = use_temp_workdir()
+
+import httpx
+import websockets
+
+from utils.backplane import UnixSocketBroker
+
+WORKER = (
+    "import dependencies, uvicorn, sys;"
+    "dependencies.SECRET_KEY = dependencies.SECRET_KEY or 'bench-secret';"
+    "dependencies.ALGORITHM = dependencies.ALGORITHM or 'HS256';"
+    "from main import app;"
+    "uvicorn.run(app, host='127.0.0.1', port=int(sys.argv[1]), log_level='warning')"
+)
+
+
+async def start_worker(port, socket_path):
+    env = dict(os.environ, PYTHONPATH=ROOT, BACKPLANE_URL=f"unix://{socket_path}")
+    process = subprocess.Popen([sys.executable, "-c", WORKER, str(port)], cwd=workdir, env=env)
+    async with httpx.AsyncClient() as client:
+        for _ in range(200):
+            try:
+                await client.get(f"http://127.0.0.1:{port}/")
+                return process
+            except httpx.TransportError:
+                await asyncio.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"worker on port {port} did not start")
+
+
+async def expect(ws, predicate, label, results, timeout=5.0):
+    try:
+        while True:
+            data = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+            if predicate(data):
+                results.append((label, True))
+                return
+    except asyncio.TimeoutError:
+        results.append((label, False))
+
+
+async def main():
+    socket_path = os.path.join(workdir, "backplane.sock")
+    broker = UnixSocketBroker(socket_path)
+    await broker.start()
+
+    port_a, port_b = free_port(), free_port()
+    workers = [await start_worker(port_a, socket_path)]
+    workers.append(await start_worker(port_b, socket_path))
+    results = []
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port_a}") as api:
+            ids, tokens = {}, {}
+            for name in ("alice", "bob", "carol"):
+                response = await api.post("/auth/register", json={"username": name, "password": "pw"})
+                ids[name] = response.json()["id"]
+                response = await api.post("/auth/login", data={"username": name, "password": "pw"})
+                tokens[name] = response.json()["access_token"]
+            auth = {"Authorization": f"Bearer {tokens['alice']}"}
+
+            def ws_url(port, name):
+                return f"ws://127.0.0.1:{port}/ws/chat?token={tokens[name]}"
+
+            async with websockets.connect(ws_url(port_a, "alice")) as alice, \
+                    websockets.connect(ws_url(port_b, "bob")) as bob, \
+                    websockets.connect(ws_url(port_b, "carol")) as carol:
+                response = await api.post("/groups", json={"name": "ops", "member_ids": [ids["bob"]]}, headers=auth)
+                group_id = response.json()["id"]
+                await asyncio.sleep(0.2)
+
+                await alice.send(json.dumps({"type": "personal", "recipient_id": ids["bob"], "content": "dm a->b"}))
+                await expect(bob, lambda d: d.get("content") == "dm a->b", "personal message A -> B", results)
+
+                await bob.send(json.dumps({"type": "group", "group_id": group_id, "content": "group b->a"}))
+                await expect(alice, lambda d: d.get("content") == "group b->a", "group message B -> A", results)
+
+                await api.post(f"/groups/{group_id}/members/{ids['carol']}", headers=auth)
+                await expect(carol, lambda d: d.get("type") == "notification", "notification A -> B", results)
+
+                await alice.send(json.dumps({"type": "group", "group_id": group_id, "content": "welcome"}))
+                await expect(carol, lambda d: d.get("content") == "welcome", "membership change A -> B", results)
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+        await broker.stop()
+
+    for label, ok in results:
+        print(f"{'ok' if ok else 'FAILED':>6}  {label}")
+    return bool(results) and all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,94 @@
+"""SQL statements per endpoint, checked against a fixed budget.
+
+    python benchmarks/query_counts.py --groups 20 --members 50 --outsiders 2000
+
+Each request runs inside utils.query_counter.assert_max_queries; the script
+exits with status 1 if any endpoint issues more statements than its budget. The
+budgets do not depend on --groups/--members, so an N+1 regression shows up
+as soon as the data set has more than one group or member; the bulk
+endpoints get all --outsiders users in one request.
+"""
+import argparse
+import sqlite3
+import sys
+from datetime import datetime
+
+from _common import use_temp_workdir, configure_jwt, seed_users
+
+use_temp_workdir()
+configure_jwt()
+
+from fastapi.testclient import TestClient
+
+from main import app
+from dependencies import create_access_token
+from utils.query_counter import assert_max_queries
+
+
+def seed(groups, members, outsiders):
+    seed_users(members + outsiders)
+    conn = sqlite3.connect("chat_app.db")
+    conn.executemany(
+        "INSERT INTO groups (id, name, created_at) VALUES (?, ?, ?)",
+        [(gid, f"group {gid}", datetime.utcnow().isoformat(" ")) for gid in range(1, groups + 1)],
+    )
+    # Пользователи после members ни в одной группе — их добавляют и удаляют
+    conn.executemany(
+        "INSERT INTO group_members (group_id, user_id) VALUES (?, ?)",
+        [(gid, uid) for gid in range(1, groups + 1) for uid in range(1, members + 1)],
+    )
+    conn.executemany(
+        "INSERT INTO messages (content, sender_id, group_id, timestamp) VALUES (?, ?, ?, ?)",
+        [(f"message {n}", 1 + n % members, 1, datetime.utcnow().isoformat(" ")) for n in range(200)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--outsiders", type=int, default=2000)
+    args = parser.parse_args()
+    outsider = args.members + 1
+    outsiders = {"user_ids": list(range(args.members + 1, args.members + args.outsiders + 1))}
+    message = {"content": "hello"}
+
+    # (метод, путь, тело, бюджет запросов)
+    checks = [
+        ("GET", "/groups", None, 2),
+        ("GET", "/groups/1", None, 2),
+        ("GET", "/groups/1/messages", None, 2),
+        ("GET", "/groups/1/messages", None, 1),
+        ("POST", "/groups/1/messages", message, 3),
+        ("POST", f"/groups/1/members/{outsider}", None, 4),
+        ("DELETE", f"/groups/1/members/{outsider}", None, 4),
+        ("POST", "/groups/1/members", outsiders, 4),
+        ("DELETE", "/groups/1/members", outsiders, 4),
+        ("POST", "/groups", {"name": "new", "member_ids": outsiders["user_ids"]}, 4),
+        # Переписка короче страницы: оба направления читаются ещё и из архива
+        ("GET", "/messages/with/2", None, 5),
+        ("GET", "/auth/notifications", None, 2),
+    ]
+    failed = False
+    with TestClient(app) as client:
+        seed(args.groups, args.members, args.outsiders)
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': 'user1'})}"}
+        # Прогрев кэша токенов, чтобы поиск пользователя не попадал в счёт
+        client.get("/auth/me", headers=headers).raise_for_status()
+        print(f"{'endpoint':<40} {'queries':>7} {'budget':>6}")
+        for method, path, body, budget in checks:
+            status = ""
+            try:
+                with assert_max_queries(budget) as counter:
+                    response = client.request(method, path, headers=headers, json=body)
+            except AssertionError as error:
+                failed, status = True, f"  OVER BUDGET\n{error}"
+            response.raise_for_status()
+            print(f"{method + ' ' + path:<40} {counter.count:>7} {budget:>6}{status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
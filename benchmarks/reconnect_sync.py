@@ -0,0 +1,117 @@
+"""Reconnect catch-up cost: {"type": "sync"} on /ws/chat vs re-reading histories over REST.
+
+    python benchmarks/reconnect_sync.py --history 200000 --missed 100 --clients 50
+
+user1..userN each belong to --groups groups, and the history is spread over
+those groups and DMs. Every client reconnects with a cursor just before the
+last --missed messages, and the script measures how long it takes to catch up:
+once with sync, and once with the first history page of every conversation
+(GET /messages plus GET /groups/{id}/messages), as clients did before.
+Run it with two --history sizes: sync time should not change.
+Requires httpx and websockets.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from _common import use_temp_workdir, configure_jwt, free_port, serve, percentiles, format_ms, seed_users
+
+use_temp_workdir()
+configure_jwt()
+
+import httpx
+import websockets
+
+from main import app
+from database import init_db, close_db
+from dependencies import create_access_token
+
+
+async def seed(users, groups, history, seed_value):
+    await init_db()
+    await close_db()
+    seed_users(users)
+    rng = random.Random(seed_value)
+    conn = sqlite3.connect("chat_app.db")
+    conn.executemany(
+        "INSERT INTO groups (id, name, created_at) VALUES (?, ?, ?)",
+        [(gid, f"group {gid}", datetime.utcnow().isoformat(" ")) for gid in range(1, groups + 1)],
+    )
+    conn.executemany(
+        "INSERT INTO group_members (group_id, user_id) VALUES (?, ?)",
+        [(gid, uid) for gid in range(1, groups + 1) for uid in range(1, users + 1)],
+    )
+    start = datetime.utcnow() - timedelta(seconds=history)
+
+    def rows():
+        for n in range(history):
+            sender = rng.randint(1, users)
+            timestamp = (start + timedelta(seconds=n)).isoformat(" ")
+            if rng.random() < 0.5:
+                yield (f"message {n}", sender, rng.randint(1, groups), None, timestamp)
+            else:
+                yield (f"message {n}", sender, None, rng.randint(1, users), timestamp)
+
+    conn.executemany(
+        "INSERT INTO messages (content, sender_id, group_id, recipient_id, timestamp) VALUES (?, ?, ?, ?, ?)", rows()
+    )
+    conn.commit()
+    conn.close()
+
+
+async def sync_client(host, user, after, samples, received):
+    token = create_access_token({"sub": f"user{user}"})
+    async with websockets.connect(f"ws://{host}/ws/chat?token={token}", max_queue=None) as ws:
+        started = time.perf_counter()
+        await ws.send(json.dumps({"type": "sync", "after": after}))
+        count = 0
+        async for raw in ws:
+            data = json.loads(raw)
+            if data["type"] == "sync_done":
+                break
+            count += 1
+        samples.append(time.perf_counter() - started)
+        received.append(count)
+
+
+async def rest_client(api, user, groups, samples):
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': f'user{user}'})}"}
+    started = time.perf_counter()
+    (await api.get("/messages", headers=headers)).raise_for_status()
+    for gid in range(1, groups + 1):
+        (await api.get(f"/groups/{gid}/messages", headers=headers)).raise_for_status()
+    samples.append(time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=10)
+    parser.add_argument("--history", type=int, default=100_000)
+    parser.add_argument("--missed", type=int, default=100)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    await seed(args.users, args.groups, args.history, args.seed)
+    # Курсор: всё, кроме последних --missed сообщений, клиенты уже видели
+    after = max(0, args.history - args.missed)
+    clients = range(1, min(args.clients, args.users) + 1)
+
+    async with serve(app, free_port()) as host:
+        samples, received = [], []
+        await asyncio.gather(*(sync_client(host, user, after, samples, received) for user in clients))
+        print(f"sync: {format_ms(percentiles(samples))}  frames per client={sum(received) / len(received):.1f}")
+
+        samples = []
+        async with httpx.AsyncClient(base_url=f"http://{host}", timeout=120) as api:
+            await asyncio.gather(*(rest_client(api, user, args.groups, samples) for user in clients))
+        print(f"rest: {format_ms(percentiles(samples))}  requests per client={args.groups + 1}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""Retention job cost: archive + notification purge + incremental vacuum under live traffic.
+
+    python benchmarks/retention_job.py --history 300000 --notifications 300000
+
+Seeds --history messages and --notifications read notifications, all older
+than the policy, then measures personal-message delivery latency over
+/ws/chat (the same probe as loadgen) while RetentionJob.run_once() moves the
+messages to messages_archive, deletes the notifications and vacuums the freed
+pages. Reports the job's duration, rows moved, the hot-table size and the
+database file size before and after. Compare the delivery percentiles with
+--idle (probe without the job) to see how much the job costs live traffic.
+Requires websockets.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from _common import use_temp_workdir, configure_jwt, free_port, serve, probe_pair, percentiles, format_ms, seed_users
+
+use_temp_workdir()
+configure_jwt()
+
+import config
+from main import app
+from database import init_db, close_db
+from utils import search
+from utils.retention import RetentionJob, RetentionPolicy
+
+
+async def seed(users, history, notifications):
+    # Файл создаёт init_db, поэтому у него сразу auto_vacuum=INCREMENTAL
+    await init_db()
+    await close_db()
+    seed_users(users)
+    conn = sqlite3.connect("chat_app.db")
+    start = datetime.utcnow() - timedelta(days=400)
+    conn.executemany(
+        "INSERT INTO messages (content, sender_id, recipient_id, timestamp) VALUES (?, ?, ?, ?)",
+        (
+            (f"old message {n} " + "x" * 80, 1 + n % users, 1 + (n + 1) % users,
+             (start + timedelta(seconds=n)).isoformat(" "))
+            for n in range(history)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO notifications (user_id, content, is_read, timestamp) VALUES (?, ?, 1, ?)",
+        (
+            (1 + n % users, f"old notification {n}", (start + timedelta(seconds=n)).isoformat(" "))
+            for n in range(notifications)
+        ),
+    )
+    # Строки, вставленные мимо ORM, добавляются в индекс поиска, как в search_latency
+    conn.execute(f"INSERT INTO {search.FTS_TABLE}({search.FTS_TABLE}) VALUES('rebuild')")
+    conn.commit()
+    conn.close()
+
+
+def sizes():
+    conn = sqlite3.connect("chat_app.db")
+    try:
+        hot = conn.execute("SELECT count(*) FROM messages").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+    return hot, free, os.path.getsize("chat_app.db") / 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--history", type=int, default=200_000)
+    parser.add_argument("--notifications", type=int, default=200_000)
+    parser.add_argument("--pairs", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=0.02)
+    parser.add_argument("--chunk-size", type=int, default=config.RETENTION_CHUNK_SIZE)
+    parser.add_argument("--pause", type=float, default=config.RETENTION_PAUSE)
+    parser.add_argument("--idle", type=float, default=0, help="seconds of probing without the job")
+    args = parser.parse_args()
+
+    await seed(args.users, args.history, args.notifications)
+    hot, free, size = sizes()
+    print(f"before: {hot:,} hot messages, {free:,} free pages, {size:.1f} MB")
+
+    job = RetentionJob(
+        RetentionPolicy(dm=30, groups=30), chunk_size=args.chunk_size, pause=args.pause, notification_days=30
+    )
+    async with serve(app, free_port()) as host:
+        stop, samples = asyncio.Event(), []
+        probes = [
+            asyncio.create_task(probe_pair(host, 2 * i + 1, 2 * i + 2, stop, samples, args.interval))
+            for i in range(min(args.pairs, args.users // 2))
+        ]
+        if args.idle:
+            await asyncio.sleep(args.idle)
+            print(f"idle delivery: {format_ms(percentiles(samples))}")
+            samples.clear()
+        started = time.perf_counter()
+        stats = await job.run_once()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await asyncio.gather(*probes)
+
+    print(f"job: {elapsed:.2f}s, {stats}")
+    print(f"delivery during job: {format_ms(percentiles(samples))}  ({len(samples)} messages)")
+    hot, free, size = sizes()
+    print(f"after: {hot:,} hot messages, {free:,} free pages, {size:.1f} MB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""Full-text search latency over a large message corpus.
+
+    python benchmarks/search_latency.py --messages 2000000 --queries 200
+
+The corpus is inserted with sqlite3 directly, the FTS5 index is built with the
+same rebuild used by `python -m utils.search rebuild`, and queries then go
+through utils.search.search_messages as the /messages/search endpoint does.
+"""
+import argparse
+import asyncio
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from _common import use_temp_workdir, percentiles, format_ms, seed_users
+
+use_temp_workdir()
+
+from database import init_db, engine, AsyncSessionLocal
+from utils import search
+
+WORDS = (
+    "deploy release rollback incident review lunch meeting budget invoice design "
+    "database migration backup latency outage ticket sprint retro launch metrics "
+    "customer feedback roadmap hiring offsite travel report draft update status"
+).split()
+
+
+def seed(users, groups, messages):
+    seed_users(users)
+    conn = sqlite3.connect("chat_app.db")
+    conn.executemany("INSERT INTO groups (id, name) VALUES (?, ?)", [(g, f"group{g}") for g in range(1, groups + 1)])
+    conn.executemany(
+        "INSERT INTO group_members (group_id, user_id) VALUES (?, ?)",
+        [(g, u) for g in range(1, groups + 1) for u in range(1, users + 1) if (u + g) % 4 == 0],
+    )
+    rng = random.Random(1)
+    start = datetime.utcnow() - timedelta(seconds=messages)
+
+    def rows():
+        for n in range(messages):
+            content = " ".join(rng.choices(WORDS, k=8))
+            sender = rng.randint(1, users)
+            timestamp = (start + timedelta(seconds=n)).isoformat(" ")
+            if n % 3 == 0:
+                yield content, sender, None, rng.randint(1, groups), timestamp
+            else:
+                yield content, sender, rng.randint(1, users), None, timestamp
+
+    conn.executemany(
+        "INSERT INTO messages (content, sender_id, recipient_id, group_id, timestamp) VALUES (?, ?, ?, ?, ?)",
+        rows(),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    await init_db()
+    started = time.perf_counter()
+    seed(args.users, args.groups, args.messages)
+    print(f"seeded {args.messages} messages in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    async with engine.begin() as connection:
+        await connection.run_sync(search.rebuild_index)
+    print(f"built {search.FTS_TABLE} in {time.perf_counter() - started:.1f}s")
+
+    rng = random.Random(2)
+    cases = {
+        "one term": lambda: rng.choice(WORDS),
+        "two terms": lambda: " ".join(rng.sample(WORDS, 2)),
+        "three terms": lambda: " ".join(rng.sample(WORDS, 3)),
+    }
+    async with AsyncSessionLocal() as db:
+        for label, make_query in cases.items():
+            first_page, next_page = [], []
+            for _ in range(args.queries):
+                user_id = rng.randint(1, args.users)
+                query = make_query()
+                started = time.perf_counter()
+                page = await search.search_messages(db, user_id, query, limit=args.limit)
+                first_page.append(time.perf_counter() - started)
+                if page["next"]:
+                    started = time.perf_counter()
+                    await search.search_messages(db, user_id, query, page["next"], args.limit)
+                    next_page.append(time.perf_counter() - started)
+            print(f"{label:>11} first page: {format_ms(percentiles(first_page))}")
+            print(f"{label:>11} next page:  {format_ms(percentiles(next_page))}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
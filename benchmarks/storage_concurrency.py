@@ -0,0 +1,120 @@
+"""Mixed read/write load against the storage layer: WAL + writer/reader pools vs the old setup.
+
+    python benchmarks/storage_concurrency.py --writers 8 --readers 16 --duration 5
+
+Writers push messages through the write pipeline, readers fetch history pages.
+The "legacy" run uses one engine with aiosqlite's default per-request
+connections and the rollback journal, as database.py did before; the "wal"
+run uses the engines from database.py. Set DATABASE_URL to benchmark another
+backend (the legacy run is then skipped).
+"""
+import argparse
+import asyncio
+import sqlite3
+import time
+from datetime import datetime
+
+from _common import use_temp_workdir, percentiles, format_ms, seed_users
+
+use_temp_workdir()
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+import database
+from models import MessageDB
+from utils.ingest import WritePipeline
+from utils.pagination import fetch_message_page
+
+
+def seed_history(users, history):
+    seed_users(users)
+    conn = sqlite3.connect("chat_app.db")
+    conn.executemany(
+        "INSERT INTO messages (content, sender_id, recipient_id, timestamp) VALUES (?, ?, ?, ?)",
+        ((f"seed {n}", 1 + n % users, 1 + (n + 1) % users, datetime.utcnow().isoformat(" ")) for n in range(history)),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def writer(pipeline, user_id, users, stop, stats):
+    while not stop.is_set():
+        try:
+            await pipeline.write(MessageDB(
+                content="load", sender_id=user_id, recipient_id=1 + user_id % users, timestamp=datetime.utcnow()
+            ))
+            stats["writes"] += 1
+        except OperationalError:
+            stats["errors"] += 1
+
+
+async def reader(session_factory, user_id, users, stop, stats, samples):
+    other = 1 + user_id % users
+    queries = [
+        select(MessageDB).where(MessageDB.sender_id == user_id, MessageDB.recipient_id == other),
+        select(MessageDB).where(MessageDB.sender_id == other, MessageDB.recipient_id == user_id),
+    ]
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            async with session_factory() as db:
+                await fetch_message_page(db, queries, limit=50)
+            samples.append(time.perf_counter() - started)
+            stats["reads"] += 1
+        except OperationalError:
+            stats["errors"] += 1
+
+
+async def run(label, write_factory, read_factory, args):
+    pipeline = WritePipeline(write_factory)
+    pipeline.start()
+    stop = asyncio.Event()
+    stats = {"writes": 0, "reads": 0, "errors": 0}
+    samples = []
+    tasks = [
+        asyncio.create_task(writer(pipeline, 1 + i % args.users, args.users, stop, stats))
+        for i in range(args.writers)
+    ]
+    tasks += [
+        asyncio.create_task(reader(read_factory, 1 + i % args.users, args.users, stop, stats, samples))
+        for i in range(args.readers)
+    ]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    await pipeline.stop()
+    print(
+        f"{label:>7}: {stats['writes'] / args.duration:,.0f} writes/s  {stats['reads'] / args.duration:,.0f} reads/s  "
+        f"errors={stats['errors']}  read latency {format_ms(percentiles(samples))}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--history", type=int, default=100_000)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    await database.init_db()
+    # Смена режима журнала требует, чтобы других соединений не было
+    await database.close_db()
+    if database.IS_SQLITE:
+        seed_history(args.users, args.history)
+        # Старая схема: один движок, новое соединение на каждый запрос, rollback-журнал
+        legacy_engine = create_async_engine("sqlite+aiosqlite:///./chat_app.db")
+        async with legacy_engine.begin() as connection:
+            await connection.exec_driver_sql("PRAGMA journal_mode=DELETE")
+        legacy = async_sessionmaker(bind=legacy_engine, class_=AsyncSession, expire_on_commit=False)
+        await run("legacy", legacy, legacy, args)
+        await legacy_engine.dispose()
+    await run("wal", database.AsyncSessionLocal, database.ReadSessionLocal, args)
+    await database.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
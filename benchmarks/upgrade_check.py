@@ -0,0 +1,88 @@
+"""Upgrade of a database created before the full-text index existed.
+
+    python benchmarks/upgrade_check.py --messages 50
+    python benchmarks/upgrade_check.py --messages 50 --empty-index
+
+Creates the tables without messages_fts and fills them with --messages
+messages directly, as an older release left them, then runs init_db and
+checks that every message is found by search. The messages are older than
+the 30-day DM retention plus one fresh message; a retention run must then
+archive all of them without corrupting the index and leave only the fresh
+one searchable. --empty-index also creates an empty messages_fts, as
+init_db did before it learned to fill the index. Exits with status 1 if a
+check fails.
+"""
+import argparse
+import asyncio
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+from _common import use_temp_workdir, configure_jwt, seed_users
+
+use_temp_workdir()
+configure_jwt()
+
+from sqlalchemy import create_engine
+
+from models import Base
+from database import init_db, close_db, ReadSessionLocal
+from utils.retention import RetentionJob, RetentionPolicy
+from utils.search import search_messages
+
+
+def create_legacy_db(messages, empty_index):
+    engine = create_engine("sqlite:///chat_app.db")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    seed_users(2)
+    old = (datetime.utcnow() - timedelta(days=400)).isoformat(" ")
+    conn = sqlite3.connect("chat_app.db")
+    conn.executemany(
+        "INSERT INTO messages (content, sender_id, recipient_id, timestamp) VALUES (?, 1, 2, ?)",
+        [(f"legacy message {n}", old) for n in range(messages)]
+        + [("fresh message", datetime.utcnow().isoformat(" "))],
+    )
+    if empty_index:
+        conn.execute(
+            "CREATE VIRTUAL TABLE messages_fts USING fts5("
+            "content, content='messages', content_rowid='id', tokenize='unicode61')"
+        )
+    conn.commit()
+    conn.close()
+
+
+async def found(query, limit):
+    async with ReadSessionLocal() as db:
+        page = await search_messages(db, 1, query, limit=limit)
+    return len(page["items"])
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--empty-index", action="store_true")
+    args = parser.parse_args()
+
+    create_legacy_db(args.messages, args.empty_index)
+    failed = []
+    try:
+        await init_db()
+        hits = await found("legacy", args.messages)
+        print(f"search after init_db: {hits} of {args.messages} messages")
+        if hits != args.messages:
+            failed.append("search")
+        stats = await RetentionJob(RetentionPolicy(dm=30), pause=0, notification_days=0).run_once()
+        legacy, fresh = await found("legacy", args.messages), await found("fresh", 1)
+        print(f"retention: {stats['archived']} archived, search finds {legacy} legacy and {fresh} fresh")
+        if stats["archived"] != args.messages or legacy != 0 or fresh != 1:
+            failed.append("retention")
+    finally:
+        await close_db()
+    if failed:
+        print("FAILED:", ", ".join(failed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
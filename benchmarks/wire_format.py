@@ -0,0 +1,96 @@
+"""Bytes per event and client parse CPU for the JSON and MessagePack wire formats.
+
+    python benchmarks/wire_format.py --events 20000
+
+Sizes are reported raw and after permessage-deflate, simulated with a raw
+deflate stream that keeps its context between messages, as browsers and the
+websockets library negotiate by default. A live connection then checks that
+the server negotiates permessage-deflate and delivers binary frames for
+?encoding=msgpack. Requires msgpack.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from _common import use_temp_workdir, configure_jwt, free_port, serve, seed_users
+
+use_temp_workdir()
+configure_jwt()
+
+import msgpack
+import websockets
+
+from main import app
+from database import init_db
+from dependencies import create_access_token
+from utils.frames import EncodedFrame
+
+
+def make_events(count):
+    rng = random.Random(1)
+    start = datetime.utcnow()
+    for n in range(count):
+        yield {
+            "type": "group_message",
+            "group_id": rng.randint(1, 50),
+            "group_name": "engineering-announcements",
+            "sender_id": rng.randint(1, 5000),
+            "sender_name": f"user{rng.randint(1, 5000)}",
+            "content": rng.choice(["ok", "on my way", "Deploy finished, dashboards look healthy."]),
+            "timestamp": (start + timedelta(milliseconds=n * 37)).isoformat(),
+        }
+
+
+def deflated_size(payloads):
+    stream = zlib.compressobj(wbits=-15)
+    total = 0
+    for payload in payloads:
+        total += len(stream.compress(payload) + stream.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return total
+
+
+def parse_cpu(payloads, parse):
+    start = time.process_time()
+    for payload in payloads:
+        parse(payload)
+    return time.process_time() - start
+
+
+async def live_check():
+    await init_db()
+    seed_users(2)
+    token = create_access_token({"sub": "user1"})
+    async with serve(app, free_port()) as host:
+        async with websockets.connect(f"ws://{host}/ws/chat?token={token}&encoding=msgpack") as ws:
+            extensions = [extension.name for extension in ws.extensions]
+            await ws.send(msgpack.packb({"type": "personal", "recipient_id": 1, "content": "self"}))
+            frame = await asyncio.wait_for(ws.recv(), 5)
+    print(f"live: extensions={extensions}  frame={type(frame).__name__}  event={msgpack.unpackb(frame)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args()
+
+    frames = [EncodedFrame(event) for event in make_events(args.events)]
+    formats = {
+        "json": ([frame.text.encode() for frame in frames], json.loads),
+        "msgpack": ([frame.binary for frame in frames], msgpack.unpackb),
+    }
+    print(f"{'format':>8} {'bytes/event':>12} {'deflated':>10} {'parse us/event':>15}")
+    for name, (payloads, parse) in formats.items():
+        raw = sum(len(payload) for payload in payloads) / args.events
+        deflated = deflated_size(payloads) / args.events
+        cpu = parse_cpu(payloads, parse) / args.events
+        print(f"{name:>8} {raw:>12.1f} {deflated:>10.1f} {cpu * 1e6:>15.2f}")
+
+    asyncio.run(live_check())
+
+
+if __name__ == "__main__":
+    main()
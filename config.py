@@ -0,0 +1,128 @@
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes", "on")
+
+
+# База данных: sqlite:///..., postgresql://... (async-драйвер подставляется сам).
+# DATABASE_READ_URL — необязательная реплика для чтения
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./chat_app.db")
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+DB_WRITE_POOL_SIZE = _env_int("DB_WRITE_POOL_SIZE", 5)
+DB_READ_POOL_SIZE = _env_int("DB_READ_POOL_SIZE", 8)
+# Прагмы SQLite; cache_size < 0 — размер в КиБ
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+SQLITE_CACHE_SIZE = _env_int("SQLITE_CACHE_SIZE", -64000)
+SQLITE_MMAP_SIZE = _env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+
+# Подпись JWT; пустые значения нужно задать перед запуском
+SECRET_KEY = os.getenv("SECRET_KEY", "")
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "")
+
+# Исходящая очередь каждого WebSocket-соединения
+OUTBOUND_QUEUE_SIZE = _env_int("OUTBOUND_QUEUE_SIZE", 256)
+# drop_oldest | disconnect | block
+OUTBOUND_OVERFLOW_POLICY = os.getenv("OUTBOUND_OVERFLOW_POLICY", "drop_oldest")
+OUTBOUND_BLOCK_TIMEOUT = _env_float("OUTBOUND_BLOCK_TIMEOUT", 1.0)
+SEND_TIMEOUT = _env_float("SEND_TIMEOUT", 5.0)
+# Склейка исходящих событий для клиентов, подключившихся с ?batch=1
+BATCH_MAX_DELAY = _env_float("BATCH_MAX_DELAY", 0.005)
+BATCH_MAX_BYTES = _env_int("BATCH_MAX_BYTES", 64 * 1024)
+# permessage-deflate для WebSocket, если клиент его предлагает
+WS_PER_MESSAGE_DEFLATE = _env_bool("WS_PER_MESSAGE_DEFLATE", True)
+# Пинги протокола WebSocket от uvicorn: браузеры отвечают на них сами,
+# и соединение без ответа закрывается сервером
+WS_PING_INTERVAL = _env_float("WS_PING_INTERVAL", 20.0)
+WS_PING_TIMEOUT = _env_float("WS_PING_TIMEOUT", 20.0)
+# Пульс приложения (utils/manager.py): клиенту, подключившемуся с heartbeat=1
+# или приславшему {"type": "pong"}, после HEARTBEAT_INTERVAL секунд тишины уходит
+# {"type": "ping"}, а после HEARTBEAT_IDLE_TIMEOUT секунд он отключается;
+# с HEARTBEAT_STRICT — любой клиент. 0 — пульс выключен
+HEARTBEAT_INTERVAL = _env_float("HEARTBEAT_INTERVAL", 25.0)
+HEARTBEAT_IDLE_TIMEOUT = _env_float("HEARTBEAT_IDLE_TIMEOUT", 75.0)
+HEARTBEAT_STRICT = _env_bool("HEARTBEAT_STRICT", False)
+
+# Пакетная запись сообщений и уведомлений (group commit)
+INGEST_MAX_BATCH = _env_int("INGEST_MAX_BATCH", 500)
+INGEST_MAX_DELAY = _env_float("INGEST_MAX_DELAY", 0.002)
+
+# memory:// — один процесс; unix:///path/to.sock — брокер для нескольких воркеров
+BACKPLANE_URL = os.getenv("BACKPLANE_URL", "memory://")
+# Брокер отключает воркер, у которого столько байт событий ещё не отправлено:
+# отставший воркер переподключается, а не раздувает память брокера
+BACKPLANE_MAX_BUFFER = _env_int("BACKPLANE_MAX_BUFFER", 16 * 1024 * 1024)
+
+# Кэш декодированных токенов и пользователей для get_current_user
+TOKEN_CACHE_SIZE = _env_int("TOKEN_CACHE_SIZE", 10000)
+TOKEN_CACHE_TTL = _env_float("TOKEN_CACHE_TTL", 60.0)
+
+# Хеширование паролей
+BCRYPT_ROUNDS = _env_int("BCRYPT_ROUNDS", 12)
+PASSWORD_WORKERS = _env_int("PASSWORD_WORKERS", os.cpu_count() or 1)
+PASSWORD_MAX_QUEUE = _env_int("PASSWORD_MAX_QUEUE", 64)
+
+# Кэш последних сообщений переписок для первой страницы истории
+HISTORY_CACHE_SIZE = _env_int("HISTORY_CACHE_SIZE", 100)
+HISTORY_CACHE_CONVERSATIONS = _env_int("HISTORY_CACHE_CONVERSATIONS", 5000)
+
+# Семплирующий профилировщик цикла событий (/metrics/profiler); по умолчанию выключен
+PROFILER_ENDPOINTS = _env_bool("PROFILER_ENDPOINTS", False)
+PROFILER_INTERVAL = _env_float("PROFILER_INTERVAL", 0.005)
+
+# Максимум идентификаторов в одном запросе на создание группы или массовое изменение состава
+GROUP_BULK_MAX_IDS = _env_int("GROUP_BULK_MAX_IDS", 5000)
+# Максимум идентификаторов в PUT /auth/notifications/read
+NOTIFICATION_BULK_MAX_IDS = _env_int("NOTIFICATION_BULK_MAX_IDS", 1000)
+
+# Досылка пропущенного при переподключении (/ws/chat, {"type": "sync"}):
+# строк за один запрос к БД и максимум сообщений на один ответ
+SYNC_BATCH_SIZE = _env_int("SYNC_BATCH_SIZE", 100)
+SYNC_MAX_MESSAGES = _env_int("SYNC_MAX_MESSAGES", 5000)
+
+# Потоковая выгрузка переписки (/export): строк за один запрос к БД
+EXPORT_CHUNK_SIZE = _env_int("EXPORT_CHUNK_SIZE", 1000)
+
+# Хранение истории (utils/retention.py). Фоновую задачу включают ровно в одном
+# процессе; политика — JSON, сроки в днях, null — хранить всегда:
+# {"dm": 365, "groups": 180, "group_overrides": {"42": 30, "7": null}}
+RETENTION_ENABLED = _env_bool("RETENTION_ENABLED", False)
+RETENTION_POLICIES = os.getenv("RETENTION_POLICIES", "{}")
+RETENTION_INTERVAL = _env_float("RETENTION_INTERVAL", 3600.0)
+RETENTION_CHUNK_SIZE = _env_int("RETENTION_CHUNK_SIZE", 500)
+# Пауза между порциями, чтобы конвейер записи успевал коммитить живой трафик
+RETENTION_PAUSE = _env_float("RETENTION_PAUSE", 0.05)
+# Прочитанные уведомления старше N дней удаляются; 0 — не удалять
+NOTIFICATION_RETENTION_DAYS = _env_float("NOTIFICATION_RETENTION_DAYS", 30)
+# Страниц за один шаг PRAGMA incremental_vacuum
+VACUUM_STEP_PAGES = _env_int("VACUUM_STEP_PAGES", 256)
+
+# Допуск входящих событий /ws/chat (utils/admission.py): корзины токенов,
+# событий в секунду и запас на всплеск
+WS_RATE_CONNECTION = _env_float("WS_RATE_CONNECTION", 20.0)
+WS_BURST_CONNECTION = _env_float("WS_BURST_CONNECTION", 40.0)
+WS_RATE_USER = _env_float("WS_RATE_USER", 30.0)
+WS_BURST_USER = _env_float("WS_BURST_USER", 60.0)
+# Для группы — доставок в секунду: сообщение стоит столько токенов,
+# сколько у группы подключённых участников
+WS_RATE_GROUP = _env_float("WS_RATE_GROUP", 1000.0)
+WS_BURST_GROUP = _env_float("WS_BURST_GROUP", 2000.0)
+# Максимальный размер входящего кадра. Его же получает uvicorn (ws_max_size):
+# больший кадр не буферизуется целиком, соединение закрывается с 1009.
+# Проверка в приложении отвечает кадром ошибки, если сервер запущен без этого лимита
+WS_MAX_FRAME_BYTES = _env_int("WS_MAX_FRAME_BYTES", 64 * 1024)
+# Перегрузка по глубине очереди конвейера записи: с первого порога
+# не пишутся уведомления о сообщениях, со второго отклоняются сами сообщения
+OVERLOAD_SHED_DEPTH = _env_int("OVERLOAD_SHED_DEPTH", 2000)
+OVERLOAD_REJECT_DEPTH = _env_int("OVERLOAD_REJECT_DEPTH", 10000)
+# Отказов подряд, после которых соединение закрывается с кодом 1008
+WS_MAX_REJECTIONS = _env_int("WS_MAX_REJECTIONS", 100)
@@ -1,21 +1,151 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from models import Base
+import time
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./chat_app.db"
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+import config
+from models import Base, group_members
+from utils import search
+from utils.metrics import DB_COMMIT_SECONDS, DB_QUERY_SECONDS
+
+# Синхронные схемы из окружения переводятся на async-драйверы
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def _async_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=_ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+SQLALCHEMY_DATABASE_URL = _async_url(config.DATABASE_URL)
+SQLALCHEMY_READ_DATABASE_URL = _async_url(config.DATABASE_READ_URL or config.DATABASE_URL)
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.get_backend_name() == "sqlite"
+
+
+def _sqlite_pragmas(read_only: bool):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            # Действует только для нового файла (до создания таблиц); существующую
+            # базу переводит python -m utils.retention enable-incremental-vacuum
+            cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL: читатели не блокируют писателя и друг друга
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size={config.SQLITE_CACHE_SIZE}")
+        cursor.execute(f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+    return on_connect
+
+
+def _create_engine(url, pool_size: int, read_only: bool):
+    if url.get_backend_name() != "sqlite":
+        return create_async_engine(url, pool_size=pool_size, pool_pre_ping=True)
+    # aiosqlite по умолчанию открывает файл заново на каждый запрос (NullPool);
+    # постоянные соединения сохраняют прагмы, кэш страниц и mmap
+    engine = create_async_engine(
+        url,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+        connect_args={"timeout": config.SQLITE_BUSY_TIMEOUT_MS / 1000},
+    )
+    event.listen(engine.sync_engine, "connect", _sqlite_pragmas(read_only))
+    return engine
+
+
+def _instrument(engine, label: str):
+    # Время запроса считается по курсору драйвера, без ожидания соединения из пула
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERY_SECONDS.observe(time.perf_counter() - conn.info.pop("query_started"), engine=label)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_execute)
+    return engine
+
+
+@event.listens_for(Session, "before_commit")
+def _commit_started(session):
+    session.info["commit_started"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_commit")
+def _commit_finished(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+
+@event.listens_for(Session, "after_rollback")
+def _commit_failed(session):
+    session.info.pop("commit_started", None)
+
+
+# SQLite допускает одного писателя, поэтому все записи идут через одно
+# соединение, а чтения — через отдельный пул соединений только для чтения.
+# Для PostgreSQL это два обычных пула (читатель может смотреть на реплику).
+engine = _instrument(_create_engine(
+    SQLALCHEMY_DATABASE_URL, 1 if IS_SQLITE else config.DB_WRITE_POOL_SIZE, read_only=False
+), "writer")
+read_engine = _instrument(
+    _create_engine(SQLALCHEMY_READ_DATABASE_URL, config.DB_READ_POOL_SIZE, read_only=True), "reader"
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+ReadSessionLocal = async_sessionmaker(
+    bind=read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_read_db():
+    async with ReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-def init_db():
-    Base.metadata.create_all(bind=engine)
+def _create_missing_indexes(connection):
+    # create_all не добавляет новые индексы к уже существующим таблицам
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+def _deduplicate_group_members(connection):
+    # Раньше создатель, указанный и в member_ids, записывался в группу дважды;
+    # уникальный индекс не создастся, пока такие пары не схлопнуты
+    indexes = inspect(connection).get_indexes("group_members")
+    if any(index["name"] == "ux_group_members_group_user" for index in indexes):
+        return
+    pair = (group_members.c.group_id, group_members.c.user_id)
+    duplicates = connection.execute(select(*pair).group_by(*pair).having(func.count() > 1)).all()
+    for group_id, user_id in duplicates:
+        connection.execute(
+            group_members.delete().where(group_members.c.group_id == group_id, group_members.c.user_id == user_id)
+        )
+        connection.execute(group_members.insert().values(group_id=group_id, user_id=user_id))
+
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_deduplicate_group_members)
+        await conn.run_sync(_create_missing_indexes)
+        await conn.run_sync(search.create_index)
+
+async def close_db():
+    await engine.dispose()
+    await read_engine.dispose()
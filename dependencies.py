@@ -1,18 +1,33 @@
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from fastapi import HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
 from typing import Optional
+import config
 from models import UserDB, fake_users_db
-from database import get_db
+from database import get_read_db
+from utils.password_pool import password_pool
+from utils.metrics import TOKEN_CACHE_ENTRIES, TOKEN_CACHE_EVICTIONS, TOKEN_CACHE_HITS, TOKEN_CACHE_MISSES, TOKEN_DECODES
+from utils.token_cache import TokenCache, UserPrincipal
 
-SECRET_KEY = ""
-ALGORITHM = ""
+SECRET_KEY = config.SECRET_KEY
+ALGORITHM = config.JWT_ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=config.BCRYPT_ROUNDS)
+token_cache = TokenCache()
+TOKEN_CACHE_HITS.set_function(lambda: token_cache.hits)
+TOKEN_CACHE_MISSES.set_function(lambda: token_cache.misses)
+TOKEN_CACHE_EVICTIONS.set_function(lambda: token_cache.evictions)
+TOKEN_CACHE_ENTRIES.set_function(lambda: len(token_cache))
+
+@event.listens_for(UserDB, "after_update")
+@event.listens_for(UserDB, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    token_cache.invalidate_user(target.id)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -30,14 +45,18 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(UserDB).filter(UserDB.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(UserDB).where(UserDB.username == username))
+    return result.scalars().first()
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user_by_username(db, username)
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user_by_username(db, username)
+    # Соединение возвращается в пул до проверки bcrypt; загруженные
+    # атрибуты пользователя остаются доступны
+    await db.close()
     if not user:
         return False
-    if not verify_password(password, user.password):
+    if not await password_pool.run(verify_password, password, user.password):
         return False
     return user
 
@@ -54,12 +73,17 @@ async def get_current_user_legacy(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="",
         headers={"Authenticate": "Bearer"},
     )
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
+    
+    TOKEN_DECODES.inc()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -68,9 +92,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = get_user_by_username(db, username)
+    user = await get_user_by_username(db, username)
     if user is None:
         if username in fake_users_db:
             return username
         raise credentials_exception
-    return user
+    
+    principal = UserPrincipal.from_user(user)
+    token_cache.put(token, principal, payload.get("exp"))
+    return principal
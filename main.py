@@ -1,7 +1,14 @@
+import time
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routers import auth, ws_chat, groups, messages
-from database import init_db
+import config
+from routers import auth, ws_chat, groups, messages, metrics
+from database import init_db, close_db
+from utils.ingest import pipeline
+from utils.manager import manager
+from utils.retention import retention
+from utils.metrics import HTTP_REQUEST_SECONDS
 
 app = FastAPI(title="FastAPI WebSocket Chat")
 
@@ -13,14 +20,62 @@ app.add_middleware(
     allow_headers=["*"],  
 )
 
+class RequestTimer:
+    # Обычное ASGI-middleware вместо @app.middleware("http"): без лишней обёртки
+    # запроса и ответа, и время фиксируется после последнего чанка ответа,
+    # так что потоковая выгрузка NDJSON учитывается целиком
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_and_record_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            # Метка — шаблон маршрута (/groups/{group_id}), а не сам путь,
+            # чтобы число рядов не росло с числом идентификаторов
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=route.path if route is not None else "unmatched",
+                status=status_code,
+            )
+
+app.add_middleware(RequestTimer)
+
 @app.on_event("startup")
 async def startup_event():
-    init_db()
+    await init_db()
+    pipeline.start()
+    await manager.start()
+    # Задачу хранения запускает ровно один процесс
+    if config.RETENTION_ENABLED:
+        retention.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await retention.stop()
+    await manager.stop()
+    await pipeline.stop()
+    await close_db()
 
 app.include_router(auth.router)
 app.include_router(ws_chat.router)
 app.include_router(groups.router)
 app.include_router(messages.router)
+app.include_router(metrics.router)
 
 @app.get("/")
 async def root():
@@ -35,3 +90,15 @@ async def root():
             "Real-time notifications"
         ]
     }
+
+if __name__ == "__main__":
+    # При запуске через CLI то же самое задают --ws-per-message-deflate,
+    # --ws-max-size, --ws-ping-interval и --ws-ping-timeout
+    import uvicorn
+    uvicorn.run(
+        app, host="0.0.0.0", port=8000,
+        ws_per_message_deflate=config.WS_PER_MESSAGE_DEFLATE,
+        ws_max_size=config.WS_MAX_FRAME_BYTES,
+        ws_ping_interval=config.WS_PING_INTERVAL,
+        ws_ping_timeout=config.WS_PING_TIMEOUT,
+    )
@@ -1,10 +1,12 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Table, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Table, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
+import config
+
 Base = declarative_base()
 
 # SQLAlchemy 
@@ -12,7 +14,11 @@ group_members = Table(
     "group_members",
     Base.metadata,
     Column("user_id", Integer, ForeignKey("users.id")),
-    Column("group_id", Integer, ForeignKey("groups.id"))
+    Column("group_id", Integer, ForeignKey("groups.id")),
+    # Уникальная пара: проверка членства идёт по индексу, дубликаты невозможны;
+    # обратный индекс — для списка групп пользователя
+    Index("ux_group_members_group_user", "group_id", "user_id", unique=True),
+    Index("ix_group_members_user_group", "user_id", "group_id"),
 )
 
 class UserDB(Base):
@@ -44,6 +50,46 @@ class MessageDB(Base):
     sender = relationship("UserDB", back_populates="messages_sent", foreign_keys=[sender_id])
     group = relationship("GroupDB", back_populates="messages", foreign_keys=[group_id])
 
+    # Составные индексы покрывают и фильтр, и сортировку (timestamp, id)
+    # для курсорной пагинации истории.
+    __table_args__ = (
+        Index("ix_messages_group_timestamp", "group_id", "timestamp", "id"),
+        Index("ix_messages_dm_timestamp", "sender_id", "recipient_id", "timestamp", "id"),
+        Index("ix_messages_recipient_timestamp", "recipient_id", "timestamp", "id"),
+        # Досылка пропущенного: сообщения после последнего увиденного id
+        Index("ix_messages_group_id", "group_id", "id"),
+        Index("ix_messages_recipient_id", "recipient_id", "id"),
+        # Отбор старых сообщений для архивации
+        Index("ix_messages_timestamp", "timestamp"),
+        Index(
+            "ix_messages_sender_dm_timestamp", "sender_id", "timestamp", "id",
+            sqlite_where=recipient_id.isnot(None),
+            postgresql_where=recipient_id.isnot(None),
+        ),
+    )
+
+class ArchivedMessageDB(Base):
+    # Холодный уровень истории (utils/retention.py): старые сообщения переезжают
+    # сюда с прежними id, история читается из обеих таблиц
+    __tablename__ = "messages_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    content = Column(String)
+    sender_id = Column(Integer, ForeignKey("users.id"))
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=True)
+    recipient_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    timestamp = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_messages_archive_group_timestamp", "group_id", "timestamp", "id"),
+        Index("ix_messages_archive_dm_timestamp", "sender_id", "recipient_id", "timestamp", "id"),
+        Index("ix_messages_archive_recipient_timestamp", "recipient_id", "timestamp", "id"),
+        Index(
+            "ix_messages_archive_sender_dm_timestamp", "sender_id", "timestamp", "id",
+            sqlite_where=recipient_id.isnot(None),
+            postgresql_where=recipient_id.isnot(None),
+        ),
+    )
+
 class NotificationDB(Base):
     __tablename__ = "notifications"
     id = Column(Integer, primary_key=True, index=True)
@@ -53,6 +99,12 @@ class NotificationDB(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
     user = relationship("UserDB", back_populates="notifications")
 
+    __table_args__ = (
+        Index("ix_notifications_user_read_timestamp", "user_id", "is_read", "timestamp", "id"),
+        Index("ix_notifications_user_id", "user_id", "id"),
+        Index("ix_notifications_read_timestamp", "is_read", "timestamp"),
+    )
+
 # Pydantic 
 class User(BaseModel):
     username: str
@@ -90,6 +142,17 @@ class MessageResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class MessagePage(BaseModel):
+    items: List[MessageResponse]
+    has_more: bool
+    before: Optional[str] = None
+    after: Optional[str] = None
+
+class MessageSearchPage(BaseModel):
+    items: List[MessageResponse]
+    has_more: bool
+    next: Optional[str] = None
+
 class Group(BaseModel):
     name: str
     member_ids: List[int]
@@ -103,6 +166,21 @@ class GroupResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class GroupMemberIds(BaseModel):
+    user_ids: List[int]
+
+class GroupMemberResult(BaseModel):
+    user_id: int
+    # added, removed, already_member, not_member, not_found
+    status: str
+
+class GroupMembersResponse(BaseModel):
+    group_id: int
+    results: List[GroupMemberResult]
+
+class GroupCreateResponse(GroupResponse):
+    results: List[GroupMemberResult]
+
 class Notification(BaseModel):
     user_id: int
     content: str
@@ -117,6 +195,15 @@ class NotificationResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class NotificationPage(BaseModel):
+    items: List[NotificationResponse]
+    has_more: bool
+    before: Optional[str] = None
+    after: Optional[str] = None
+
+class NotificationIds(BaseModel):
+    ids: List[int] = Field(max_length=config.NOTIFICATION_BULK_MAX_IDS)
+
 # Фейковая БД пользователей 
 fake_users_db = {
     "user1": {"username": "", "password": ""},
@@ -1,35 +1,48 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
-from models import User, UserCreate, UserResponse, Token, fake_users_db, UserDB, NotificationResponse, NotificationDB
+from models import User, UserCreate, UserResponse, Token, fake_users_db, UserDB, NotificationResponse, NotificationDB, NotificationPage, NotificationIds
 from dependencies import create_jwt_token, authenticate_user, get_password_hash, get_current_user
-from database import get_db
+from utils.manager import manager
+from utils.pagination import fetch_page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils.password_pool import password_pool
+from database import AsyncSessionLocal, get_db, get_read_db
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
 @router.post("/register", response_model=UserResponse)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(UserDB).filter(UserDB.username == user.username).first()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_read_db)):
+    result = await db.execute(select(UserDB).where(UserDB.username == user.username))
+    db_user = result.scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
     if user.email:
-        db_email = db.query(UserDB).filter(UserDB.email == user.email).first()
+        result = await db.execute(select(UserDB).where(UserDB.email == user.email))
+        db_email = result.scalars().first()
         if db_email:
             raise HTTPException(status_code=400, detail="Email already registered")
+    # Соединения пулов не держатся, пока идёт bcrypt: у писателя оно одно
+    await db.close()
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await password_pool.run(get_password_hash, user.password)
     db_user = UserDB(username=user.username, password=hashed_password, email=user.email)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    async with AsyncSessionLocal() as write_db:
+        write_db.add(db_user)
+        try:
+            await write_db.commit()
+        except IntegrityError:
+            # Тот же username или email успели зарегистрировать, пока считался хэш
+            raise HTTPException(status_code=400, detail="Username or email already registered")
     return db_user
 
 @router.post("/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_read_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     
     if not user:
         if form_data.username in fake_users_db and fake_users_db[form_data.username]["password"] == form_data.password:
@@ -50,27 +63,89 @@ async def read_users_me(current_user: UserDB = Depends(get_current_user)):
         raise HTTPException(status_code=400, detail="")
     return current_user
 
-@router.get("/notifications", response_model=List[NotificationResponse])
-async def get_notifications(current_user: UserDB = Depends(get_current_user), db: Session = Depends(get_db)):
+@router.get("/notifications", response_model=NotificationPage)
+async def get_notifications(
+    unread_only: bool = False,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
     if isinstance(current_user, str):
         raise HTTPException(status_code=400, detail="")
     
-    notifications = db.query(NotificationDB).filter(NotificationDB.user_id == current_user.id).order_by(NotificationDB.timestamp.desc()).all()
-    return notifications
+    # По запросу на каждое значение is_read, чтобы оба шли по индексу
+    # (user_id, is_read, timestamp, id)
+    states = [False] if unread_only else [False, True]
+    queries = [
+        select(NotificationDB).where(NotificationDB.user_id == current_user.id, NotificationDB.is_read == state)
+        for state in states
+    ]
+    page = await fetch_page(db, NotificationDB, queries, before, after, limit)
+    page["items"].reverse()
+    return page
+
+async def _mark_read(db: AsyncSession, user_id: int, *criteria) -> dict:
+    result = await db.execute(
+        update(NotificationDB)
+        .where(NotificationDB.user_id == user_id, NotificationDB.is_read == False, *criteria)
+        .values(is_read=True)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    await manager.notifications_read(user_id, result.rowcount)
+    return {"status": "success", "updated": result.rowcount}
+
+@router.put("/notifications/read-all")
+async def mark_all_notifications_read(current_user: UserDB = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    if isinstance(current_user, str):
+        raise HTTPException(status_code=400, detail="")
+    
+    return await _mark_read(db, current_user.id)
+
+@router.put("/notifications/read-up-to/{notification_id}")
+async def mark_notifications_read_up_to(
+    notification_id: int,
+    current_user: UserDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if isinstance(current_user, str):
+        raise HTTPException(status_code=400, detail="")
+    
+    return await _mark_read(db, current_user.id, NotificationDB.id <= notification_id)
+
+@router.put("/notifications/read")
+async def mark_notifications_read(
+    notifications: NotificationIds,
+    current_user: UserDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if isinstance(current_user, str):
+        raise HTTPException(status_code=400, detail="")
+    
+    if not notifications.ids:
+        return {"status": "success", "updated": 0}
+    return await _mark_read(db, current_user.id, NotificationDB.id.in_(notifications.ids))
 
 @router.put("/notifications/{notification_id}/read")
-async def mark_notification_read(notification_id: int, current_user: UserDB = Depends(get_current_user), db: Session = Depends(get_db)):
+async def mark_notification_read(notification_id: int, current_user: UserDB = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     if isinstance(current_user, str):
         raise HTTPException(status_code=400, detail="")
     
-    notification = db.query(NotificationDB).filter(
+    result = await db.execute(select(NotificationDB).where(
         NotificationDB.id == notification_id,
         NotificationDB.user_id == current_user.id
-    ).first()
+    ))
+    notification = result.scalars().first()
     
     if not notification:
         raise HTTPException(status_code=404, detail="Notification not found")
     
+    was_unread = not notification.is_read
     notification.is_read = True
-    db.commit()
+    await db.commit()
+    
+    if was_unread:
+        await manager.notifications_read(current_user.id, 1)
     return {"status": "success"}
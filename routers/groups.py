@@ -1,95 +1,180 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import Dict, List, Optional
 
-from models import Group, GroupResponse, UserDB, GroupDB, MessageResponse, MessageDB, Message
+import config
+from models import (
+    Group, GroupResponse, UserDB, GroupDB, MessageResponse, MessageDB, Message, MessagePage, group_members,
+    GroupCreateResponse, GroupMemberIds, GroupMembersResponse,
+)
 from dependencies import get_current_user
-from database import get_db
+from database import get_db, get_read_db
 from utils.manager import manager
+from utils.pagination import fetch_message_page, across_tiers, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils.history_cache import history_cache, group_key
+from utils.membership import get_member_group, member_exists
+from utils.export import export_response
 
 router = APIRouter(prefix="/groups", tags=["Groups"])
 
-@router.post("", response_model=GroupResponse)
-async def create_group(group: Group, current_user: UserDB = Depends(get_current_user), db: Session = Depends(get_db)):
+def _unique_ids(user_ids: List[int]) -> List[int]:
+    user_ids = list(dict.fromkeys(user_ids))
+    if len(user_ids) > config.GROUP_BULK_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {config.GROUP_BULK_MAX_IDS} user ids per request")
+    return user_ids
+
+async def _membership(db: AsyncSession, group_id: int, user_ids: List[int]) -> Dict[int, bool]:
+    # Существование пользователей и членство в группе одним запросом с IN
+    if not user_ids:
+        return {}
+    result = await db.execute(
+        select(UserDB.id, member_exists(group_id, UserDB.id)).where(UserDB.id.in_(user_ids))
+    )
+    return {user_id: bool(is_member) for user_id, is_member in result.all()}
+
+@router.post("", response_model=GroupCreateResponse)
+async def create_group(group: Group, current_user: UserDB = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     if isinstance(current_user, str):
         raise HTTPException(status_code=400, detail="")
     
+    # Создатель может быть указан и в member_ids — пара (группа, участник) уникальна
+    requested = _unique_ids(group.member_ids)
+    member_ids = list(dict.fromkeys([current_user.id, *requested]))
+    result = await db.execute(select(UserDB).where(UserDB.id.in_(member_ids)))
+    users = {user.id: user for user in result.scalars().all()}
+    
+    # Группа и все строки group_members — одна транзакция; участники пишутся
+    # одним executemany мимо связи members, чтобы не помечать UserDB изменёнными
+    added = [user_id for user_id in member_ids if user_id in users]
     db_group = GroupDB(name=group.name)
     db.add(db_group)
-    db.commit()
-    db.refresh(db_group)
-    
-    db_group.members.append(current_user)
+    await db.flush()
+    await db.execute(group_members.insert(), [{"group_id": db_group.id, "user_id": user_id} for user_id in added])
+    await db.commit()
     
-    for member_id in group.member_ids:
-        member = db.query(UserDB).filter(UserDB.id == member_id).first()
-        if member:
-            db_group.members.append(member)
-    
-    db.commit()
-    db.refresh(db_group)
-    
-    for member in db_group.members:
-        if member.id in manager.active_connections:
-            manager.add_user_to_group(member.id, db_group.id)
+    await manager.group_members_added(added, db_group.id, db_group.name)
+    await manager.send_bulk_notification(
+        [user_id for user_id in added if user_id != current_user.id], f"You were added to group {db_group.name}"
+    )
     
-    return db_group
+    return {
+        "id": db_group.id,
+        "name": db_group.name,
+        "created_at": db_group.created_at,
+        "members": [users[user_id] for user_id in added],
+        "results": [
+            {"user_id": user_id, "status": "added" if user_id in users else "not_found"} for user_id in requested
+        ],
+    }
 
 @router.get("", response_model=List[GroupResponse])
-async def get_user_groups(current_user: UserDB = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_user_groups(current_user: UserDB = Depends(get_current_user), db: AsyncSession = Depends(get_read_db)):
     if isinstance(current_user, str):
         raise HTTPException(status_code=400, detail="")
     
-    return current_user.groups
+    # Два запроса на весь список: группы по индексу (user_id, group_id)
+    # и участники всех групп одним IN
+    result = await db.execute(
+        select(GroupDB)
+        .join(group_members, group_members.c.group_id == GroupDB.id)
+        .where(group_members.c.user_id == current_user.id)
+        .options(selectinload(GroupDB.members))
+    )
+    return result.scalars().all()
 
 @router.get("/{group_id}", response_model=GroupResponse)
-async def get_group(group_id: int, current_user: UserDB = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_group(group_id: int, current_user: UserDB = Depends(get_current_user), db: AsyncSession = Depends(get_read_db)):
     if isinstance(current_user, str):
         raise HTTPException(status_code=400, detail="")
     
-    group = db.query(GroupDB).filter(GroupDB.id == group_id).first()
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
+    return await get_member_group(db, group_id, current_user.id, selectinload(GroupDB.members))
+
+@router.post("/{group_id}/members", response_model=GroupMembersResponse)
+async def add_members_to_group(
+    group_id: int,
+    members: GroupMemberIds,
+    current_user: UserDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if isinstance(current_user, str):
+        raise HTTPException(status_code=400, detail="")
     
-    if current_user not in group.members:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
+    user_ids = _unique_ids(members.user_ids)
+    group = await get_member_group(db, group_id, current_user.id)
+    membership = await _membership(db, group_id, user_ids)
+    
+    added = [user_id for user_id in user_ids if membership.get(user_id) is False]
+    if added:
+        await db.execute(group_members.insert(), [{"group_id": group_id, "user_id": user_id} for user_id in added])
+        await db.commit()
+        await manager.group_members_added(added, group_id, group.name)
+        await manager.send_bulk_notification(added, f"You were added to group {group.name}")
+    
+    statuses = {None: "not_found", True: "already_member", False: "added"}
+    return {
+        "group_id": group_id,
+        "results": [{"user_id": user_id, "status": statuses[membership.get(user_id)]} for user_id in user_ids],
+    }
+
+@router.delete("/{group_id}/members", response_model=GroupMembersResponse)
+async def remove_members_from_group(
+    group_id: int,
+    members: GroupMemberIds,
+    current_user: UserDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if isinstance(current_user, str):
+        raise HTTPException(status_code=400, detail="")
     
-    return group
+    user_ids = _unique_ids(members.user_ids)
+    group = await get_member_group(db, group_id, current_user.id)
+    membership = await _membership(db, group_id, user_ids)
+    
+    removed = [user_id for user_id in user_ids if membership.get(user_id)]
+    if removed:
+        await db.execute(
+            group_members.delete().where(group_members.c.group_id == group_id, group_members.c.user_id.in_(removed))
+        )
+        await db.commit()
+        await manager.group_members_removed(removed, group_id)
+        await manager.send_bulk_notification(removed, f"You were removed from group {group.name}")
+    
+    statuses = {None: "not_found", True: "removed", False: "not_member"}
+    return {
+        "group_id": group_id,
+        "results": [{"user_id": user_id, "status": statuses[membership.get(user_id)]} for user_id in user_ids],
+    }
 
 @router.post("/{group_id}/members/{user_id}")
 async def add_member_to_group(
     group_id: int, 
     user_id: int, 
     current_user: UserDB = Depends(get_current_user), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     if isinstance(current_user, str):
         raise HTTPException(status_code=400, detail="")
     
-    group = db.query(GroupDB).filter(GroupDB.id == group_id).first()
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
+    group = await get_member_group(db, group_id, current_user.id)
     
-    if current_user not in group.members:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
-    
-    user_to_add = db.query(UserDB).filter(UserDB.id == user_id).first()
-    if not user_to_add:
+    result = await db.execute(select(UserDB.id, member_exists(group_id, UserDB.id)).where(UserDB.id == user_id))
+    row = result.first()
+    if row is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    if user_to_add in group.members:
+    if row[1]:
         raise HTTPException(status_code=400, detail="User is already a member of this group")
     
-    group.members.append(user_to_add)
-    db.commit()
+    await db.execute(group_members.insert().values(group_id=group_id, user_id=user_id))
+    await db.commit()
     
-    if user_id in manager.active_connections:
-        manager.add_user_to_group(user_id, group_id)
+    await manager.group_members_added([user_id], group_id, group.name)
     
     await manager.send_notification(
         user_id=user_id,
-        content=f"You were added to group {group.name}",
-        db=db
+        content=f"You were added to group {group.name}"
     )
     
     return {"status": "success"}
@@ -99,84 +184,88 @@ async def remove_member_from_group(
     group_id: int, 
     user_id: int, 
     current_user: UserDB = Depends(get_current_user), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     if isinstance(current_user, str):
         raise HTTPException(status_code=400, detail="")
     
-    group = db.query(GroupDB).filter(GroupDB.id == group_id).first()
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    
-    if current_user not in group.members:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
+    group = await get_member_group(db, group_id, current_user.id)
     
-    user_to_remove = db.query(UserDB).filter(UserDB.id == user_id).first()
-    if not user_to_remove:
+    result = await db.execute(select(UserDB.id, member_exists(group_id, UserDB.id)).where(UserDB.id == user_id))
+    row = result.first()
+    if row is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    if user_to_remove not in group.members:
+    if not row[1]:
         raise HTTPException(status_code=400, detail="User is not a member of this group")
     
-    group.members.remove(user_to_remove)
-    db.commit()
+    await db.execute(
+        group_members.delete().where(group_members.c.group_id == group_id, group_members.c.user_id == user_id)
+    )
+    await db.commit()
     
-    if user_id in manager.active_connections:
-        manager.remove_user_from_group(user_id, group_id)
+    await manager.group_members_removed([user_id], group_id)
     
     await manager.send_notification(
         user_id=user_id,
-        content=f"You were removed from group {group.name}",
-        db=db
+        content=f"You were removed from group {group.name}"
     )
     
     return {"status": "success"}
 
-@router.get("/{group_id}/messages", response_model=List[MessageResponse])
+@router.get("/{group_id}/messages", response_model=MessagePage)
 async def get_group_messages(
     group_id: int, 
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     current_user: UserDB = Depends(get_current_user), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     if isinstance(current_user, str):
         raise HTTPException(status_code=400, detail="")
     
-    group = db.query(GroupDB).filter(GroupDB.id == group_id).first()
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
+    await get_member_group(db, group_id, current_user.id)
     
-    if current_user not in group.members:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
+    queries = across_tiers(lambda model: [select(model).where(model.group_id == group_id)])
+    if before is None and after is None:
+        return await history_cache.first_page(group_key(group_id), db, queries, limit)
+    return await fetch_message_page(db, queries, before, after, limit)
+
+@router.get("/{group_id}/export")
+async def export_group_messages(
+    group_id: int,
+    after: Optional[str] = None,
+    until: Optional[str] = None,
+    gzip: bool = False,
+    current_user: UserDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    if isinstance(current_user, str):
+        raise HTTPException(status_code=400, detail="")
+    
+    await get_member_group(db, group_id, current_user.id)
     
-    messages = db.query(MessageDB).filter(MessageDB.group_id == group_id).order_by(MessageDB.timestamp).all()
-    return messages
+    # NDJSON потоком, без сборки всей истории в памяти
+    return await export_response(
+        db, lambda model: [[model.group_id == group_id]], f"group-{group_id}", after, until, gzip
+    )
 
 @router.post("/{group_id}/messages", response_model=MessageResponse)
 async def send_group_message(
     group_id: int,
     message: Message,
     current_user: UserDB = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     if isinstance(current_user, str):
         raise HTTPException(status_code=400, detail="")
     
-    group = db.query(GroupDB).filter(GroupDB.id == group_id).first()
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    
-    if current_user not in group.members:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
+    group = await get_member_group(db, group_id, current_user.id)
+    # Соединение чтения возвращается в пул до ожидания group commit
+    await db.close()
     
-    db_message = MessageDB(
-        content=message.content,
-        sender_id=current_user.id,
-        group_id=group_id
+    return await manager.send_group_message(
+        group_id, current_user.id, message.content,
+        sender_name=current_user.username, group_name=group.name
     )
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    
-    await manager.send_group_message(group_id, current_user.id, message.content, db)
-    
-    return db_message
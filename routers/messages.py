@@ -1,72 +1,128 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
-from models import Message, MessageResponse, UserDB, MessageDB
+from models import Message, MessageResponse, UserDB, MessageDB, MessagePage, MessageSearchPage
 from dependencies import get_current_user
-from database import get_db
+from database import get_db, get_read_db
 from utils.manager import manager
+from utils.pagination import fetch_message_page, across_tiers, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils.search import search_messages
+from utils.history_cache import history_cache, dm_key
+from utils.export import export_response
 
 router = APIRouter(prefix="/messages", tags=["Messages"])
 
-@router.get("", response_model=List[MessageResponse])
-async def get_user_messages(current_user: UserDB = Depends(get_current_user), db: Session = Depends(get_db)):
+def _dm_directions(user_id: int, other_id: int):
+    # Переписка с самим собой — одно направление
+    if user_id == other_id:
+        return [(user_id, other_id)]
+    return [(user_id, other_id), (other_id, user_id)]
+
+@router.get("", response_model=MessagePage)
+async def get_user_messages(
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
     if isinstance(current_user, str):
         raise HTTPException(status_code=400, detail="")
     
-    messages = db.query(MessageDB).filter(
-        ((MessageDB.sender_id == current_user.id) | (MessageDB.recipient_id == current_user.id)) &
-        (MessageDB.group_id == None)
-    ).order_by(MessageDB.timestamp).all()
+    # Исходящие и входящие читаются отдельными запросами, чтобы каждый
+    # шёл по своему индексу, а не по OR с сортировкой всей переписки.
+    queries = across_tiers(lambda model: [
+        select(model).where(model.sender_id == current_user.id, model.recipient_id != None),
+        select(model).where(
+            model.recipient_id == current_user.id,
+            model.sender_id != current_user.id,
+        ),
+    ])
+    return await fetch_message_page(db, queries, before, after, limit)
+
+@router.get("/search", response_model=MessageSearchPage)
+async def search_user_messages(
+    q: str = Query(..., min_length=1, max_length=256),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    if isinstance(current_user, str):
+        raise HTTPException(status_code=400, detail="")
     
-    return messages
+    # Поиск только по личной переписке пользователя и его группам, лучшие совпадения первыми
+    return await search_messages(db, current_user.id, q, cursor, limit)
 
-@router.get("/with/{user_id}", response_model=List[MessageResponse])
+@router.get("/with/{user_id}", response_model=MessagePage)
 async def get_messages_with_user(
     user_id: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     current_user: UserDB = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     if isinstance(current_user, str):
         raise HTTPException(status_code=400, detail="")
     
-    other_user = db.query(UserDB).filter(UserDB.id == user_id).first()
+    result = await db.execute(select(UserDB).where(UserDB.id == user_id))
+    other_user = result.scalars().first()
     if not other_user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    messages = db.query(MessageDB).filter(
-        (
-            ((MessageDB.sender_id == current_user.id) & (MessageDB.recipient_id == user_id)) |
-            ((MessageDB.sender_id == user_id) & (MessageDB.recipient_id == current_user.id))
-        ) &
-        (MessageDB.group_id == None)
-    ).order_by(MessageDB.timestamp).all()
+    queries = across_tiers(lambda model: [
+        select(model).where(model.sender_id == sender, model.recipient_id == recipient)
+        for sender, recipient in _dm_directions(current_user.id, user_id)
+    ])
+    if before is None and after is None:
+        return await history_cache.first_page(dm_key(current_user.id, user_id), db, queries, limit)
+    return await fetch_message_page(db, queries, before, after, limit)
+
+@router.get("/with/{user_id}/export")
+async def export_messages_with_user(
+    user_id: int,
+    after: Optional[str] = None,
+    until: Optional[str] = None,
+    gzip: bool = False,
+    current_user: UserDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    if isinstance(current_user, str):
+        raise HTTPException(status_code=400, detail="")
     
-    return messages
+    result = await db.execute(select(UserDB.id).where(UserDB.id == user_id))
+    if result.first() is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    return await export_response(
+        db,
+        lambda model: [
+            [model.sender_id == sender, model.recipient_id == recipient]
+            for sender, recipient in _dm_directions(current_user.id, user_id)
+        ],
+        f"messages-{current_user.id}-{user_id}", after, until, gzip
+    )
 
 @router.post("/to/{recipient_id}", response_model=MessageResponse)
 async def send_message(
     recipient_id: int,
     message: Message,
     current_user: UserDB = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     if isinstance(current_user, str):
         raise HTTPException(status_code=400, detail="")
     
-    recipient = db.query(UserDB).filter(UserDB.id == recipient_id).first()
+    result = await db.execute(select(UserDB).where(UserDB.id == recipient_id))
+    recipient = result.scalars().first()
     if not recipient:
         raise HTTPException(status_code=404, detail="Recipient not found")
+    # Соединение чтения возвращается в пул до ожидания group commit
+    await db.close()
     
-    db_message = MessageDB(
-        content=message.content,
-        sender_id=current_user.id,
-        recipient_id=recipient_id
+    return await manager.send_personal_message(
+        recipient_id, current_user.id, message.content, sender_name=current_user.username
     )
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    
-    await manager.send_personal_message(recipient_id, current_user.id, message.content, db)
-    
-    return db_message
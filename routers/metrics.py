@@ -0,0 +1,40 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+import config
+from utils.metrics import registry
+from utils.profiler import profiler
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+@router.get("", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+def _check_profiler_enabled():
+    if not config.PROFILER_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@router.get("/profiler")
+async def get_profiler_status():
+    _check_profiler_enabled()
+    return profiler.status()
+
+@router.post("/profiler/start")
+async def start_profiler(interval: float = Query(config.PROFILER_INTERVAL, gt=0, le=1)):
+    _check_profiler_enabled()
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    # Обработчик выполняется в потоке цикла событий — его и профилируем
+    profiler.start(interval)
+    return profiler.status()
+
+@router.post("/profiler/stop", response_class=PlainTextResponse)
+async def stop_profiler():
+    _check_profiler_enabled()
+    if not profiler.running:
+        raise HTTPException(status_code=409, detail="Profiler is not running")
+    # Свёрнутые стеки: flamegraph.pl или speedscope строят по ним граф
+    return PlainTextResponse(profiler.stop())
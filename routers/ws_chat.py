@@ -1,77 +1,214 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
 from fastapi.websockets import WebSocketState
 from dependencies import get_current_user
+import config
 from utils.manager import manager
-from database import get_db, SessionLocal
-from sqlalchemy.orm import Session
-import json
+from utils import frames
+from utils.frames import EncodedFrame
+from utils.sync import sync_missed
+from utils.metrics import WS_FRAMES_RECEIVED
+from utils.admission import Rejected, TokenBucket, admission, check_frame_size, reject_invalid
+from utils.connection import ClientConnection
+from database import ReadSessionLocal
+from models import GroupDB, group_members
+from sqlalchemy import select
+import asyncio
 from typing import Dict, Any, Optional, Union
 
 router = APIRouter(prefix="/ws", tags=["WebSocket Chat"])
 
-@router.websocket("/chat")
-async def websocket_chat(websocket: WebSocket, token: str):
-    db = SessionLocal()
+async def handle_client_event(user_id: int, message_data: Dict[str, Any]):
+    message_type = message_data.get("type", "personal")
+    content = message_data.get("content", "")
+    
+    if message_type == "personal":
+        recipient_id = message_data.get("recipient_id")
+        if recipient_id:
+            await manager.send_personal_message(recipient_id, user_id, content)
+    
+    elif message_type == "group":
+        group_id = message_data.get("group_id")
+        if group_id in manager.user_groups.get(user_id, ()):
+            await manager.send_group_message(group_id, user_id, content)
+
+async def admit_client_event(
+    connection: ClientConnection, bucket: TokenBucket, user_id: int, message_data: Dict[str, Any]
+) -> bool:
+    try:
+        check_event(message_data)
+        # Корзина группы расходуется только участниками: чужие group_id
+        # не создают записей в admission.groups
+        group_id = message_data.get("group_id") if message_data.get("type") == "group" else None
+        if group_id not in manager.user_groups.get(user_id, ()):
+            group_id = None
+        admission.admit(bucket, user_id, group_id, len(manager.group_online.get(group_id, ())))
+    except Rejected as e:
+        connection.offer(EncodedFrame(e.frame()))
+        return False
+    await handle_client_event(user_id, message_data)
+    return True
+
+def read_frame(message: Dict[str, Any]) -> Dict[str, Any]:
+    payload = message.get("text")
+    if payload is None:
+        payload = message.get("bytes") or b""
+    # Размер проверяется до разбора; для текстовых кадров — в символах
+    check_frame_size(len(payload))
     try:
+        data = frames.loads(payload)
+    except (ValueError, TypeError):
+        # Ошибки json и msgpack — подклассы ValueError
+        data = None
+    if not isinstance(data, dict):
+        reject_invalid("Frame must be a JSON or MessagePack object")
+    return data
+
+def _is_id(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def check_event(message_data: Dict[str, Any]):
+    # Типы полей проверяются до допуска: иначе список вместо id или объект
+    # вместо текста падали бы в менеджере или в конвейере записи
+    if not isinstance(message_data.get("content", ""), str):
+        reject_invalid("content must be a string")
+    for field in ("recipient_id", "group_id"):
+        if message_data.get(field) is not None and not _is_id(message_data[field]):
+            reject_invalid(f"{field} must be an integer")
+
+@router.websocket("/chat")
+async def websocket_chat(
+    websocket: WebSocket, token: str, batch: bool = False, encoding: str = "json", heartbeat: bool = False
+):
+    # encoding=msgpack: события приходят бинарными кадрами MessagePack в компактной
+    # форме (без group_name/sender_name, timestamp в мс эпохи); клиент может слать
+    # и JSON, и MessagePack
+    if encoding not in ("json", "msgpack") or (encoding == "msgpack" and frames.msgpack is None):
+        await websocket.close(code=1008, reason=f"Unsupported encoding: {encoding}")
+        return
+    
+    async with ReadSessionLocal() as db:
         user = await get_current_user(token, db)
         
         if isinstance(user, str):
             await websocket.close(code=1008, reason="")
             return
         
-        await manager.connect(user.id, websocket)
-        
-        for group in user.groups:
-            manager.add_user_to_group(user.id, group.id)
-        
-        try:
-            while True:
-                data = await websocket.receive_text()
-                message_data = json.loads(data)
-                
-                message_type = message_data.get("type", "personal")
-                content = message_data.get("content", "")
-                
-                if message_type == "personal":
-                    recipient_id = message_data.get("recipient_id")
-                    if recipient_id:
-                        await manager.send_personal_message(recipient_id, user.id, content, db)
-                
-                elif message_type == "group":
-                    group_id = message_data.get("group_id")
-                    if group_id:
-                        await manager.send_group_message(group_id, user.id, content, db)
-                
-        except WebSocketDisconnect:
-            manager.disconnect(user.id)
-        except Exception as e:
-            manager.disconnect(user.id)
-            raise e
-    finally:
-        db.close()
+        result = await db.execute(
+            select(GroupDB.id, GroupDB.name)
+            .join(group_members, group_members.c.group_id == GroupDB.id)
+            .where(group_members.c.user_id == user.id)
+        )
+        groups = result.all()
+    
+    # batch=1: сервер склеивает исходящие события в кадры {"type": "batch", "events": [...]},
+    # и клиент может присылать такие же кадры
+    # heartbeat=1: клиент отвечает на {"type": "ping"} кадром {"type": "pong"}
+    # и отключается после HEARTBEAT_IDLE_TIMEOUT тишины
+    connection = await manager.connect(
+        user.id, websocket, user.username, batch=batch, binary=encoding == "msgpack", heartbeat=heartbeat
+    )
+    for group_id, group_name in groups:
+        manager.add_user_to_group(user.id, group_id, group_name)
+    
+    # Отправка не требует сессии: имена и состав групп берутся из памяти
+    # менеджера, а запись идёт через общий конвейер.
+    # Отклонённые кадры и события не закрывают соединение: клиент получает
+    # {"type": "error", "code": ...} и может повторить после retry_after.
+    # Отключается только клиент, получивший WS_MAX_REJECTIONS отказов подряд:
+    # иначе каждый его кадр стоил бы ещё и кадра ошибки
+    bucket = admission.connection_bucket()
+    rejections = 0
+    try:
+        while True:
+            if rejections >= config.WS_MAX_REJECTIONS:
+                manager.disconnect(user.id, connection)
+                await websocket.close(code=1008, reason="Too many rejected events")
+                return
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            WS_FRAMES_RECEIVED.inc()
+            connection.touch()
+            try:
+                message_data = read_frame(message)
+                if message_data.get("type") == "pong":
+                    # Ответ на пинг менеджера: с этого момента к соединению
+                    # применяется HEARTBEAT_IDLE_TIMEOUT
+                    connection.touch(pong=True)
+                    continue
+                if message_data.get("type") == "ping":
+                    admission.admit(bucket, user.id)
+                    connection.offer(EncodedFrame({"type": "pong"}))
+                    continue
+                if message_data.get("type") == "sync":
+                    admission.admit(bucket, user.id)
+                if message_data.get("type") == "batch" and not isinstance(message_data.get("events", []), list):
+                    reject_invalid("Batch events must be a list")
+            except Rejected as e:
+                connection.offer(EncodedFrame(e.frame()))
+                rejections += 1
+                continue
+            
+            if message_data.get("type") == "sync":
+                # Досылка пропущенного после переподключения; пока она идёт,
+                # новые кадры клиента не читаются
+                try:
+                    await sync_missed(
+                        connection, user.id, manager.user_groups.get(user.id, ()),
+                        message_data.get("after"), message_data.get("notifications_after"),
+                        message_data.get("limit"),
+                    )
+                except ValueError as e:
+                    connection.offer(EncodedFrame({"type": "error", "code": "invalid_request", "detail": str(e)}))
+            elif message_data.get("type") == "batch":
+                # События пакета запускаются вместе и попадают в один коммит конвейера;
+                # порядок записи совпадает с порядком в пакете. Допуск — по каждому событию
+                events = [event for event in message_data.get("events", []) if isinstance(event, dict)]
+                admitted = await asyncio.gather(*(
+                    admit_client_event(connection, bucket, user.id, event) for event in events
+                ))
+                rejections = 0 if any(admitted) else rejections + len(admitted)
+            else:
+                admitted = await admit_client_event(connection, bucket, user.id, message_data)
+                rejections = 0 if admitted else rejections + 1
+            
+    except WebSocketDisconnect:
+        manager.disconnect(user.id, connection)
+    except Exception as e:
+        manager.disconnect(user.id, connection)
+        raise e
 
-@router.websocket("/notifications")
-async def websocket_notifications(websocket: WebSocket, token: str):
-    db = SessionLocal()
+def is_pong(text: str) -> bool:
     try:
+        data = frames.loads(text)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and data.get("type") == "pong"
+
+@router.websocket("/notifications")
+async def websocket_notifications(websocket: WebSocket, token: str, heartbeat: bool = False):
+    async with ReadSessionLocal() as db:
         user = await get_current_user(token, db)
-        
-        if isinstance(user, str):
-            await websocket.close(code=1008, reason="")
-            return
-        
-        await websocket.accept()
-        
-        unread_count = db.query(db.func.count()).filter_by(user_id=user.id, is_read=False).scalar()
-        await websocket.send_text(json.dumps({
-            "type": "unread_count",
-            "count": unread_count
-        }))
-        
-        try:
-            while True:
-                await websocket.receive_text()
-        except WebSocketDisconnect:
-            pass
+    
+    if isinstance(user, str):
+        await websocket.close(code=1008, reason="")
+        return
+    
+    connection = await manager.connect_notifications(user.id, websocket, heartbeat=heartbeat)
+    
+    # Счётчик непрочитанных дальше приходит дельтами от менеджера;
+    # от клиента ожидаются только текстовые ответы на пинги
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            WS_FRAMES_RECEIVED.inc()
+            text = message.get("text")
+            if text is None:
+                connection.close()
+                await websocket.close(code=1003, reason="Binary frames are not supported")
+                return
+            connection.touch(pong=is_pong(text))
     finally:
-        db.close()
+        connection.close()
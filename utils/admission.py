@@ -0,0 +1,166 @@
+import time
+from typing import Dict, Optional
+
+import config
+from utils.ingest import pipeline
+from utils.metrics import WS_ADMISSION_REJECTED, OVERLOAD_LEVEL, OVERLOAD_SHED
+
+# Допуск входящего трафика /ws/chat. Каждое событие клиента проходит корзины
+# токенов соединения, пользователя (переживает переподключения) и группы
+# (в доставках: ограничивает стоимость рассылки большой группы). Проверка — O(1):
+# корзина пополняется по времени, прошедшему с прошлого обращения.
+#
+# Перегрузка определяется по глубине очереди конвейера записи: сначала
+# перестают писаться уведомления о сообщениях, затем отклоняются и сами сообщения.
+
+NORMAL, SHED_NOTIFICATIONS, REJECT_MESSAGES = 0, 1, 2
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+    def take(self, now: float, cost: float = 1) -> float:
+        # 0 — токены списаны, иначе через сколько секунд их хватит
+        self.refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.rate
+
+
+class Rejected(Exception):
+    # Отказ, который клиент получает кадром {"type": "error", "code": ..., "detail": ...}
+    def __init__(
+        self, code: str, detail: str, retry_after: Optional[float] = None, scope: Optional[str] = None
+    ):
+        super().__init__(detail)
+        self.code = code
+        self.detail = detail
+        self.retry_after = retry_after
+        self.scope = scope
+
+    def frame(self) -> dict:
+        data = {"type": "error", "code": self.code, "detail": self.detail}
+        if self.scope is not None:
+            data["scope"] = self.scope
+        if self.retry_after is not None:
+            data["retry_after"] = round(self.retry_after, 3)
+        return data
+
+
+def _reject(code: str, detail: str, retry_after: Optional[float] = None, scope: Optional[str] = None):
+    WS_ADMISSION_REJECTED.inc(reason=scope or code)
+    raise Rejected(code, detail, retry_after, scope)
+
+
+def reject_invalid(detail: str):
+    _reject("invalid_frame", detail)
+
+
+class AdmissionControl:
+    def __init__(
+        self,
+        connection_rate: float = config.WS_RATE_CONNECTION,
+        connection_burst: float = config.WS_BURST_CONNECTION,
+        user_rate: float = config.WS_RATE_USER,
+        user_burst: float = config.WS_BURST_USER,
+        group_rate: float = config.WS_RATE_GROUP,
+        group_burst: float = config.WS_BURST_GROUP,
+        shed_depth: int = config.OVERLOAD_SHED_DEPTH,
+        reject_depth: int = config.OVERLOAD_REJECT_DEPTH,
+        prune_interval: float = 60.0,
+    ):
+        self.connection_rate = connection_rate
+        self.connection_burst = connection_burst
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.shed_depth = shed_depth
+        self.reject_depth = reject_depth
+        self.prune_interval = prune_interval
+        self.users: Dict[int, TokenBucket] = {}
+        self.groups: Dict[int, TokenBucket] = {}
+        self._pruned = time.monotonic()
+
+    def connection_bucket(self) -> TokenBucket:
+        return TokenBucket(self.connection_rate, self.connection_burst)
+
+    @property
+    def level(self) -> int:
+        depth = pipeline.depth
+        if depth >= self.reject_depth:
+            return REJECT_MESSAGES
+        if depth >= self.shed_depth:
+            return SHED_NOTIFICATIONS
+        return NORMAL
+
+    def shed_notifications(self, count: int = 1) -> bool:
+        # Уведомления о сообщениях — первое, что отбрасывается при перегрузке
+        if self.level < SHED_NOTIFICATIONS:
+            return False
+        OVERLOAD_SHED.inc(count, work="notification")
+        return True
+
+    def admit(
+        self, connection_bucket: TokenBucket, user_id: int, group_id: Optional[int] = None, recipients: int = 1
+    ):
+        # Порядок: соединение, пользователь, группа. Отклонённое на позднем
+        # уровне событие всё равно расходует токены ранних: флуд стоит клиенту дорого
+        if self.level >= REJECT_MESSAGES:
+            _reject("overloaded", "Server is overloaded, retry later", 1.0)
+        now = time.monotonic()
+        if now - self._pruned > self.prune_interval:
+            self._prune(now)
+        wait = connection_bucket.take(now)
+        if wait:
+            _reject("rate_limited", "Too many events on this connection", wait, "connection")
+        wait = self._bucket(self.users, user_id, self.user_rate, self.user_burst, now).take(now)
+        if wait:
+            _reject("rate_limited", "Too many events from this user", wait, "user")
+        if group_id is not None:
+            # Цена сообщения в группу — число получателей: рассылка на тысячу
+            # сокетов дороже личного сообщения во столько же раз
+            bucket = self._bucket(self.groups, group_id, self.group_rate, self.group_burst, now)
+            wait = bucket.take(now, min(max(recipients, 1), bucket.burst))
+            if wait:
+                _reject("rate_limited", "Too many messages in this group", wait, "group")
+
+    @staticmethod
+    def _bucket(buckets: Dict[int, TokenBucket], key: int, rate: float, burst: float, now: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst, now)
+        return bucket
+
+    def _prune(self, now: float):
+        # Полностью пополненная корзина ничем не отличается от новой,
+        # поэтому её можно забыть; словари не растут с числом бывших клиентов
+        self._pruned = now
+        for buckets in (self.users, self.groups):
+            for key in [key for key, bucket in buckets.items() if bucket.full(now)]:
+                del buckets[key]
+
+
+def check_frame_size(size: int):
+    # Проверяется до разбора кадра
+    if size > config.WS_MAX_FRAME_BYTES:
+        _reject("frame_too_large", f"Frame exceeds {config.WS_MAX_FRAME_BYTES} bytes")
+
+
+admission = AdmissionControl()
+
+OVERLOAD_LEVEL.set_function(lambda: admission.level)
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import struct
+import sys
+from typing import Awaitable, Callable, Optional, Set
+
+import config
+from utils.frames import dumps
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+_HEADER = struct.Struct("!I")
+
+
+class Backplane:
+    # Шина событий доставки между процессами. Каждое событие обрабатывается
+    # локально и во всех остальных процессах; каждый процесс сам решает,
+    # какие из его сокетов должны получить событие.
+
+    def __init__(self):
+        self._handler: Optional[Handler] = None
+
+    def subscribe(self, handler: Handler):
+        self._handler = handler
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, event: dict):
+        await self._handler(event)
+
+
+class InProcessBackplane(Backplane):
+    pass
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    header = await reader.readexactly(_HEADER.size)
+    return await reader.readexactly(_HEADER.unpack(header)[0])
+
+
+def _write_frame(writer: asyncio.StreamWriter, payload: bytes):
+    writer.write(_HEADER.pack(len(payload)) + payload)
+
+
+class UnixSocketBackplane(Backplane):
+    def __init__(self, path: str, reconnect_delay: float = 1.0):
+        super().__init__()
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), self.reconnect_delay * 5)
+        except asyncio.TimeoutError:
+            logger.warning("Backplane broker %s is not reachable yet", self.path)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._writer:
+            self._writer.close()
+
+    async def publish(self, event: dict):
+        await self._handler(event)
+        if self._writer is None:
+            logger.warning("Backplane broker unavailable, event delivered locally only")
+            return
+        _write_frame(self._writer, dumps(event).encode())
+        await self._writer.drain()
+
+    async def _run(self):
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+                self._connected.set()
+                while True:
+                    payload = await _read_frame(reader)
+                    # Битый кадр пропускается: без этого задача чтения
+                    # завершилась бы молча и воркер перестал бы получать события
+                    try:
+                        event = json.loads(payload)
+                        await self._handler(event)
+                    except ValueError:
+                        logger.exception("Malformed backplane event")
+                    except Exception:
+                        logger.exception("Failed to handle backplane event")
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.IncompleteReadError):
+                self._writer = None
+                self._connected.clear()
+                await asyncio.sleep(self.reconnect_delay)
+
+
+class UnixSocketBroker:
+    # Пересылает каждое событие всем подключённым процессам, кроме отправителя
+
+    def __init__(self, path: str, max_buffer: int = config.BACKPLANE_MAX_BUFFER):
+        self.path = path
+        self.max_buffer = max_buffer
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self._handlers: Set[asyncio.Task] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in list(self._handlers):
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients.add(writer)
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                payload = await _read_frame(reader)
+                for client in list(self._clients):
+                    if client is not writer:
+                        self._forward(client, payload)
+        except (OSError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    def _forward(self, client: asyncio.StreamWriter, payload: bytes):
+        # drain() здесь не ждётся: один медленный воркер задержал бы всех.
+        # Вместо этого размер неотправленного буфера ограничен
+        if client.transport.get_write_buffer_size() + len(payload) > self.max_buffer:
+            logger.warning("Backplane client fell behind, disconnecting it")
+            self._clients.discard(client)
+            client.close()
+            return
+        _write_frame(client, payload)
+
+
+def create_backplane(url: str = config.BACKPLANE_URL) -> Backplane:
+    if url.startswith("unix://"):
+        return UnixSocketBackplane(url[len("unix://"):])
+    if url in ("", "memory://"):
+        return InProcessBackplane()
+    raise ValueError(f"Unsupported backplane URL: {url}")
+
+
+if __name__ == "__main__":
+    # python -m utils.backplane /tmp/chat-backplane.sock
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(UnixSocketBroker(sys.argv[1]).serve_forever())
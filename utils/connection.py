@@ -0,0 +1,176 @@
+import asyncio
+import time
+from enum import Enum
+from typing import Callable, Optional, Union
+
+from fastapi import WebSocket
+
+import config
+from utils.frames import EncodedFrame, batch_binary, batch_text
+from utils.metrics import WS_BYTES_SENT, WS_FRAMES_DROPPED, WS_FRAMES_SENT
+
+SLOW_CONSUMER_CLOSE_CODE = 1013
+IDLE_CLOSE_CODE = 1001
+
+
+class OverflowPolicy(str, Enum):
+    DROP_OLDEST = "drop_oldest"
+    DISCONNECT = "disconnect"
+    BLOCK = "block"
+
+
+class ClientConnection:
+    def __init__(
+        self,
+        user_id: int,
+        websocket: WebSocket,
+        on_close: Callable[["ClientConnection"], None],
+        queue_size: int = config.OUTBOUND_QUEUE_SIZE,
+        policy: OverflowPolicy = OverflowPolicy(config.OUTBOUND_OVERFLOW_POLICY),
+        block_timeout: float = config.OUTBOUND_BLOCK_TIMEOUT,
+        send_timeout: float = config.SEND_TIMEOUT,
+        batch_delay: float = 0,
+        batch_bytes: int = config.BATCH_MAX_BYTES,
+        binary: bool = False,
+        heartbeat: bool = False,
+    ):
+        self.user_id = user_id
+        self.username: Optional[str] = None
+        self.websocket = websocket
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.send_timeout = send_timeout
+        # batch_delay > 0 включает склейку исходящих событий в один кадр
+        self.batch_delay = batch_delay
+        self.batch_bytes = batch_bytes
+        # binary: кадры уходят в компактной форме MessagePack вместо JSON
+        self.binary = binary
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+        self._on_close = on_close
+        self._writer: Optional[asyncio.Task] = None
+        self._arrived = asyncio.Event()
+        self._drained = asyncio.Event()
+        # Время последнего входящего кадра; heartbeat — клиент отвечает на пинги
+        # (подключился с heartbeat=1 или уже прислал pong)
+        self.last_seen = time.monotonic()
+        self.heartbeat = heartbeat
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def touch(self, pong: bool = False):
+        self.last_seen = time.monotonic()
+        if pong:
+            self.heartbeat = True
+
+    def offer(self, frame: EncodedFrame) -> bool:
+        # Неблокирующая постановка в очередь. False означает, что очередь
+        # полна при политике BLOCK и вызывающий должен дождаться put().
+        if self.closed:
+            return True
+        try:
+            self.queue.put_nowait(frame)
+            self._arrived.set()
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy is OverflowPolicy.DROP_OLDEST:
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+            self._arrived.set()
+            self.dropped += 1
+            WS_FRAMES_DROPPED.inc(policy=self.policy.value)
+            return True
+        if self.policy is OverflowPolicy.DISCONNECT:
+            self.dropped += 1
+            WS_FRAMES_DROPPED.inc(policy=self.policy.value)
+            self.close(SLOW_CONSUMER_CLOSE_CODE)
+            return True
+        return False
+
+    async def put(self, frame: EncodedFrame):
+        if self.offer(frame):
+            return
+        try:
+            await asyncio.wait_for(self.queue.put(frame), self.block_timeout)
+            self._arrived.set()
+        except asyncio.TimeoutError:
+            self.dropped += 1
+            WS_FRAMES_DROPPED.inc(policy=self.policy.value)
+            self.close(SLOW_CONSUMER_CLOSE_CODE)
+
+    async def wait_for_room(self, count: int):
+        # Для потоковых ответов (синхронизация): дождаться, пока писатель
+        # освободит место под count кадров, вместо того чтобы политика
+        # переполнения вытесняла живые события
+        count = min(count, self.queue.maxsize)
+        while not self.closed and self.queue.maxsize - self.queue.qsize() < count:
+            self._drained.clear()
+            await self._drained.wait()
+
+    async def _write_loop(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                payload = await self._coalesce(frame) if self.batch_delay else self._encode(frame)
+                if self.binary:
+                    await asyncio.wait_for(self.websocket.send_bytes(payload), self.send_timeout)
+                else:
+                    await asyncio.wait_for(self.websocket.send_text(payload), self.send_timeout)
+                WS_FRAMES_SENT.inc()
+                WS_BYTES_SENT.inc(len(payload))
+                self._drained.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Таймаут отправки или оборванный сокет: соединение считается мёртвым
+            self.close(SLOW_CONSUMER_CLOSE_CODE)
+
+    def _encode(self, frame: EncodedFrame) -> Union[str, bytes]:
+        return frame.binary if self.binary else frame.text
+
+    async def _coalesce(self, first: EncodedFrame) -> Union[str, bytes]:
+        # Собирает события, пришедшие в течение batch_delay, пока не набран
+        # batch_bytes, и склеивает уже сериализованные кадры без повторного
+        # кодирования. Одиночное событие уходит как есть.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_delay
+        payloads = [self._encode(first)]
+        size = len(payloads[0])
+        while size < self.batch_bytes:
+            if self.queue.empty():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                continue
+            payload = self._encode(self.queue.get_nowait())
+            payloads.append(payload)
+            size += len(payload)
+        if len(payloads) == 1:
+            return payloads[0]
+        return batch_binary(payloads) if self.binary else batch_text(payloads)
+
+    def close(self, code: Optional[int] = None):
+        if self.closed:
+            return
+        self.closed = True
+        self._drained.set()
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._on_close(self)
+        if code is not None:
+            asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), self.send_timeout)
+        except Exception:
+            pass
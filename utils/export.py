@@ -0,0 +1,119 @@
+import zlib
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from database import ReadSessionLocal
+from models import ArchivedMessageDB, MessageDB
+from utils import frames
+from utils.pagination import decode_cursor, encode_cursor
+
+# Потоковая выгрузка переписки в NDJSON. Каждая порция — отдельный короткий
+# запрос по индексу (..., timestamp, id) с LIMIT в своей сессии, поэтому память
+# и время удержания соединения не зависят от размера переписки, а медленный
+# клиент не держит открытую транзакцию чтения.
+#
+# Каждая строка содержит cursor. Прерванную выгрузку продолжают запросом
+# ?after=<cursor последней строки>&until=<X-Export-Until из первого ответа>,
+# и получают ровно оставшуюся часть того же снимка.
+
+# Старые сообщения лежат в messages_archive (utils/retention.py), поэтому
+# условия задаются функцией от модели и каждая порция читается из обеих таблиц
+TIERS = (MessageDB, ArchivedMessageDB)
+
+
+def _columns(model) -> tuple:
+    return (model.id, model.content, model.sender_id, model.recipient_id, model.group_id, model.timestamp)
+
+
+def _key(model):
+    return tuple_(model.timestamp, model.id)
+
+
+async def last_position(db: AsyncSession, conditions: Callable[[type], List[list]]) -> Optional[Tuple]:
+    positions = []
+    for model in TIERS:
+        for where in conditions(model):
+            result = await db.execute(
+                select(model.timestamp, model.id)
+                .where(*where)
+                .order_by(model.timestamp.desc(), model.id.desc())
+                .limit(1)
+            )
+            row = result.first()
+            if row is not None:
+                positions.append(tuple(row))
+    return max(positions) if positions else None
+
+
+def _line(row) -> str:
+    return frames.dumps({
+        "id": row.id,
+        "cursor": encode_cursor(row.timestamp, row.id),
+        "sender_id": row.sender_id,
+        "recipient_id": row.recipient_id,
+        "group_id": row.group_id,
+        "content": row.content,
+        "timestamp": row.timestamp.isoformat(),
+    }) + "\n"
+
+
+async def _chunks(
+    conditions: Callable[[type], List[list]], after: Optional[Tuple], until: Tuple, chunk_size: int
+) -> AsyncIterator[str]:
+    while True:
+        rows = []
+        async with ReadSessionLocal() as db:
+            for model in TIERS:
+                key = _key(model)
+                for where in conditions(model):
+                    query = select(*_columns(model)).where(*where, key <= tuple_(*until))
+                    if after is not None:
+                        query = query.where(key > tuple_(*after))
+                    result = await db.execute(query.order_by(model.timestamp, model.id).limit(chunk_size))
+                    rows.extend(result.all())
+        rows.sort(key=lambda row: (row.timestamp, row.id))
+        rows = rows[:chunk_size]
+        if not rows:
+            return
+        yield "".join(_line(row) for row in rows)
+        after = (rows[-1].timestamp, rows[-1].id)
+        if len(rows) < chunk_size:
+            return
+
+
+async def _gzip(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def export_response(
+    db: AsyncSession,
+    conditions: Callable[[type], List[list]],
+    filename: str,
+    after: Optional[str] = None,
+    until: Optional[str] = None,
+    gzip: bool = False,
+    chunk_size: int = config.EXPORT_CHUNK_SIZE,
+) -> StreamingResponse:
+    # Верхняя граница фиксируется при первом запросе: сообщения, пришедшие
+    # во время выгрузки, в неё не попадают
+    end = decode_cursor(until) if until else await last_position(db, conditions)
+    start = decode_cursor(after) if after else None
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.ndjson"'}
+    if end is None:
+        body = iter(())
+    else:
+        headers["X-Export-Until"] = encode_cursor(*end)
+        body = _chunks(conditions, start, end, chunk_size)
+        if gzip:
+            body = _gzip(body)
+            headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
@@ -0,0 +1,84 @@
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Поля, которые клиент компактного протокола получает по REST один раз,
+# а не в каждом сообщении
+_VERBOSE_FIELDS = ("group_name", "sender_name")
+
+_EPOCH = datetime(1970, 1, 1)
+_MILLISECOND = timedelta(milliseconds=1)
+
+
+def dumps(data: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    # Текстовые кадры — JSON, бинарные — MessagePack
+    if isinstance(data, bytes):
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def compact(data: Dict[str, Any]) -> Dict[str, Any]:
+    # Компактная форма события: без имён, которые повторяются в каждом
+    # сообщении, и с timestamp в миллисекундах эпохи UTC
+    result = {key: value for key, value in data.items() if key not in _VERBOSE_FIELDS}
+    if isinstance(result.get("timestamp"), str):
+        # Время в событиях — наивный UTC из datetime.utcnow()
+        result["timestamp"] = (datetime.fromisoformat(result["timestamp"]) - _EPOCH) // _MILLISECOND
+    return result
+
+
+class EncodedFrame:
+    # Событие, которое сериализуется один раз для каждого формата
+    # и затем отдаётся всем получателям
+    __slots__ = ("data", "_text", "_binary")
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        self._text: Optional[str] = None
+        self._binary: Optional[bytes] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = dumps(self.data)
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = msgpack.packb(compact(self.data))
+        return self._binary
+
+
+def batch_text(texts: List[str]) -> str:
+    return '{"type":"batch","events":[' + ",".join(texts) + "]}"
+
+
+def batch_binary(payloads: List[bytes]) -> bytes:
+    # Та же структура {"type": "batch", "events": [...]}, собранная из уже
+    # закодированных событий без повторной упаковки
+    packer = msgpack.Packer()
+    return b"".join([
+        packer.pack_map_header(2),
+        packer.pack("type"),
+        packer.pack("batch"),
+        packer.pack("events"),
+        packer.pack_array_header(len(payloads)),
+        *payloads,
+    ])
@@ -0,0 +1,167 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+import config
+from utils.metrics import HISTORY_CACHE_CONVERSATIONS, HISTORY_CACHE_EVICTIONS, HISTORY_CACHE_HITS, HISTORY_CACHE_MISSES
+from utils.pagination import fetch_message_page, row_cursor
+
+ConversationKey = Tuple
+
+
+def group_key(group_id: int) -> ConversationKey:
+    return ("group", group_id)
+
+
+def dm_key(user_id: int, other_id: int) -> ConversationKey:
+    return ("dm", min(user_id, other_id), max(user_id, other_id))
+
+
+@dataclass(frozen=True)
+class CachedMessage:
+    # Та же форма, что у MessageResponse, без привязки к сессии
+    id: int
+    content: str
+    sender_id: int
+    recipient_id: Optional[int]
+    group_id: Optional[int]
+    timestamp: datetime
+
+    @classmethod
+    def from_row(cls, row) -> "CachedMessage":
+        return cls(row.id, row.content, row.sender_id, row.recipient_id, row.group_id, row.timestamp)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CachedMessage":
+        return cls(
+            data["id"], data["content"], data["sender_id"], data.get("recipient_id"),
+            data.get("group_id"), datetime.fromisoformat(data["timestamp"]),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "content": self.content,
+            "sender_id": self.sender_id,
+            "recipient_id": self.recipient_id,
+            "group_id": self.group_id,
+            "timestamp": self.timestamp.isoformat(),
+        }
+
+    @property
+    def sort_key(self):
+        return (self.timestamp, self.id)
+
+
+class _Conversation:
+    __slots__ = ("messages", "ids", "complete")
+
+    def __init__(self, messages: List[CachedMessage], complete: bool):
+        # messages упорядочены по (timestamp, id), как ключ курсора;
+        # complete — в буфере вся переписка и более старых сообщений в БД нет
+        self.messages = messages
+        self.ids: Set[int] = {message.id for message in messages}
+        self.complete = complete
+
+
+class HistoryCache:
+    def __init__(
+        self,
+        size: int = config.HISTORY_CACHE_SIZE,
+        max_conversations: int = config.HISTORY_CACHE_CONVERSATIONS,
+    ):
+        self.size = size
+        self.max_conversations = max_conversations
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conversations: "OrderedDict[ConversationKey, _Conversation]" = OrderedDict()
+        # Сообщения, пришедшие, пока буфер загружается из БД: запрос мог
+        # выполниться до их коммита, поэтому они досливаются после загрузки
+        self._loading: Dict[ConversationKey, int] = {}
+        self._pending: Dict[ConversationKey, List[CachedMessage]] = {}
+
+    def add(self, key: ConversationKey, message: CachedMessage):
+        if key in self._loading:
+            self._pending[key].append(message)
+        conversation = self._conversations.get(key)
+        if conversation is not None:
+            self._insert(conversation, message)
+
+    async def first_page(self, key: ConversationKey, db, queries: list, limit: int) -> dict:
+        # Первая страница (без курсора) отдаётся из буфера; остальные
+        # страницы и страницы крупнее буфера читаются из БД как раньше
+        if limit > self.size:
+            return await fetch_message_page(db, queries, limit=limit)
+
+        conversation = self._conversations.get(key)
+        if conversation is not None:
+            self._conversations.move_to_end(key)
+            self.hits += 1
+            return self._page(conversation, limit)
+
+        self.misses += 1
+        self._loading[key] = self._loading.get(key, 0) + 1
+        self._pending.setdefault(key, [])
+        try:
+            loaded = await fetch_message_page(db, queries, limit=self.size)
+        finally:
+            pending = self._pending[key]
+            self._loading[key] -= 1
+            if not self._loading[key]:
+                del self._loading[key]
+                del self._pending[key]
+
+        conversation = self._conversations.get(key)
+        if conversation is None:
+            conversation = _Conversation(
+                [CachedMessage.from_row(row) for row in loaded["items"]], not loaded["has_more"]
+            )
+            self._store(key, conversation)
+        for message in pending:
+            self._insert(conversation, message)
+        return self._page(conversation, limit)
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def _store(self, key: ConversationKey, conversation: _Conversation):
+        self._conversations[key] = conversation
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+            self.evictions += 1
+
+    def _insert(self, conversation: _Conversation, message: CachedMessage):
+        if message.id in conversation.ids:
+            return
+        messages = conversation.messages
+        position = bisect_left([item.sort_key for item in messages], message.sort_key)
+        # Сообщение старше всего буфера при неполном буфере лежит в «хвосте» БД
+        if position == 0 and messages and not conversation.complete:
+            return
+        messages.insert(position, message)
+        conversation.ids.add(message.id)
+        if len(messages) > self.size:
+            conversation.ids.discard(messages.pop(0).id)
+            conversation.complete = False
+
+    @staticmethod
+    def _page(conversation: _Conversation, limit: int) -> dict:
+        # Та же семантика, что у fetch_page без курсора: последние limit
+        # сообщений по возрастанию и курсоры по крайним элементам
+        items = conversation.messages[-limit:]
+        return {
+            "items": items,
+            "has_more": len(conversation.messages) > limit or not conversation.complete,
+            "before": row_cursor(items[0]) if items else None,
+            "after": row_cursor(items[-1]) if items else None,
+        }
+
+
+history_cache = HistoryCache()
+HISTORY_CACHE_HITS.set_function(lambda: history_cache.hits)
+HISTORY_CACHE_MISSES.set_function(lambda: history_cache.misses)
+HISTORY_CACHE_EVICTIONS.set_function(lambda: history_cache.evictions)
+HISTORY_CACHE_CONVERSATIONS.set_function(lambda: len(history_cache))
@@ -0,0 +1,131 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+
+import config
+from database import AsyncSessionLocal
+from utils.metrics import INGEST_BATCH_ROWS, INGEST_QUEUE_DEPTH
+
+
+class WritePipeline:
+    # Единый путь записи сообщений и уведомлений: строки из всех точек входа
+    # копятся в очереди и фиксируются пачками в одной транзакции (group commit).
+    # write() возвращает управление только после коммита пачки.
+
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        max_batch: int = config.INGEST_MAX_BATCH,
+        max_delay: float = config.INGEST_MAX_DELAY,
+    ):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._batch_full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._batch_full = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def submit(self, *rows) -> asyncio.Future:
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((list(rows), future))
+        if self._queue.qsize() >= self.max_batch:
+            self._batch_full.set()
+        return future
+
+    async def write(self, *rows) -> List:
+        return await self.submit(*rows)
+
+    async def insert_many(self, model, values: List[Dict]):
+        # Массовая вставка строк, чьи id не нужны: один executemany без RETURNING
+        # вместо INSERT на каждую строку (у SQLite нет пакетного RETURNING для ORM)
+        if not values:
+            return
+        async with self.session_factory() as db:
+            await db.execute(insert(model), values)
+            await db.commit()
+        INGEST_BATCH_ROWS.observe(len(values))
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    @staticmethod
+    def _size(batch: List[Tuple[List, asyncio.Future]]) -> int:
+        return sum(len(rows) for rows, _ in batch)
+
+    def _drain(self, batch: List[Tuple[List, asyncio.Future]]):
+        size = self._size(batch)
+        while size < self.max_batch and not self._queue.empty():
+            item = self._queue.get_nowait()
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = self._drain([await self._queue.get()])
+            # Пачка закрывается по размеру или по истечении max_delay
+            if self._size(batch) < self.max_batch and self.max_delay > 0:
+                self._batch_full.clear()
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._drain(batch)
+            await self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush(self, batch: List[Tuple[List, asyncio.Future]]):
+        if not batch:
+            return
+        try:
+            await self._commit([row for rows, _ in batch for row in rows])
+        except Exception as exc:
+            if len(batch) == 1:
+                self._resolve(batch[0][1], exc=exc)
+                return
+            # Одна плохая запись не должна ронять всю пачку
+            for item in batch:
+                await self._flush([item])
+            return
+        for rows, future in batch:
+            self._resolve(future, rows)
+
+    async def _commit(self, rows: List):
+        async with self.session_factory() as db:
+            db.add_all(rows)
+            await db.commit()
+        INGEST_BATCH_ROWS.observe(len(rows))
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result=None, exc: Optional[BaseException] = None):
+        if future.done():
+            return
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+
+pipeline = WritePipeline()
+INGEST_QUEUE_DEPTH.set_function(lambda: pipeline.depth)
@@ -1,69 +1,444 @@
 from fastapi import WebSocket, Depends
-from typing import Dict, List, Set, Union
-from sqlalchemy.orm import Session
-import json
+from typing import Dict, Iterable, List, Optional, Set, Union
+from sqlalchemy import func, select
+import asyncio
+import logging
+import time
 from datetime import datetime
+from functools import partial
 
-from models import MessageDB, NotificationDB, UserDB, GroupDB
-from database import get_db
+import config
+from models import MessageDB, NotificationDB
+from database import get_db, ReadSessionLocal
+from utils.admission import admission
+from utils.backplane import Backplane, create_backplane
+from utils.connection import ClientConnection, IDLE_CLOSE_CODE
+from utils.frames import EncodedFrame
+from utils.history_cache import CachedMessage, history_cache, dm_key, group_key
+from utils.ingest import pipeline
+from utils.metrics import (
+    BACKPLANE_EVENTS, FANOUT_RECIPIENTS, FANOUT_SECONDS, WS_CHAT_CONNECTIONS, WS_HEARTBEAT_PINGS,
+    WS_NOTIFICATION_CONNECTIONS, WS_QUEUE_DEPTH_MAX, WS_QUEUED_FRAMES, WS_REAPED,
+)
+
+logger = logging.getLogger(__name__)
+
+# Кадры событий; те же функции собирают кадры при досылке пропущенного (utils/sync.py).
+# id сообщения или уведомления — курсор, который клиент присылает в {"type": "sync"}
+def personal_message_data(message: MessageDB, sender_name: str) -> dict:
+    return {
+        "type": "personal_message",
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "sender_name": sender_name,
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat()
+    }
+
+def group_message_data(message: MessageDB, group_name: str, sender_name: str) -> dict:
+    return {
+        "type": "group_message",
+        "id": message.id,
+        "group_id": message.group_id,
+        "group_name": group_name,
+        "sender_id": message.sender_id,
+        "sender_name": sender_name,
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat()
+    }
+
+def notification_data(content: str, timestamp: datetime, notification_id: Optional[int] = None) -> dict:
+    data = {"type": "notification", "content": content, "timestamp": timestamp.isoformat()}
+    if notification_id is not None:
+        data["id"] = notification_id
+    return data
+
+class UnreadCounter:
+    # Счётчик непрочитанных уведомлений одного пользователя. Снимок COUNT
+    # читается вместе с max(id) уведомлений: строки с id не больше seen_id
+    # снимок уже учёл, поэтому их дельты пропускаются. Пока снимок читается,
+    # дельты копятся в pending и применяются после него.
+    __slots__ = ("count", "seen_id", "pending", "stale", "task")
 
-class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
+        self.count: Optional[int] = None
+        self.seen_id = 0
+        self.pending: Optional[List[tuple]] = None
+        self.stale = False
+        self.task: Optional[asyncio.Task] = None
+
+class ConnectionManager:
+    def __init__(self, backplane: Optional[Backplane] = None):
+        self.active_connections: Dict[int, ClientConnection] = {}
         self.user_groups: Dict[int, Set[int]] = {}
+        # Обратный индекс: группа -> подключённые участники, чтобы рассылка
+        # не ходила в БД за составом группы
+        self.group_online: Dict[int, Set[int]] = {}
+        self.group_names: Dict[int, str] = {}
+        # Счётчики непрочитанных ведутся только для пользователей с открытым
+        # /ws/notifications и обновляются инкрементально
+        self.notification_connections: Dict[int, Set[ClientConnection]] = {}
+        self.unread_counts: Dict[int, UnreadCounter] = {}
+        # Доставка всегда идёт через шину: сокет получателя может принадлежать
+        # другому воркеру или хосту
+        self.backplane = backplane or create_backplane()
+        self.backplane.subscribe(self._on_event)
+        self._reaper: Optional[asyncio.Task] = None
 
-    async def connect(self, user_id: int, websocket: WebSocket):
+    async def start(self):
+        await self.backplane.start()
+        if config.HEARTBEAT_INTERVAL > 0 and self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+        await self.backplane.stop()
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(config.HEARTBEAT_INTERVAL / 2)
+            try:
+                self.reap()
+            except Exception:
+                logger.exception("Connection reaper failed")
+
+    def reap(self, now: Optional[float] = None):
+        # Проход по всем соединениям раз в полинтервала пульса. Пинги получают
+        # только клиенты с пульсом (или все при HEARTBEAT_STRICT): молчащим уходит
+        # пинг, замолчавшие дольше HEARTBEAT_IDLE_TIMEOUT закрываются, и close()
+        # убирает их из реестра вместе с user_groups и group_online. Рассылка
+        # после этого не тратит время на мёртвых получателей. Старые клиенты
+        # без пульса протокола не меняют: пингов им не приходит.
+        now = time.monotonic() if now is None else now
+        ping = EncodedFrame({"type": "ping"})
+        for connection in list(self._all_connections()):
+            if not (connection.heartbeat or config.HEARTBEAT_STRICT):
+                continue
+            silent = now - connection.last_seen
+            if silent > config.HEARTBEAT_IDLE_TIMEOUT:
+                WS_REAPED.inc(reason="idle")
+                connection.close(IDLE_CLOSE_CODE)
+            elif silent >= config.HEARTBEAT_INTERVAL:
+                WS_HEARTBEAT_PINGS.inc()
+                connection.offer(ping)
+        # Состав групп без соединения остаётся, только если соединение потерялось
+        # мимо _forget
+        for user_id in [user_id for user_id in self.user_groups if user_id not in self.active_connections]:
+            WS_REAPED.inc(reason="orphaned_groups")
+            for group_id in self.user_groups.pop(user_id):
+                self._discard_online(user_id, group_id)
+
+    async def connect(
+        self,
+        user_id: int,
+        websocket: WebSocket,
+        username: Optional[str] = None,
+        batch: bool = False,
+        binary: bool = False,
+        heartbeat: bool = False,
+    ) -> ClientConnection:
         await websocket.accept()
-        self.active_connections[user_id] = websocket
+        previous = self.active_connections.get(user_id)
+        if previous:
+            previous.close()
+        connection = ClientConnection(
+            user_id, websocket, self._forget, batch_delay=config.BATCH_MAX_DELAY if batch else 0, binary=binary,
+            heartbeat=heartbeat,
+        )
+        connection.username = username
+        self.active_connections[user_id] = connection
         self.user_groups[user_id] = set()
+        connection.start()
+        return connection
 
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-        if user_id in self.user_groups:
-            del self.user_groups[user_id]
+    def disconnect(self, user_id: int, connection: Optional[ClientConnection] = None):
+        connection = connection or self.active_connections.get(user_id)
+        if connection:
+            connection.close()
+
+    def _forget(self, connection: ClientConnection):
+        # Переподключившийся пользователь уже может иметь новое соединение
+        if self.active_connections.get(connection.user_id) is not connection:
+            return
+        del self.active_connections[connection.user_id]
+        for group_id in self.user_groups.pop(connection.user_id, set()):
+            self._discard_online(connection.user_id, group_id)
+
+    async def connect_notifications(self, user_id: int, websocket: WebSocket, heartbeat: bool = False) -> ClientConnection:
+        counter = self.unread_counts.get(user_id)
+        if counter is None:
+            counter = self.unread_counts[user_id] = UnreadCounter()
+            self._recount_unread(user_id, counter)
+        if not counter.task.done():
+            try:
+                await asyncio.shield(counter.task)
+            except Exception:
+                if user_id not in self.notification_connections:
+                    self.unread_counts.pop(user_id, None)
+                raise
+        await websocket.accept()
+        connection = ClientConnection(user_id, websocket, self._forget_notifications, heartbeat=heartbeat)
+        self.notification_connections.setdefault(user_id, set()).add(connection)
+        connection.start()
+        connection.offer(EncodedFrame({"type": "unread_count", "count": counter.count}))
+        return connection
+
+    def _forget_notifications(self, connection: ClientConnection):
+        connections = self.notification_connections.get(connection.user_id)
+        if connections is None:
+            return
+        connections.discard(connection)
+        if not connections:
+            del self.notification_connections[connection.user_id]
+            self.unread_counts.pop(connection.user_id, None)
+
+    def _recount_unread(self, user_id: int, counter: UnreadCounter):
+        if counter.task is not None and not counter.task.done():
+            # Снимок уже читается, но мог не увидеть это изменение: прочитать ещё раз
+            counter.stale = True
+            return
+        counter.pending = []
+        counter.task = asyncio.create_task(self._read_unread(user_id, counter))
+        counter.task.add_done_callback(self._log_recount_failure)
+
+    async def _read_unread(self, user_id: int, counter: UnreadCounter):
+        previous = counter.count
+        while True:
+            counter.pending, counter.stale = [], False
+            try:
+                async with ReadSessionLocal() as db:
+                    result = await db.execute(select(
+                        select(func.count()).select_from(NotificationDB).where(
+                            NotificationDB.user_id == user_id, NotificationDB.is_read == False
+                        ).scalar_subquery(),
+                        select(func.max(NotificationDB.id)).scalar_subquery(),
+                    ))
+                    count, seen_id = result.one()
+            finally:
+                pending, counter.pending = counter.pending, None
+            counter.count, counter.seen_id = count, seen_id or 0
+            for delta, notification_id in pending:
+                if notification_id > counter.seen_id:
+                    counter.count = max(0, counter.count + delta)
+            if not counter.stale:
+                break
+        if previous is not None and counter.count != previous:
+            frame = EncodedFrame({"type": "unread_delta", "delta": counter.count - previous, "count": counter.count})
+            for connection in self.notification_connections.get(user_id, ()):
+                connection.offer(frame)
+
+    @staticmethod
+    def _log_recount_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Failed to count unread notifications", exc_info=task.exception())
+
+    def _adjust_unread(self, user_id: int, delta: int, notification_id: Optional[int] = None):
+        counter = self.unread_counts.get(user_id)
+        if counter is None:
+            return
+        if notification_id is None:
+            # Без id нельзя понять, учёл ли изменение снимок (отметки о прочтении,
+            # массовые уведомления): счётчик читается заново
+            self._recount_unread(user_id, counter)
+            return
+        if counter.pending is not None:
+            counter.pending.append((delta, notification_id))
+            return
+        if notification_id <= counter.seen_id:
+            return
+        counter.count = max(0, counter.count + delta)
+        frame = EncodedFrame({"type": "unread_delta", "delta": delta, "count": counter.count})
+        for connection in self.notification_connections.get(user_id, ()):
+            connection.offer(frame)
 
-    def add_user_to_group(self, user_id: int, group_id: int):
+    async def notifications_read(self, user_id: int, count: int):
+        if count:
+            await self._publish_unread([user_id], -count)
+
+    async def _publish_unread(self, user_ids: List[int], delta: int, notification_ids: Optional[List[int]] = None):
+        event = {"kind": "unread", "user_ids": user_ids, "delta": delta}
+        if notification_ids is not None:
+            event["notification_ids"] = notification_ids
+        await self.backplane.publish(event)
+
+    async def _send(self, user_id: int, frame: EncodedFrame):
+        await self._broadcast((user_id,), frame)
+
+    async def _broadcast(self, user_ids: Iterable[int], frame: EncodedFrame):
+        # Рассылка — это постановка в очереди соединений; сокеты пишут их
+        # собственные задачи, поэтому медленный клиент не задерживает остальных.
+        blocked = []
+        for user_id in user_ids:
+            connection = self.active_connections.get(user_id)
+            if connection and not connection.offer(frame):
+                blocked.append(connection.put(frame))
+        if blocked:
+            await asyncio.gather(*blocked)
+
+    def add_user_to_group(self, user_id: int, group_id: int, group_name: Optional[str] = None):
         if user_id in self.user_groups:
             self.user_groups[user_id].add(group_id)
+            self.group_online.setdefault(group_id, set()).add(user_id)
+            if group_name is not None:
+                self.group_names[group_id] = group_name
 
     def remove_user_from_group(self, user_id: int, group_id: int):
         if user_id in self.user_groups and group_id in self.user_groups[user_id]:
             self.user_groups[user_id].remove(group_id)
+            self._discard_online(user_id, group_id)
+
+    def _discard_online(self, user_id: int, group_id: int):
+        members = self.group_online.get(group_id)
+        if members is None:
+            return
+        members.discard(user_id)
+        if not members:
+            del self.group_online[group_id]
+            self.group_names.pop(group_id, None)
+
+    async def group_members_added(self, user_ids: Iterable[int], group_id: int, group_name: str):
+        await self.backplane.publish({
+            "kind": "group_join", "user_ids": list(user_ids), "group_id": group_id, "group_name": group_name
+        })
+
+    async def group_members_removed(self, user_ids: Iterable[int], group_id: int):
+        await self.backplane.publish({"kind": "group_leave", "user_ids": list(user_ids), "group_id": group_id})
+
+    def _all_connections(self) -> Iterable[ClientConnection]:
+        yield from self.active_connections.values()
+        for connections in self.notification_connections.values():
+            yield from connections
+
+    async def _on_event(self, event: dict):
+        kind = event["kind"]
+        BACKPLANE_EVENTS.inc(kind=kind)
+        if kind == "group_join":
+            for user_id in event["user_ids"]:
+                self.add_user_to_group(user_id, event["group_id"], event["group_name"])
+        elif kind == "group_leave":
+            for user_id in event["user_ids"]:
+                self.remove_user_from_group(user_id, event["group_id"])
+        elif kind == "group":
+            # Буфер истории обновляют все процессы, поэтому событие разбирается
+            # до проверки, есть ли здесь получатели
+            history_cache.add(group_key(event["group_id"]), CachedMessage.from_dict(event["message"]))
+            recipients = [
+                member_id for member_id in self.group_online.get(event["group_id"], ())
+                if member_id != event["sender_id"]
+            ]
+            if not recipients:
+                return
+            # Уведомления пишет процесс, которому принадлежат сокеты получателей;
+            # при перегрузке они отбрасываются первыми, само сообщение доставляется
+            notify = not admission.shed_notifications(len(recipients))
+            if notify:
+                notifications = [
+                    NotificationDB(user_id=member_id, content=event["notification"], timestamp=datetime.utcnow())
+                    for member_id in recipients
+                ]
+                pipeline.submit(*notifications).add_done_callback(
+                    partial(self._notifications_stored, recipients, notifications)
+                )
+            FANOUT_RECIPIENTS.observe(len(recipients), kind=kind)
+            with FANOUT_SECONDS.time(kind=kind):
+                await self._broadcast(recipients, EncodedFrame(event["data"]))
+        elif kind == "unread":
+            notification_ids = event.get("notification_ids") or [None] * len(event["user_ids"])
+            for user_id, notification_id in zip(event["user_ids"], notification_ids):
+                self._adjust_unread(user_id, event["delta"], notification_id)
+        elif kind == "notifications":
+            # Одно событие на массовую операцию: кадр кодируется один раз
+            local = [user_id for user_id in event["user_ids"] if user_id in self.active_connections]
+            for user_id in event["user_ids"]:
+                self._adjust_unread(user_id, 1)
+            if local:
+                FANOUT_RECIPIENTS.observe(len(local), kind=kind)
+                with FANOUT_SECONDS.time(kind=kind):
+                    await self._broadcast(local, EncodedFrame(event["data"]))
+        else:
+            if kind == "personal":
+                message = CachedMessage.from_dict(event["message"])
+                history_cache.add(dm_key(message.sender_id, message.recipient_id), message)
+            # personal и notification: у получателя появилось одно непрочитанное уведомление
+            # (если его не отбросили при перегрузке)
+            if event.get("notified", True):
+                self._adjust_unread(event["user_id"], 1, event.get("notification_id"))
+            if event["user_id"] in self.active_connections:
+                with FANOUT_SECONDS.time(kind=kind):
+                    await self._send(event["user_id"], EncodedFrame(event["data"]))
+
+    def _notifications_stored(self, recipients: List[int], notifications: List[NotificationDB], future: asyncio.Future):
+        # Дельта публикуется после коммита, когда у строк уже есть id
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error("Failed to store notifications", exc_info=future.exception())
+            return
+        asyncio.create_task(self._publish_unread(recipients, 1, [row.id for row in notifications]))
 
-    async def send_personal_message(self, recipient_id: int, sender_id: int, message: str, db: Session):
+    def _username(self, user_id: int) -> Optional[str]:
+        connection = self.active_connections.get(user_id)
+        return connection.username if connection else None
+
+    async def send_personal_message(
+        self,
+        recipient_id: int,
+        sender_id: int,
+        message: str,
+        sender_name: Optional[str] = None,
+    ) -> MessageDB:
+        # Сессии вызывающего сюда не передаются: ожидание group commit
+        # не должно держать соединение пула
+        now = datetime.utcnow()
         db_message = MessageDB(
             content=message,
             sender_id=sender_id,
             recipient_id=recipient_id,
-            timestamp=datetime.utcnow()
+            timestamp=now
         )
-        db.add(db_message)
+        rows = [db_message]
+        notified = not admission.shed_notifications()
+        if notified:
+            rows.append(NotificationDB(
+                user_id=recipient_id,
+                content=f"New message from user {sender_id}",
+                timestamp=now
+            ))
+        await pipeline.write(*rows)
         
-        notification = NotificationDB(
-            user_id=recipient_id,
-            content=f"New message from user {sender_id}",
-            timestamp=datetime.utcnow()
-        )
-        db.add(notification)
-        db.commit()
+        sender_name = sender_name or self._username(sender_id) or f"User {sender_id}"
+        message_data = personal_message_data(db_message, sender_name)
+        await self.backplane.publish({
+            "kind": "personal",
+            "user_id": recipient_id,
+            "notified": notified,
+            "notification_id": rows[1].id if notified else None,
+            "message": CachedMessage.from_row(db_message).to_dict(),
+            "data": message_data,
+        })
         
-        if recipient_id in self.active_connections:
-            sender = db.query(UserDB).filter(UserDB.id == sender_id).first()
-            sender_name = sender.username if sender else f"User {sender_id}"
-            message_data = {
-                "type": "personal_message",
-                "sender_id": sender_id,
-                "sender_name": sender_name,
-                "content": message,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            await self.active_connections[recipient_id].send_text(json.dumps(message_data))
-
-    async def send_group_message(self, group_id: int, sender_id: int, message: str, db: Session):
-        group = db.query(GroupDB).filter(GroupDB.id == group_id).first()
-        if not group:
-            return
+        return db_message
+
+    async def send_group_message(
+        self,
+        group_id: int,
+        sender_id: int,
+        message: str,
+        sender_name: Optional[str] = None,
+        group_name: Optional[str] = None,
+    ) -> Optional[MessageDB]:
+        # Имя группы передаёт REST-обработчик (он уже проверил членство)
+        # или берётся из памяти: отправитель по /ws/chat онлайн в группе
+        group_name = group_name or self.group_names.get(group_id)
+        if group_name is None:
+            return None
+        sender_name = sender_name or self._username(sender_id) or f"User {sender_id}"
         
         db_message = MessageDB(
             content=message,
@@ -71,50 +446,53 @@ class ConnectionManager:
             group_id=group_id,
             timestamp=datetime.utcnow()
         )
-        db.add(db_message)
-        db.commit()
+        await pipeline.write(db_message)
         
-        sender = db.query(UserDB).filter(UserDB.id == sender_id).first()
-        sender_name = sender.username if sender else f"User {sender_id}"
-        
-        message_data = {
-            "type": "group_message",
+        message_data = group_message_data(db_message, group_name, sender_name)
+        await self.backplane.publish({
+            "kind": "group",
             "group_id": group_id,
-            "group_name": group.name,
             "sender_id": sender_id,
-            "sender_name": sender_name,
-            "content": message,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        
-        for member in group.members:
-            if member.id != sender_id and member.id in self.active_connections:
-                await self.active_connections[member.id].send_text(json.dumps(message_data))
-                
-                notification = NotificationDB(
-                    user_id=member.id,
-                    content=f"New message in group {group.name} from {sender_name}",
-                    timestamp=datetime.utcnow()
-                )
-                db.add(notification)
+            "notification": f"New message in group {group_name} from {sender_name}",
+            "message": CachedMessage.from_row(db_message).to_dict(),
+            "data": message_data,
+        })
         
-        db.commit()
+        return db_message
 
-    async def send_notification(self, user_id: int, content: str, db: Session):
+    async def send_notification(self, user_id: int, content: str):
         notification = NotificationDB(
             user_id=user_id,
             content=content,
             timestamp=datetime.utcnow()
         )
-        db.add(notification)
-        db.commit()
+        await pipeline.write(notification)
         
-        if user_id in self.active_connections:
-            notification_data = {
-                "type": "notification",
-                "content": content,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            await self.active_connections[user_id].send_text(json.dumps(notification_data))
+        await self.backplane.publish({
+            "kind": "notification",
+            "user_id": user_id,
+            "notification_id": notification.id,
+            "data": notification_data(content, notification.timestamp, notification.id),
+        })
+
+    async def send_bulk_notification(self, user_ids: List[int], content: str):
+        if not user_ids:
+            return
+        now = datetime.utcnow()
+        await pipeline.insert_many(
+            NotificationDB, [{"user_id": user_id, "content": content, "timestamp": now} for user_id in user_ids]
+        )
+        # Строки вставлены без RETURNING, поэтому в кадре нет id; курсор
+        # уведомлений клиент получает из ответа на sync
+        await self.backplane.publish({
+            "kind": "notifications", "user_ids": list(user_ids), "data": notification_data(content, now)
+        })
 
 manager = ConnectionManager()
+
+WS_CHAT_CONNECTIONS.set_function(lambda: len(manager.active_connections))
+WS_NOTIFICATION_CONNECTIONS.set_function(
+    lambda: sum(len(connections) for connections in manager.notification_connections.values())
+)
+WS_QUEUED_FRAMES.set_function(lambda: sum(c.queue.qsize() for c in manager._all_connections()))
+WS_QUEUE_DEPTH_MAX.set_function(lambda: max((c.queue.qsize() for c in manager._all_connections()), default=0))
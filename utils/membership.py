@@ -0,0 +1,25 @@
+from fastapi import HTTPException
+from sqlalchemy import exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import GroupDB, group_members
+
+
+def member_exists(group_id, user_id):
+    # EXISTS по уникальному индексу (group_id, user_id): одна строка индекса
+    # вместо загрузки всего списка участников
+    return exists().where(group_members.c.group_id == group_id, group_members.c.user_id == user_id)
+
+
+async def get_member_group(db: AsyncSession, group_id: int, user_id: int, *options) -> GroupDB:
+    # Группа и проверка членства одним запросом
+    result = await db.execute(
+        select(GroupDB, member_exists(GroupDB.id, user_id)).where(GroupDB.id == group_id).options(*options)
+    )
+    row = result.first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    group, is_member = row
+    if not is_member:
+        raise HTTPException(status_code=403, detail="Not a member of this group")
+    return group
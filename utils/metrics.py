@@ -0,0 +1,210 @@
+import math
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Минимальная реализация метрик в формате Prometheus: обновление — это
+# одно сложение в словаре, вся работа по форматированию идёт при чтении /metrics
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_function(self, function: Callable[[], float]):
+        # Счётчик, который уже ведётся где-то ещё (например, в кэше токенов)
+        self._function = function
+
+    def collect(self) -> List[str]:
+        values = {(): self._function()} if self._function else self._values
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # По каждому набору меток: счётчики корзин (без накопления), сумма, количество
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")
+)
+WS_CHAT_CONNECTIONS = registry.gauge("ws_chat_connections", "Open /ws/chat connections")
+WS_NOTIFICATION_CONNECTIONS = registry.gauge("ws_notification_connections", "Open /ws/notifications connections")
+WS_FRAMES_RECEIVED = registry.counter("ws_frames_received_total", "WebSocket frames received from clients")
+WS_FRAMES_SENT = registry.counter("ws_frames_sent_total", "WebSocket frames written to clients")
+WS_BYTES_SENT = registry.counter(
+    "ws_payload_sent_total", "WebSocket payload size written to clients (bytes for binary, characters for text)"
+)
+WS_FRAMES_DROPPED = registry.counter(
+    "ws_frames_dropped_total", "Outbound frames dropped by the overflow policy", ("policy",)
+)
+# Глубина очередей считается при чтении /metrics, а не на каждой постановке в очередь
+WS_QUEUED_FRAMES = registry.gauge("ws_outbound_queued_frames", "Frames waiting in all outbound queues")
+WS_QUEUE_DEPTH_MAX = registry.gauge("ws_outbound_queue_depth_max", "Deepest outbound queue of a single connection")
+FANOUT_SECONDS = registry.histogram(
+    "fanout_duration_seconds", "Time to enqueue one event for its local recipients", ("kind",)
+)
+FANOUT_RECIPIENTS = registry.histogram(
+    "fanout_recipients", "Local recipients per delivered event", ("kind",),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000),
+)
+DB_QUERY_SECONDS = registry.histogram("db_query_duration_seconds", "Database statement latency", ("engine",))
+DB_COMMIT_SECONDS = registry.histogram("db_commit_duration_seconds", "Session flush and commit latency")
+INGEST_BATCH_ROWS = registry.histogram(
+    "ingest_batch_rows", "Rows per write-pipeline commit", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+INGEST_QUEUE_DEPTH = registry.gauge("ingest_queue_depth", "Writes waiting for the write pipeline")
+PASSWORD_HASH_SECONDS = registry.histogram(
+    "password_hash_duration_seconds", "bcrypt hash/verify time in the worker thread", ("operation",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.5),
+)
+PASSWORD_IN_FLIGHT = registry.gauge("password_pool_in_flight", "bcrypt operations running or queued")
+PASSWORD_REJECTED = registry.counter("password_pool_rejected_total", "Logins rejected with 503 by the bcrypt pool")
+TOKEN_DECODES = registry.counter("token_decodes_total", "JWT decodes on token-cache misses")
+TOKEN_CACHE_HITS = registry.counter("token_cache_hits_total", "Token cache hits")
+TOKEN_CACHE_MISSES = registry.counter("token_cache_misses_total", "Token cache misses")
+TOKEN_CACHE_EVICTIONS = registry.counter("token_cache_evictions_total", "Token cache entries evicted by size")
+TOKEN_CACHE_ENTRIES = registry.gauge("token_cache_entries", "Tokens in the token cache")
+HISTORY_CACHE_HITS = registry.counter("history_cache_hits_total", "First history pages served from the ring buffers")
+HISTORY_CACHE_MISSES = registry.counter("history_cache_misses_total", "First history pages that loaded a buffer from the DB")
+HISTORY_CACHE_EVICTIONS = registry.counter("history_cache_evictions_total", "Conversation buffers evicted by size")
+HISTORY_CACHE_CONVERSATIONS = registry.gauge("history_cache_conversations", "Conversations with a history buffer")
+BACKPLANE_EVENTS = registry.counter("backplane_events_total", "Delivery events handled by this process", ("kind",))
+RETENTION_ARCHIVED = registry.counter(
+    "retention_archived_messages_total", "Messages moved to messages_archive by the retention job", ("scope",)
+)
+RETENTION_NOTIFICATIONS_DELETED = registry.counter(
+    "retention_notifications_deleted_total", "Read notifications deleted by the retention job"
+)
+RETENTION_VACUUM_PAGES = registry.counter(
+    "retention_vacuum_pages_total", "Free pages returned to the file system by incremental vacuum"
+)
+WS_ADMISSION_REJECTED = registry.counter(
+    "ws_admission_rejected_total", "Inbound /ws/chat events rejected with an error frame", ("reason",)
+)
+OVERLOAD_LEVEL = registry.gauge("overload_level", "0 normal, 1 shedding notifications, 2 rejecting messages")
+OVERLOAD_SHED = registry.counter("overload_shed_total", "Low-priority work skipped in overload mode", ("work",))
+WS_HEARTBEAT_PINGS = registry.counter("ws_heartbeat_pings_total", "Application-level pings sent to silent connections")
+WS_REAPED = registry.counter("ws_reaped_connections_total", "Connections closed or evicted by the reaper", ("reason",))
@@ -0,0 +1,104 @@
+import base64
+import binascii
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ArchivedMessageDB, MessageDB
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_token(raw: str) -> str:
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_token(token: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    return encode_token(f"{timestamp.isoformat()}|{row_id}")
+
+
+def decode_cursor(token: str) -> Tuple[datetime, int]:
+    try:
+        timestamp, row_id = decode_token(token).rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def row_cursor(row) -> str:
+    return encode_cursor(row.timestamp, row.id)
+
+
+def across_tiers(build) -> list:
+    # Старые сообщения лежат в messages_archive (utils/retention.py): одни и те же
+    # запросы строятся для обеих таблиц, горячая идёт первой, а fetch_page
+    # сливает их по (timestamp, id)
+    return build(MessageDB) + build(ArchivedMessageDB)
+
+
+async def fetch_page(
+    db: AsyncSession,
+    model,
+    queries: list,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+):
+    # Каждый запрос страницы — это диапазон по индексу (..., timestamp, id)
+    # с LIMIT, поэтому его стоимость не зависит от длины переписки.
+    # Несколько запросов (например, входящие и исходящие) сливаются в памяти.
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both")
+
+    forward = after is not None
+    rows: List = []
+    for query in queries:
+        # Запросы могут идти к разным таблицам с одинаковыми колонками (горячая и архив)
+        table = query.column_descriptions[0]["entity"] or model
+        # Архив хранит только то, что старше горячей таблицы: если горячие
+        # запросы уже дали больше limit строк, листание назад до архива не дойдёт
+        if table is ArchivedMessageDB and not forward and len(rows) > limit:
+            continue
+        key = tuple_(table.timestamp, table.id)
+        if forward:
+            query = query.where(key > tuple_(*decode_cursor(after))).order_by(table.timestamp, table.id)
+        else:
+            if before:
+                query = query.where(key < tuple_(*decode_cursor(before)))
+            query = query.order_by(table.timestamp.desc(), table.id.desc())
+        result = await db.execute(query.limit(limit + 1))
+        rows.extend(result.scalars().all())
+
+    rows.sort(key=lambda row: (row.timestamp, row.id), reverse=not forward)
+    has_more = len(rows) > limit
+    items = rows[:limit]
+    if not forward:
+        items.reverse()
+
+    return {
+        "items": items,
+        "has_more": has_more,
+        "before": row_cursor(items[0]) if items else before,
+        "after": row_cursor(items[-1]) if items else after,
+    }
+
+
+async def fetch_message_page(
+    db: AsyncSession,
+    queries: list,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+):
+    return await fetch_page(db, MessageDB, queries, before, after, limit)
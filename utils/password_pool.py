@@ -0,0 +1,50 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from fastapi import HTTPException, status
+
+import config
+from utils.metrics import PASSWORD_HASH_SECONDS, PASSWORD_IN_FLIGHT, PASSWORD_REJECTED
+
+
+class PasswordPool:
+    # bcrypt занимает сотни миллисекунд CPU и отпускает GIL, поэтому хеширование
+    # и проверка паролей выполняются в отдельном пуле потоков. Если очередь
+    # переполнена, запрос сразу получает 503 вместо бесконечного ожидания.
+
+    def __init__(self, workers: int = config.PASSWORD_WORKERS, max_queue: int = config.PASSWORD_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    async def run(self, fn: Callable, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication is overloaded, retry later",
+                headers={"Retry-After": "1"},
+            )
+        self.in_flight += 1
+        try:
+            result, elapsed = await asyncio.get_running_loop().run_in_executor(self._executor, _timed, fn, *args)
+        finally:
+            self.in_flight -= 1
+        # Время самой операции в потоке, без ожидания в очереди пула
+        PASSWORD_HASH_SECONDS.observe(elapsed, operation=fn.__name__)
+        return result
+
+
+def _timed(fn: Callable, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+password_pool = PasswordPool()
+PASSWORD_IN_FLIGHT.set_function(lambda: password_pool.in_flight)
+PASSWORD_REJECTED.set_function(lambda: password_pool.rejected)
@@ -0,0 +1,68 @@
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+# Семплирующий профилировщик: отдельный поток периодически снимает стек
+# потока с циклом событий и считает свёрнутые стеки (формат flamegraph.pl /
+# speedscope). Сам цикл событий ничего не делает, поэтому профилировщик
+# можно включать на работающем сервере.
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self.samples: Counter = Counter()
+        self.interval = 0.0
+        self.started_at: Optional[float] = None
+        self._target: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float, thread_id: Optional[int] = None):
+        if self.running:
+            raise RuntimeError("Profiler is already running")
+        self.samples.clear()
+        self.interval = interval
+        self.started_at = time.time()
+        self._target = thread_id if thread_id is not None else threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.folded()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def status(self) -> Dict:
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "started_at": self.started_at,
+            "samples": sum(self.samples.values()),
+        }
+
+
+profiler = SamplingProfiler()
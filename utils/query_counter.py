@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+from typing import List
+
+from sqlalchemy import event
+
+import database
+
+# Подсчёт SQL-запросов в блоке кода: ловит N+1 при проверке эндпоинтов
+
+
+class QueryCounter:
+    def __init__(self, *engines):
+        self.engines = engines or (database.engine, database.read_engine)
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self) -> "QueryCounter":
+        for engine in self.engines:
+            event.listen(engine.sync_engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        for engine in self.engines:
+            event.remove(engine.sync_engine, "before_cursor_execute", self._record)
+
+
+@contextmanager
+def assert_max_queries(limit: int, *engines):
+    with QueryCounter(*engines) as counter:
+        yield counter
+    if counter.count > limit:
+        statements = "\n".join(f"    {' '.join(statement.split())}" for statement in counter.statements)
+        raise AssertionError(f"Expected at most {limit} SQL statements, got {counter.count}:\n{statements}")
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import logging
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, insert, select
+
+import config
+from database import engine
+from models import ArchivedMessageDB, MessageDB, NotificationDB
+from utils import search
+from utils.metrics import RETENTION_ARCHIVED, RETENTION_NOTIFICATIONS_DELETED, RETENTION_VACUUM_PAGES
+
+logger = logging.getLogger(__name__)
+
+# Хранение истории. Сообщения старше срока своей политики переезжают
+# из messages в messages_archive с прежними id (история и выгрузка читают обе
+# таблицы, поиск — только горячую), прочитанные уведомления старше
+# NOTIFICATION_RETENTION_DAYS удаляются, освободившиеся страницы возвращаются
+# файловой системе через PRAGMA incremental_vacuum.
+#
+# Вся работа идёт короткими транзакциями по RETENTION_CHUNK_SIZE строк
+# с паузой между ними: у писателя одно соединение, и конвейер записи
+# живых сообщений ждёт не дольше одной порции.
+
+_COLUMNS = ("id", "content", "sender_id", "group_id", "recipient_id", "timestamp")
+
+
+def _days(value, name: str) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise ValueError(f"Retention for {name} must be a positive number of days or null")
+    return float(value)
+
+
+@dataclass
+class RetentionPolicy:
+    # Сроки в днях; None — хранить всегда
+    dm: Optional[float] = None
+    groups: Optional[float] = None
+    group_overrides: Dict[int, Optional[float]] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, raw: str) -> "RetentionPolicy":
+        data = json.loads(raw or "{}")
+        if not isinstance(data, dict):
+            raise ValueError("RETENTION_POLICIES must be a JSON object")
+        overrides = data.get("group_overrides") or {}
+        if not isinstance(overrides, dict):
+            raise ValueError("group_overrides must map group ids to days")
+        return cls(
+            dm=_days(data.get("dm"), "dm"),
+            groups=_days(data.get("groups"), "groups"),
+            group_overrides={
+                int(group_id): _days(days, f"group {group_id}") for group_id, days in overrides.items()
+            },
+        )
+
+    def scopes(self) -> List[tuple]:
+        # (метка для метрик, условия WHERE, срок в днях)
+        scopes = [
+            ("group", [MessageDB.group_id == group_id], days)
+            for group_id, days in self.group_overrides.items()
+        ]
+        default_groups = [MessageDB.group_id.isnot(None)]
+        if self.group_overrides:
+            default_groups.append(MessageDB.group_id.notin_(list(self.group_overrides)))
+        scopes.append(("group", default_groups, self.groups))
+        scopes.append(("dm", [MessageDB.group_id.is_(None)], self.dm))
+        return [scope for scope in scopes if scope[2] is not None]
+
+
+class RetentionJob:
+    # Фоновая задача по образцу WritePipeline: start/stop из main.py,
+    # run_once() можно вызвать напрямую (CLI, скрипты)
+
+    def __init__(
+        self,
+        policy: Optional[RetentionPolicy] = None,
+        interval: float = config.RETENTION_INTERVAL,
+        chunk_size: int = config.RETENTION_CHUNK_SIZE,
+        pause: float = config.RETENTION_PAUSE,
+        notification_days: float = config.NOTIFICATION_RETENTION_DAYS,
+        vacuum_step: int = config.VACUUM_STEP_PAGES,
+    ):
+        self.policy = policy if policy is not None else RetentionPolicy.parse(config.RETENTION_POLICIES)
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.notification_days = notification_days
+        self.vacuum_step = vacuum_step
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Retention run failed")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        now = now or datetime.utcnow()
+        stats = {"archived": 0, "notifications": 0, "vacuum_pages": 0}
+        for scope, conditions, days in self.policy.scopes():
+            stats["archived"] += await self._archive(scope, conditions, now - timedelta(days=days))
+        if self.notification_days > 0:
+            stats["notifications"] = await self._delete_notifications(now - timedelta(days=self.notification_days))
+        stats["vacuum_pages"] = await self._vacuum()
+        logger.info(
+            "Retention: %(archived)d messages archived, %(notifications)d notifications deleted, "
+            "%(vacuum_pages)d pages vacuumed", stats,
+        )
+        return stats
+
+    async def _archive(self, scope: str, conditions: list, cutoff: datetime) -> int:
+        # Последнее сообщение никогда не переносится: SQLite без AUTOINCREMENT
+        # выдаёт новый id как max(id) + 1 и после его удаления повторил бы id,
+        # уже лежащий в архиве
+        newest = select(func.max(MessageDB.id)).scalar_subquery()
+        total = 0
+        while True:
+            async with engine.begin() as connection:
+                result = await connection.execute(
+                    select(MessageDB.id, MessageDB.content)
+                    .where(*conditions, MessageDB.timestamp < cutoff, MessageDB.id < newest)
+                    .order_by(MessageDB.timestamp)
+                    .limit(self.chunk_size)
+                )
+                rows = result.all()
+                if not rows:
+                    return total
+                ids = [row.id for row in rows]
+                columns = [getattr(MessageDB, name) for name in _COLUMNS]
+                await connection.execute(
+                    insert(ArchivedMessageDB).from_select(
+                        list(_COLUMNS), select(*columns).where(MessageDB.id.in_(ids))
+                    )
+                )
+                # Внешнее содержимое FTS5: удаление из индекса требует прежний текст
+                await connection.run_sync(search.remove_from_index, [tuple(row) for row in rows])
+                await connection.execute(delete(MessageDB).where(MessageDB.id.in_(ids)))
+            total += len(rows)
+            RETENTION_ARCHIVED.inc(len(rows), scope=scope)
+            await asyncio.sleep(self.pause)
+
+    async def _delete_notifications(self, cutoff: datetime) -> int:
+        # Как и в _archive, последняя строка остаётся: иначе её id выдался бы
+        # заново, а по max(id) счётчики непрочитанных отсекают учтённые уведомления
+        newest = select(func.max(NotificationDB.id)).scalar_subquery()
+        total = 0
+        while True:
+            chunk = (
+                select(NotificationDB.id)
+                .where(NotificationDB.is_read == True, NotificationDB.timestamp < cutoff, NotificationDB.id < newest)
+                .limit(self.chunk_size)
+            )
+            async with engine.begin() as connection:
+                result = await connection.execute(delete(NotificationDB).where(NotificationDB.id.in_(chunk)))
+            if not result.rowcount:
+                return total
+            total += result.rowcount
+            RETENTION_NOTIFICATIONS_DELETED.inc(result.rowcount)
+            await asyncio.sleep(self.pause)
+
+    async def _vacuum(self) -> int:
+        # Без auto_vacuum=INCREMENTAL освобождённые страницы остаются в файле
+        # до полного VACUUM (см. enable-incremental-vacuum ниже)
+        if engine.dialect.name != "sqlite":
+            return 0
+        total = 0
+        while True:
+            async with engine.connect() as connection:
+                mode = (await connection.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+                free = (await connection.exec_driver_sql("PRAGMA freelist_count")).scalar()
+                if mode != 2 or not free:
+                    return total
+                step = min(free, self.vacuum_step)
+                # Модуль sqlite3 делает в execute() один шаг PRAGMA, то есть освобождает
+                # одну страницу; executescript выполняет её до конца
+                raw = await connection.get_raw_connection()
+                await raw.driver_connection.executescript(f"PRAGMA incremental_vacuum({step})")
+            total += step
+            RETENTION_VACUUM_PAGES.inc(step)
+            await asyncio.sleep(self.pause)
+
+
+retention = RetentionJob()
+
+
+async def _run_once():
+    # init_db включает ведение индекса поиска, иначе архивные строки остались бы в нём
+    from database import init_db, close_db
+    try:
+        await init_db()
+        print(await retention.run_once())
+    finally:
+        await close_db()
+
+
+async def _enable_incremental_vacuum():
+    # Режим auto_vacuum существующего файла меняется только полным VACUUM:
+    # он переписывает всю базу и держит её заблокированной, запускать в окно обслуживания
+    from database import close_db
+    try:
+        async with engine.connect() as connection:
+            connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+            await connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            await connection.exec_driver_sql("VACUUM")
+            mode = (await connection.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+        print(f"auto_vacuum={mode}")
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    # python -m utils.retention run | enable-incremental-vacuum
+    commands = {"run": _run_once, "enable-incremental-vacuum": _enable_incremental_vacuum}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        print("usage: python -m utils.retention run|enable-incremental-vacuum")
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(commands[sys.argv[1]]())
@@ -0,0 +1,165 @@
+import asyncio
+import sys
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import bindparam, event, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import MessageDB
+from utils.pagination import DEFAULT_PAGE_SIZE, encode_token, decode_token
+
+FTS_TABLE = "messages_fts"
+
+# Индекс ведётся только после того, как init_db убедился, что таблица FTS5 есть
+_enabled = False
+
+
+def create_index(connection) -> bool:
+    # Внешнее содержимое: FTS5 хранит только индекс, текст берётся из messages
+    global _enabled
+    if connection.dialect.name != "sqlite":
+        _enabled = False
+        return False
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    ).first()
+    if not exists:
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            f"content, content='messages', content_rowid='id', tokenize='unicode61')"
+        )
+    # Индекс с внешним содержимым сам не заполняется: сообщения, записанные
+    # до его появления (или прежним init_db, создававшим пустой индекс),
+    # добавляются в той же транзакции
+    indexed = connection.exec_driver_sql(f"SELECT count(*) FROM {FTS_TABLE}_docsize").scalar()
+    stored = connection.exec_driver_sql("SELECT count(*) FROM messages").scalar()
+    if indexed != stored:
+        connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')")
+    _enabled = True
+    return True
+
+
+def rebuild_index(connection):
+    create_index(connection)
+    connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')")
+
+
+def remove_from_index(connection, rows):
+    # rows — пары (id, content) сообщений, которые удаляются из messages.
+    # 'delete' строки, которой нет в индексе, портит индекс с внешним содержимым
+    # (database disk image is malformed), поэтому удаляются только строки
+    # из теневой таблицы messages_fts_docsize — по строке на проиндексированное сообщение
+    if not _enabled or not rows:
+        return
+    indexed = set(connection.execute(
+        text(f"SELECT id FROM {FTS_TABLE}_docsize WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+        {"ids": [row_id for row_id, _ in rows]},
+    ).scalars())
+    rows = [row for row in rows if row[0] in indexed]
+    if not rows:
+        return
+    connection.execute(
+        text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES('delete', :id, :content)"),
+        [{"id": row_id, "content": content or ""} for row_id, content in rows],
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _sync_index(session, flush_context):
+    # Любая запись MessageDB через ORM (конвейер, роутеры, скрипты) обновляет
+    # индекс в той же транзакции
+    if not _enabled:
+        return
+    added = [obj for obj in session.new if isinstance(obj, MessageDB)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, MessageDB)]
+    if not added and not deleted:
+        return
+    connection = session.connection()
+    remove_from_index(connection, [(obj.id, obj.content) for obj in deleted])
+    if added:
+        connection.execute(
+            text(f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES(:id, :content)"),
+            [{"id": obj.id, "content": obj.content or ""} for obj in added],
+        )
+
+
+def _match_expression(query: str) -> str:
+    # Каждое слово — отдельная фраза в кавычках, чтобы ввод пользователя
+    # не интерпретировался как синтаксис FTS5
+    terms = [term.replace('"', '""') for term in query.split()]
+    return " ".join(f'"{term}"' for term in terms if term)
+
+
+async def search_messages(
+    db: AsyncSession,
+    user_id: int,
+    query: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+):
+    if not _enabled:
+        raise HTTPException(status_code=501, detail="Full-text search is not available on this database")
+    match = _match_expression(query)
+    if not match:
+        raise HTTPException(status_code=400, detail="Empty search query")
+
+    params = {"match": match, "user_id": user_id, "limit": limit + 1}
+    after_clause = ""
+    if cursor:
+        try:
+            rank, row_id = decode_token(cursor).split("|")
+            params["rank"], params["row_id"] = float(rank), int(row_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        after_clause = "AND (hits.rank > :rank OR (hits.rank = :rank AND m.id > :row_id))"
+
+    # Сначала ранжируются совпадения FTS, затем они ограничиваются
+    # переписками пользователя: его личными сообщениями и его группами
+    result = await db.execute(text(f"""
+        WITH hits AS (
+            SELECT rowid AS id, bm25({FTS_TABLE}) AS rank
+            FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match
+        )
+        SELECT m.id, hits.rank FROM hits JOIN messages m ON m.id = hits.id
+        WHERE (
+            (m.group_id IS NULL AND (m.sender_id = :user_id OR m.recipient_id = :user_id))
+            OR m.group_id IN (SELECT group_id FROM group_members WHERE user_id = :user_id)
+        ) {after_clause}
+        ORDER BY hits.rank, m.id
+        LIMIT :limit
+    """), params)
+    hits = result.all()
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+
+    messages = {}
+    if hits:
+        rows = await db.scalars(select(MessageDB).where(MessageDB.id.in_([row_id for row_id, _ in hits])))
+        messages = {message.id: message for message in rows}
+    items: List = [messages[row_id] for row_id, _ in hits if row_id in messages]
+
+    return {
+        "items": items,
+        "has_more": has_more,
+        "next": encode_token(f"{hits[-1][1]!r}|{hits[-1][0]}") if has_more else None,
+    }
+
+
+async def _rebuild():
+    from database import engine
+    async with engine.begin() as connection:
+        if connection.dialect.name != "sqlite":
+            print("Full-text index is only available for SQLite")
+            return
+        await connection.run_sync(rebuild_index)
+    print(f"{FTS_TABLE} rebuilt")
+
+
+if __name__ == "__main__":
+    # python -m utils.search rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        print("usage: python -m utils.search rebuild")
+        sys.exit(2)
+    asyncio.run(_rebuild())
@@ -0,0 +1,128 @@
+from typing import Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from database import ReadSessionLocal
+from models import GroupDB, MessageDB, NotificationDB, UserDB
+from utils.connection import ClientConnection
+from utils.frames import EncodedFrame
+from utils.manager import group_message_data, notification_data, personal_message_data
+
+# Досылка пропущенного при переподключении. Клиент присылает
+# {"type": "sync", "after": <id последнего сообщения>, "notifications_after": <id уведомления>},
+# сервер отдаёт те же кадры, что пришли бы вживую, по порядку id, и завершает
+# ответ кадром sync_done с новыми курсорами. Запросы идут по индексам
+# (recipient_id, id), (group_id, id) и (user_id, id), поэтому стоимость
+# зависит от числа пропущенного, а не от размера истории.
+#
+# id выдаются при коммите единственным писателем, поэтому порядок id совпадает
+# с порядком доставки. Живые события, пришедшие во время досылки, идут
+# вперемешку с ней; клиент отбрасывает дубликаты по id.
+
+
+async def _messages_after(
+    db: AsyncSession, user_id: int, group_ids: List[int], after: int, limit: int
+) -> List[dict]:
+    personal = await db.execute(
+        select(MessageDB, UserDB.username)
+        .join(UserDB, UserDB.id == MessageDB.sender_id)
+        .where(MessageDB.recipient_id == user_id, MessageDB.id > after)
+        .order_by(MessageDB.id)
+        .limit(limit)
+    )
+    frames = [
+        personal_message_data(message, sender_name or f"User {message.sender_id}")
+        for message, sender_name in personal.all()
+    ]
+    if group_ids:
+        grouped = await db.execute(
+            select(MessageDB, GroupDB.name, UserDB.username)
+            .join(GroupDB, GroupDB.id == MessageDB.group_id)
+            .join(UserDB, UserDB.id == MessageDB.sender_id)
+            .where(MessageDB.group_id.in_(group_ids), MessageDB.id > after, MessageDB.sender_id != user_id)
+            .order_by(MessageDB.id)
+            .limit(limit)
+        )
+        frames += [
+            group_message_data(message, group_name, sender_name or f"User {message.sender_id}")
+            for message, group_name, sender_name in grouped.all()
+        ]
+    frames.sort(key=lambda frame: frame["id"])
+    return frames[:limit]
+
+
+async def _notifications_after(db: AsyncSession, user_id: int, after: int, limit: int) -> List[dict]:
+    result = await db.execute(
+        select(NotificationDB)
+        .where(NotificationDB.user_id == user_id, NotificationDB.id > after)
+        .order_by(NotificationDB.id)
+        .limit(limit)
+    )
+    return [
+        notification_data(notification.content, notification.timestamp, notification.id)
+        for notification in result.scalars().all()
+    ]
+
+
+async def _stream(connection: ClientConnection, fetch, after: int, batch_size: int, max_items: int):
+    # Пачка читается короткой сессией и ставится в очередь соединения только
+    # когда для неё есть место: медленный клиент тормозит досылку, а не вытесняет
+    # живые события. Возвращает новый курсор и признак, что упёрлись в лимит.
+    sent = 0
+    while sent < max_items and not connection.closed:
+        limit = min(batch_size, max_items - sent)
+        async with ReadSessionLocal() as db:
+            frames = await fetch(db, after, limit)
+        if not frames:
+            return after, False
+        await connection.wait_for_room(len(frames))
+        for frame in frames:
+            connection.offer(EncodedFrame(frame))
+        after = frames[-1]["id"]
+        sent += len(frames)
+        if len(frames) < limit:
+            return after, False
+    return after, sent >= max_items
+
+
+def _cursor(value) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError("Sync cursors must be non-negative integers")
+    return value
+
+
+async def sync_missed(
+    connection: ClientConnection,
+    user_id: int,
+    group_ids: Iterable[int],
+    after,
+    notifications_after=None,
+    limit=None,
+):
+    after, notifications_after = _cursor(after) or 0, _cursor(notifications_after)
+    max_items = min(_cursor(limit) or config.SYNC_MAX_MESSAGES, config.SYNC_MAX_MESSAGES)
+    # Часть очереди остаётся под живые события
+    batch_size = max(1, min(config.SYNC_BATCH_SIZE, connection.queue.maxsize // 2))
+    group_ids = list(group_ids)
+
+    async def fetch_messages(db, cursor, count):
+        return await _messages_after(db, user_id, group_ids, cursor, count)
+
+    async def fetch_notifications(db, cursor, count):
+        return await _notifications_after(db, user_id, cursor, count)
+
+    after, more = await _stream(connection, fetch_messages, after, batch_size, max_items)
+    done = {"type": "sync_done", "after": after, "more": more}
+    # Уведомления досылаются, только если клиент прислал их курсор
+    if notifications_after is not None:
+        notifications_after, notifications_more = await _stream(
+            connection, fetch_notifications, notifications_after, batch_size, max_items
+        )
+        done["notifications_after"] = notifications_after
+        done["more"] = more or notifications_more
+    await connection.wait_for_room(1)
+    connection.offer(EncodedFrame(done))
@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+
+import config
+
+
+@dataclass(frozen=True)
+class UserPrincipal:
+    # Лёгкая замена UserDB для аутентифицированных запросов: без сессии и связей
+    id: int
+    username: str
+    email: Optional[str] = None
+
+    @classmethod
+    def from_user(cls, user) -> "UserPrincipal":
+        return cls(id=user.id, username=user.username, email=user.email)
+
+
+class TokenCache:
+    def __init__(self, max_size: int = config.TOKEN_CACHE_SIZE, ttl: float = config.TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[UserPrincipal, float]]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+
+    def get(self, token: str) -> Optional[UserPrincipal]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        principal, expires_at = entry
+        if expires_at <= time.time():
+            self._remove(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return principal
+
+    def put(self, token: str, principal: UserPrincipal, token_exp: Optional[float] = None):
+        # Запись живёт не дольше TTL и не дольше срока действия самого токена
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        if token in self._entries:
+            self._remove(token)
+        self._entries[token] = (principal, expires_at)
+        self._tokens_by_user.setdefault(principal.id, set()).add(token)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate_user(self, user_id: int):
+        for token in list(self._tokens_by_user.get(user_id, ())):
+            self._remove(token)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, token: str):
+        principal, _ = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(principal.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[principal.id]